@@ -1,17 +1,22 @@
+import os
+
 from flask import Flask
-from east.database import EastSqliteDatabase
+from east.database import EastSqliteDatabase, GroupCommitWriter
 
 app = Flask(__name__)
 app.config.from_pyfile('config.py')
+if os.environ.get('BITBOARD_CONFIG'):
+    app.config.from_pyfile('config_%s.py' % os.environ['BITBOARD_CONFIG'])
 
 db = EastSqliteDatabase(app.config['DATABASE'])
+writer = GroupCommitWriter(db) if app.config['DATABASE_GROUP_COMMIT'] else None
 
 from east import East
 from east.security import JWT
 from app.models import User
 
-jwt = JWT(app, lambda payload: User.get(User.id == payload['user_id']))
-east = East(app)
+jwt = JWT(app, lambda payload: User.active.get(payload['user_id']))
+east = East(app, database=db)
 
 from app.handlers import *
-from app.views import *
\ No newline at end of file
+from app.views import *
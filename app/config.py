@@ -14,6 +14,63 @@ STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), './stat
 JWT_EXPIRATION_DELTA = datetime.timedelta(days=30)
 
 DATABASE = 'store.db'
+# Group commit pays off with many request threads per process (eg. under the
+# ASGI adapter), not with single-threaded prefork workers
+DATABASE_GROUP_COMMIT = False
+
+CATEGORY_CACHE_SIZE = 10000
+CATEGORY_CACHE_TTL = 5
+
+MULTI_GET_MAX_IDS = 100
+BOARD_MAX_RECENT_NOTES = 50
+
+RATE_LIMIT_AUTH = (10, 60)
+RATE_LIMIT_EXPENSIVE = (60, 60)
+# Seconds a request waits for an identical one in flight to share its response -
+# only requests served by the same process (SERVER_THREADS of a worker) are shared
+COALESCE_WAIT = 5.0
+# Seconds the queries of an expensive request may take, before they are
+# interrupted so that they don't hold a worker and the read lock
+QUERY_TIMEOUT = 2.0
+
+JOBS_WORKERS = 2
+JOBS_POLL_INTERVAL = 1.0
+
+DELETION_BATCH_SIZE = 500
+DELETION_PAUSE = 0.05
+
+EVENTS_BACKEND = 'local'
+EVENTS_BUFFER_SIZE = 256
+EVENTS_HEARTBEAT = 15
+EVENTS_POLL_INTERVAL = 0.5
+# Open event streams per process - each holds a server thread while it is
+# open, so this must stay below SERVER_THREADS
+EVENTS_MAX_STREAMS = 4
+
+SERVER_HOST = '0.0.0.0'
+SERVER_PORT = 5000
+SERVER_WORKERS = 2
+SERVER_THREADS = 8
+SERVER_MAX_REQUESTS = 0
+SERVER_GRACEFUL_TIMEOUT = 30
+
+LOG_FILE = 'requests.log'
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+LOG_SAMPLE_RATE = 0.1
 
 EAST_GENERATE_API_DOCS = False
 EAST_API_DOCS_LOCATION = 'docs/docs.html'
+EAST_COLLECT_METRICS = True
+# Bearer token required by the metrics endpoint, None leaves it open to anyone
+EAST_METRICS_TOKEN = None
+EAST_COMPRESS_RESPONSES = True
+EAST_COMPRESS_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+EAST_COMPRESS_MIN_SIZE = 512
+EAST_ASYNC_POOL_SIZE = 16
+EAST_RATE_LIMIT = (600, 60)
+EAST_MAX_CONCURRENT_REQUESTS = 64
+EAST_PROFILE_REQUESTS = False
+EAST_PROFILE_SAMPLE_RATE = 0.01
+EAST_PROFILE_THRESHOLD = 1.0
+EAST_PROFILE_DIR = 'profiles'
@@ -0,0 +1,21 @@
+# Production profile, loaded on top of config.py when BITBOARD_CONFIG=production
+
+import os
+
+DEBUG = False
+TESTING = False
+
+LOG_SAMPLE_RATE = 0.01
+
+# Workers are separate processes, they share events through the change log
+EVENTS_BACKEND = 'changelog'
+EVENTS_MAX_STREAMS = 8
+
+SERVER_WORKERS = None
+SERVER_THREADS = 16
+SERVER_MAX_REQUESTS = 10000
+
+# Metrics are served only to scrapers presenting BITBOARD_METRICS_TOKEN, and
+# are not collected at all without one
+EAST_METRICS_TOKEN = os.environ.get('BITBOARD_METRICS_TOKEN')
+EAST_COLLECT_METRICS = EAST_METRICS_TOKEN is not None
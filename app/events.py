@@ -0,0 +1,90 @@
+import threading
+
+from east.events import Event, EventBroker, LocalBackend
+
+from app import app, db
+from app.models import ChangeLog
+
+
+class ChangeLogBackend:
+    """
+    Cross-process event backend reading changes from the `ChangeLog` table
+
+    Write endpoints log every change in the same transaction as the change
+    itself, so the log already holds all the events - each process polls it
+    for rows newer than the last one it has seen, and replays clients' missed
+    events from it. Publishing only wakes up the local poller early.
+    """
+
+    def __init__(self, interval=0.5, batch_size=500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._deliver = None
+        self._last_id = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def attach(self, deliver):
+        self._deliver = deliver
+
+    def watch(self, channel):
+        self._ensure_poller()
+
+    def publish(self, channel, event):
+        if self._poller is not None and self._poller.is_alive():
+            self._wakeup.set()
+
+    def replay(self, channel, last_event_id):
+        return [_change_event(change) for change in
+                ChangeLog.select().where((ChangeLog.owner == channel) &
+                                         (ChangeLog.id > last_event_id))
+                .order_by(ChangeLog.id).limit(self.batch_size)]
+
+    def _ensure_poller(self):
+        # Started by the first subscription rather than on import, as the poller
+        # thread wouldn't survive the fork of a prefork server's workers
+        if self._poller is not None and self._poller.is_alive():
+            return
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._last_id = ChangeLog.select(ChangeLog.id).order_by(ChangeLog.id.desc()).scalar() or 0
+                self._poller = threading.Thread(target=self._poll_loop, name='bitboard-events',
+                                                daemon=True)
+                self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                changes = list(ChangeLog.select().where(ChangeLog.id > self._last_id)
+                               .order_by(ChangeLog.id).limit(self.batch_size))
+            except Exception:
+                continue
+            finally:
+                if not db.is_closed():
+                    db.close()
+            for change in changes:
+                self._deliver(change.owner, _change_event(change))
+                self._last_id = change.id
+            if len(changes) == self.batch_size:
+                self._wakeup.set()
+
+
+def _change_event(change):
+    return Event(change.id, 'change', {'type': change.kind, 'id': change.object_id,
+                                       'deleted': change.deleted})
+
+
+events = EventBroker(ChangeLogBackend(app.config['EVENTS_POLL_INTERVAL'])
+                     if app.config['EVENTS_BACKEND'] == 'changelog' else LocalBackend(),
+                     buffer_size=app.config['EVENTS_BUFFER_SIZE'],
+                     heartbeat=app.config['EVENTS_HEARTBEAT'],
+                     max_subscriptions=app.config['EVENTS_MAX_STREAMS'])
+
+
+def publish_change(owner, kind, object_id, token, deleted=False):
+    """Notify `owner`'s subscribers of a change logged with `token`"""
+    events.publish(owner.id, 'change', {'type': kind, 'id': object_id, 'deleted': deleted},
+                   id=token)
@@ -1,52 +1,71 @@
-import logging
-import traceback
+from time import perf_counter
 
 import peewee
 
-from flask import request
+from flask import g, request
 from east.exceptions import *
+from east.helpers import response_size
+from east.logger import StructuredLogger
+from east.security import active_user
 
-from app import app, db
+from app import app
 
-print('TESTING')
-class DummyLogger:
-    def log(self, *args):
-        pass
-    def error(self, *args):
-        pass
-logger = DummyLogger()
-#    logger = logging.getLogger(__name__)
+
+logger = StructuredLogger(app.config['LOG_FILE'],
+                          queue_size=app.config['LOG_QUEUE_SIZE'],
+                          batch_size=app.config['LOG_BATCH_SIZE'],
+                          sample_rate=app.config['LOG_SAMPLE_RATE'])
+
+
+@app.before_request
+def start_request_log():
+    g.log_started = perf_counter()
+    g.log_error = None
+
+
+@app.after_request
+def log_request(response):
+    user = active_user()
+    logger.request(error=g.get('log_error') is not None or response.status_code >= 500,
+                   method=request.method, path=request.path,
+                   endpoint=request.endpoint, status=response.status_code,
+                   duration=round(perf_counter() - g.get('log_started', perf_counter()), 6),
+                   size=response_size(response), user_id=user.id if user is not None else None,
+                   remote_addr=request.remote_addr, error_info=g.get('log_error'))
+    return response
+
+
+def _log_error(name, description, exc=None):
+    g.log_error = {'name': name, 'description': description}
+    if exc is not None:
+        logger.error('exception', exc=exc, method=request.method, path=request.path)
 
 
 @app.errorhandler(BaseAPIException)
 def handle_api_errors(e):
-    logger.error('API Exception <%s>:: %s', e.name, e.description)
-    db.rollback()
+    _log_error(e.name, e.description)
     return e.make_response()
 
 
 @app.errorhandler(peewee.DoesNotExist)
 def handle_peewee_doesnotexist(e):
-    logger.error('DoesNotExist: %s' % e)
-    db.rollback()
+    _log_error('DoesNotExist', str(e))
     return DoesNotExistError(str(e)).make_response()
 
 
 @app.errorhandler(404)
 def handle_404_error(e):
-    logger.error(str(e))
+    _log_error('NotFound', str(e))
     return APIRouteDoesNotExist().make_response()
 
 
 @app.errorhandler(405)
 def handle_405_error(e):
-    logger.error(str(e))
+    _log_error('MethodNotAllowed', str(e))
     return APIMethodNotAllowed('Requested route does not support this method [%s].' % request.method).make_response()
 
 
 @app.errorhandler(Exception)
 def handle_generic_exception(e):
-    logger.error('Generic <%s>:: %s', e.__class__.__name__, e)
-    logger.error(traceback.format_exc())
-    db.rollback()
+    _log_error(e.__class__.__name__, str(e), exc=e)
     return BaseAPIException(e.__class__.__name__, str(e)).make_response()
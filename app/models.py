@@ -1,10 +1,12 @@
 from peewee import *
+from playhouse.sqlite_ext import PrimaryKeyAutoIncrementField
 from werkzeug.security import check_password_hash
 
-from east.database import EastModel
+from east.database import EastModel, QueryTemplate
 from east.exceptions import *
+from east.helpers import LRUCache
 
-from app import db
+from app import app, db
 
 
 class BBModel(EastModel):
@@ -18,17 +20,22 @@ class User(BBModel):
     fullname = CharField(max_length=255)
     email = CharField(max_length=256, unique=True)
     password_hash = CharField()
+    deleted = BooleanField(default=False)
 
     __serialization__ = {
         'basic': ['id', 'fullname'],
         'profile': ['id', 'fullname', 'email'],
     }
 
+    # Identity of each authenticated request
+    active = QueryTemplate(lambda cls, user_id:
+                           cls.select().where((cls.id == user_id) & (cls.deleted == False)))
+
     @classmethod
     def authenticate(cls, email, password):
         """Return user identified by given `email` and `password`"""
         try:
-            user = cls.get(cls.email == email)
+            user = cls.get((cls.email == email) & (cls.deleted == False))
             if not check_password_hash(user.password_hash, password):
                 raise AuthenticationError('Incorrect password provided.')
             return user
@@ -36,6 +43,14 @@ class User(BBModel):
             raise DoesNotExistError('User with email `%s` does not exist: [%s].'
                                     % (email, e))
 
+    @classmethod
+    def mark_deleted(cls, user):
+        """
+        Mark `user` as deleted, freeing its email for a new registration -
+        its row is deleted later by a background job
+        """
+        cls.update(deleted=True, email=_tombstone(cls.id)).where(cls.id == _id(user)).execute()
+
 
 DeferredCategory = DeferredRelation()
 
@@ -43,16 +58,154 @@ class Category(BBModel):
     name = CharField(max_length=64, unique=True)
     _parent = ForeignKeyField(DeferredCategory, related_name='children', null=True)
     owner = ForeignKeyField(User, related_name='categories', on_delete='CASCADE')
+    deleted = BooleanField(default=False)
+
+    class Meta:
+        indexes = (
+            (('owner', 'name'), True),
+        )
+
+    __owner__ = 'owner'
 
     __serialization__ = {
         'basic': ['id', 'name'],
         'extended': ['id', 'name', 'parent'],
-        'full': ['id', 'name', 'parent', 'notes_count']
+        'full': ['id', 'name', 'parent', 'notes_count'],
+        'sync': ['id', 'name', 'parent_id']
     }
 
+    # Listing of categories which aren't deleted, with their parents joined
+    # for row mode serialization
+    visible_by_owner = QueryTemplate(lambda cls, owner:
+                                     cls.select()
+                                     .join(ParentCategory, JOIN.LEFT_OUTER,
+                                           on=(cls._parent == ParentCategory.id))
+                                     .where((cls.owner == owner) & (cls.deleted == False)))
+
+    @classmethod
+    def resolve(cls, owner, name):
+        """
+        Return the id of `owner`'s category called `name`
+
+        Resolved ids are cached, so that the common path of most requests
+        costs no query - `forget_name` must be called whenever a category is
+        renamed or deleted. Raises AuthorizationError if the category belongs
+        to another user and DoesNotExistError if there is no such category -
+        categories marked as deleted no longer exist for their owner.
+        """
+        key = (_id(owner), name)
+        category_id = _category_ids.get(key)
+        if category_id is None:
+            category_id = (cls.select(cls.id)
+                           .where((cls.owner == key[0]) & (cls.name == name) &
+                                  (cls.deleted == False)).scalar())
+            if category_id is None:
+                if cls.select().where((cls.name == name) & (cls.owner != key[0])).exists():
+                    raise AuthorizationError('Not allowed to access this category.')
+                raise DoesNotExistError('Category `%s` does not exist.' % name)
+            _category_ids.set(key, category_id)
+        return category_id
+
+    @classmethod
+    def forget_name(cls, owner, name):
+        """Drop the cached id of `owner`'s category called `name`"""
+        _category_ids.pop((_id(owner), name))
+
+    @classmethod
+    def forget_names(cls):
+        """Drop all cached category ids"""
+        _category_ids.clear()
+
     def notes_count(self, view=None) -> int:
         return self.notes.count()
 
+    def parent_id(self, view=None) -> int:
+        return self._data.get('_parent')
+
+    @classmethod
+    def tree(cls, owner, notes_count=False):
+        """
+        Return `owner`'s category tree, as a list of root category nodes
+
+        Each node is a dictionary with the category's `id`, `name` and a list
+        of its `children` nodes - and, if `notes_count` is set, the number of
+        its own notes. The whole tree is loaded in a single query.
+        """
+        cursor = cls._meta.database.execute_sql(_TREE_COUNTS_SQL if notes_count else _TREE_SQL,
+                                                (_id(owner), _id(owner)))
+        nodes, roots = {}, []
+        # Rows are ordered by depth, so parents always precede their children
+        for category_id, name, parent_id, *count in cursor.fetchall():
+            node = nodes[category_id] = {'id': category_id, 'name': name, 'children': []}
+            if count:
+                node['notes_count'] = count[0]
+            (nodes[parent_id]['children'] if parent_id is not None else roots).append(node)
+        return roots
+
+    @classmethod
+    def mark_deleted(cls, category):
+        """
+        Mark `category` and all of its descendants as deleted
+
+        Returns the marked categories, with only their `id` and their original
+        `name` loaded - their names are freed for new categories right away,
+        while their rows, and their notes, are deleted later by a background job.
+        """
+        categories = list(cls.select(cls.id, cls.name).where(cls.id << cls.subtree(category)))
+        (cls.update(deleted=True, name=_tombstone(cls.id))
+         .where(cls.id << cls.subtree(category)).execute())
+        return categories
+
+    @classmethod
+    def subtree(cls, category):
+        """Return a subquery of ids of `category` and all of its descendants"""
+        return SQL(_SUBTREE_SQL, _id(category))
+
+
+_TREE_CTE = """
+    WITH RECURSIVE tree(id, name, parent_id, depth) AS (
+        SELECT id, name, _parent_id, 0 FROM category
+        WHERE _parent_id IS NULL AND owner_id = ? AND NOT deleted
+        UNION
+        SELECT c.id, c.name, c._parent_id, tree.depth + 1 FROM category AS c
+        JOIN tree ON c._parent_id = tree.id WHERE c.owner_id = ? AND NOT c.deleted
+    )
+"""
+
+_TREE_SQL = _TREE_CTE + """
+    SELECT id, name, parent_id FROM tree ORDER BY depth, name
+"""
+
+_TREE_COUNTS_SQL = _TREE_CTE + """
+    SELECT id, name, parent_id, (SELECT COUNT(*) FROM note WHERE note._category_id = tree.id)
+    FROM tree ORDER BY depth, name
+"""
+
+_SUBTREE_SQL = """(
+    WITH RECURSIVE subtree(id) AS (
+        SELECT ?
+        UNION
+        SELECT c.id FROM category AS c JOIN subtree ON c._parent_id = subtree.id
+    )
+    SELECT id FROM subtree
+)"""
+
+
+# Category ids cached by (owner id, name) - entries expire so that renames and
+# deletions done by other processes are eventually seen
+_category_ids = LRUCache(maxsize=app.config['CATEGORY_CACHE_SIZE'],
+                         ttl=app.config['CATEGORY_CACHE_TTL'])
+
+
+def _id(obj):
+    return obj.id if isinstance(obj, Model) else obj
+
+
+def _tombstone(id_field):
+    # Unique values of rows marked as deleted are replaced by one derived from
+    # their id - the NUL character keeps it from clashing with real values
+    return Param('\x00deleted-').concat(id_field)
+
 
 def _category_parent(self, view=None) -> (Category, 'basic'):
     return self._parent.to_jsondict(view='basic') if self._parent is not None else None
@@ -61,6 +214,12 @@ def _category_parent(self, view=None) -> (Category, 'basic'):
 DeferredCategory.set_model(Category)
 Category.parent = _category_parent
 
+ParentCategory = Category.alias()
+Category.__row_fields__ = {
+    'parent': ((ParentCategory.id, ParentCategory.name),
+               lambda id, name: {'id': id, 'name': name} if id is not None else None),
+}
+
 
 class Note(BBModel):
     title = CharField(max_length=255)
@@ -70,10 +229,89 @@ class Note(BBModel):
     date_created = DateTimeField()
     date_modified = DateTimeField()
 
+    class Meta:
+        indexes = (
+            (('_author', 'date_modified'), False),
+        )
+
+    __owner__ = '_author'
+
     __serialization__ = {
         'excerpt': ['id', 'title', 'category', 'date_modified'],
         'full': ['id', 'title', 'category', 'content', 'date_created', 'date_modified']
     }
 
+    __row_fields__ = {
+        'category': ((Category.id, Category.name), lambda id, name: {'id': id, 'name': name}),
+    }
+
+    # Notes of categories which aren't deleted, with their category loaded
+    visible = QueryTemplate(lambda cls, note_id, author:
+                            cls.select(cls, Category).join(Category)
+                            .where((cls.id == note_id) & (cls._author == author) &
+                                   (Category.deleted == False)))
+    visible_by_author = QueryTemplate(lambda cls, author:
+                                      cls.select(cls, Category).join(Category)
+                                      .where((cls._author == author) & (Category.deleted == False))
+                                      .order_by(cls.id),
+                                      paginate=True)
+    recent_by_author = QueryTemplate(lambda cls, author:
+                                     cls.select(cls, Category).join(Category)
+                                     .where((cls._author == author) & (Category.deleted == False))
+                                     .order_by(cls.date_modified.desc(), cls.id.desc()),
+                                     paginate=True)
+
     def category(self, view=None) -> (Category, 'basic'):
         return self._category.to_jsondict(view='basic')
+
+
+class ChangeLog(BBModel):
+    """
+    Latest change of each note and category, for client synchronization
+
+    Every write to a note or category replaces the object's row, so the table
+    holds one row per object - deleted objects are kept as tombstones. Row
+    ids are never reused and always grow, so they serve as change tokens: a
+    client which has seen token `t` needs only the rows with `id > t`.
+    """
+
+    id = PrimaryKeyAutoIncrementField()
+    owner = IntegerField()
+    kind = CharField(max_length=16)
+    object_id = IntegerField()
+    deleted = BooleanField(default=False)
+
+    class Meta:
+        indexes = (
+            (('kind', 'object_id'), True),
+            (('owner', 'id'), False),
+        )
+
+    KINDS = {'note': Note, 'category': Category}
+
+    @classmethod
+    def record(cls, owner, kind, object_id, deleted=False):
+        """
+        Log a change of `owner`'s object of `kind` ('note' or 'category')
+
+        Returns the change's token.
+        """
+        return cls.insert(owner=_id(owner), kind=kind, object_id=object_id,
+                          deleted=deleted).upsert().execute()
+
+    @classmethod
+    def latest_token(cls, owner):
+        """Return the token of `owner`'s latest change, 0 if there is none"""
+        return (cls.select(fn.MAX(cls.id)).where(cls.owner == _id(owner)).scalar() or 0)
+
+    @classmethod
+    def backfill(cls):
+        """Log all existing notes and categories which have no change logged"""
+        for kind, model in sorted(cls.KINDS.items()):
+            logged = cls.select(cls.object_id).where(cls.kind == kind)
+            owner = getattr(model, model.__owner__)
+            cls.insert_from([cls.owner, cls.kind, cls.object_id, cls.deleted],
+                            model.select(owner, Param(kind), model.id, Param(False))
+                            .where(model.id.not_in(logged))
+                            .order_by(model.id)).execute()
+
@@ -0,0 +1,14 @@
+from app import db
+from app.models import User, Category, Note, ChangeLog
+from app.tasks import Job
+
+
+# All of the application's models, in dependency order
+MODELS = [User, Category, Note, ChangeLog, Job]
+
+
+def migrate():
+    """Add the application's missing tables, columns and indexes to the database"""
+    db.ensure_schema(MODELS)
+    if not db.is_closed():
+        db.close()
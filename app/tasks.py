@@ -0,0 +1,66 @@
+import time
+
+from peewee import fn
+
+from east.database import write_transaction
+from east.jobs import JobQueue
+
+from app import app, db, east
+from app.handlers import logger
+from app.models import User, Note, Category, ChangeLog
+
+
+jobs = JobQueue(db, workers=app.config['JOBS_WORKERS'],
+                poll_interval=app.config['JOBS_POLL_INTERVAL'],
+                metrics=east.metrics, logger=logger)
+Job = jobs.model
+
+
+@jobs.task(max_attempts=10)
+def purge_user(user_id):
+    """
+    Delete a user marked as deleted, together with its notes, categories
+    and change log
+    """
+    progress = _purge(Note._author == user_id, Category.owner == user_id)
+    with write_transaction(db):
+        ChangeLog.delete().where(ChangeLog.owner == user_id).execute()
+        User.delete().where(User.id == user_id).execute()
+    return progress
+
+
+@jobs.task(max_attempts=10)
+def purge_category(owner_id, category_id):
+    """Delete a category marked as deleted, together with its subcategories and notes"""
+    subtree = Category.subtree(category_id)
+    return _purge(Note._category << subtree, Category.id << subtree, owner_id)
+
+
+def _purge(notes, categories, owner_id=None):
+    # Rows are deleted a batch at a time, each batch in a transaction of its
+    # own followed by a pause, so that requests get the write lock in between.
+    # Categories go leaves first, so that none is left referencing a deleted
+    # one. Progress carries over from failed attempts.
+    progress = {'notes_deleted': 0, 'categories_deleted': 0}
+    progress.update(jobs.current().progress() or {})
+    Child = Category.alias()
+    leaves = categories & ~fn.EXISTS(Child.select().where(Child._parent == Category.id))
+
+    for model, condition, counter in ((Note, notes, 'notes_deleted'),
+                                      (Category, leaves, 'categories_deleted')):
+        while True:
+            with write_transaction(db):
+                ids = [pk for pk, in model.select(model.id).where(condition)
+                       .limit(app.config['DELETION_BATCH_SIZE']).tuples()]
+                if ids:
+                    model.delete().where(model.id << ids).execute()
+                # A deleted user's notes go away with its whole change log
+                if model is Note and owner_id is not None:
+                    for note_id in ids:
+                        ChangeLog.record(owner_id, 'note', note_id, deleted=True)
+            if not ids:
+                break
+            progress[counter] += len(ids)
+            jobs.report(**progress)
+            time.sleep(app.config['DELETION_PAUSE'])
+    return progress
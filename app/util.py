@@ -23,6 +23,23 @@ class StringValidator:
             raise ValueError('Parameter value does not match a predefined pattern.')
 
 
+class IdListValidator:
+    """Comma-separated list of IDs validator object"""
+
+    # ASCII digits only, few enough to fit a 64-bit integer column
+    ID_PATTERN = re.compile(r'[0-9]{1,18}')
+
+    def __init__(self, max_count=None):
+        self.max_count = max_count
+
+    def __call__(self, parameter):
+        ids = parameter.split(',')
+        if not all(self.ID_PATTERN.fullmatch(id.strip()) for id in ids):
+            raise ValueError('Parameter is not a comma-separated list of IDs.')
+        elif self.max_count is not None and len(ids) > self.max_count:
+            raise ValueError('Parameter lists too many IDs, at most %d are allowed.' % self.max_count)
+
+
 class Success(ResponseType):
     """Simple success response"""
 
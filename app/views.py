@@ -1,12 +1,18 @@
+import hashlib
+
 from datetime import datetime
-from flask import Blueprint
+from flask import Blueprint, g, request
 
-from east.data import JSON
+from east.asgi import run_blocking
+from east.data import ByID, EventStream, JSON, JSONStream
+from east.ratelimit import RateLimit
 from east.security import *
 
-from app import app, east
-from app.models import User, Note, Category
-from app.util import StringValidator, Success, NoResponse
+from app import app, east, writer
+from app.events import events, publish_change
+from app.models import User, Note, Category, ChangeLog
+from app.tasks import Job, jobs, purge_category, purge_user
+from app.util import IdListValidator, StringValidator, Success, NoResponse
 
 
 east.register_validator('fullname', StringValidator(min_length=3, max_length=255))
@@ -15,11 +21,17 @@ east.register_validator('password', StringValidator(min_length=6))
 
 east.register_validator('title', StringValidator(min_length=1, max_length=255))
 east.register_validator('name', StringValidator(min_length=1, max_length=64))
+east.register_validator('ids', IdListValidator(max_count=app.config['MULTI_GET_MAX_IDS']))
 
 api = Blueprint('api', __name__)
 
-@east.route(api, '/auth', method='POST')
-def obtain_access_token(email: str, password: str) -> JSON:
+# Password hashing routes share a budget per client IP, so that they can't be
+# used to exhaust the server's CPU, other expensive routes have one each
+auth_limit = RateLimit(*app.config['RATE_LIMIT_AUTH'], key='ip', name='auth')
+expensive_limit = RateLimit(*app.config['RATE_LIMIT_EXPENSIVE'])
+
+@east.route(api, '/auth', method='POST', rate_limit=auth_limit)
+async def obtain_access_token(email: str, password: str) -> JSON:
     """
     Authenticate user
 
@@ -28,7 +40,7 @@ def obtain_access_token(email: str, password: str) -> JSON:
     Authorization HTTP header with each subsequent request.
 
     @exceptions: AuthenticationError, BadParameterError, DoesNotExistError,
-                 MissingParameterError
+                 MissingParameterError, RateLimitExceededError
     @response_description: JSON response containing API `access_token` and
                            `user_id`
     @response_format:
@@ -41,10 +53,11 @@ def obtain_access_token(email: str, password: str) -> JSON:
     }
     ```
     """
-    return generate_access_token(User.authenticate(email, password).id)
+    user = await run_blocking(User.authenticate, email, password)
+    return generate_access_token(user.id)
 
 
-@east.route(api, '/users', method='POST')
+@east.route(api, '/users', method='POST', rate_limit=auth_limit)
 def register_user(fullname: str, email: str, password: str) -> Success:
     """
     Register new user
@@ -75,7 +88,7 @@ def get_profile() -> JSON(User, view='profile'):
     return active_user()
 
 
-@east.route(api, '/users/self', method='PUT', auth='JWT')
+@east.route(api, '/users/self', method='PUT', auth='JWT', rate_limit=auth_limit)
 def edit_profile(fullname: str = None, email: str = None,
                  password: str = None) -> JSON(User, view='profile'):
     """
@@ -99,34 +112,123 @@ def edit_profile(fullname: str = None, email: str = None,
     return User.get(User.id == active_user().id)
 
 
-@east.route(api, '/users/self', method='DELETE', auth='JWT')
+@east.route(api, '/users/self', method='DELETE', auth='JWT', transactional=True)
 def delete_profile() -> NoResponse:
     """
     Delete user profile
 
     Permanently deletes user's profile, together with all of his notes and
-    categories.
+    categories. The profile is gone right away, while its notes and
+    categories are deleted in the background.
 
-    @response_status: 204
+    @response_status: 202
     """
-    User.delete().where(User.id == active_user().id).execute()
-    return '', 204
+    User.mark_deleted(active_user())
+    jobs.enqueue(purge_user, active_user().id)
+    return '', 202
+
+
+def _board_etag(recent: int = 10):
+    # The board changes with every logged change, and with the profile, which
+    # isn't logged - the token is kept for the board itself, which is loaded
+    # after it, so that syncing from it never misses a change
+    user = active_user()
+    g.board_token = ChangeLog.latest_token(user)
+    state = (user.id, user.fullname, user.email, g.board_token, recent)
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:20]
+
+
+@east.route(api, '/board', method='GET', auth='JWT', etag=_board_etag,
+             query_timeout=app.config['QUERY_TIMEOUT'])
+def get_board(recent: int = 10) -> JSON:
+    """
+    Get board
+
+    Returns everything needed to open the user's board in a single request -
+    user's profile, category tree with the number of notes in each category,
+    and `recent` most recently modified notes (at most 50). `token` is the
+    latest change token, to be passed as `since` to `GET /api/sync` to keep
+    the board up to date.
+
+    The response carries an `ETag`, and a request with a matching
+    `If-None-Match` header gets an empty response with status 304.
+
+    @exceptions: QueryTimeoutError
+    @response_description: User's board
+    @response_format:
+    ```js
+    {
+        "data": {
+            "profile": {
+                "id": integer,
+                "fullname": string,
+                "email": string
+            },
+            "categories": [
+                {
+                    "id": integer,
+                    "name": string,
+                    "notes_count": integer,
+                    "children": [...]
+                }
+            ],
+            "notes": [
+                {
+                    "id": integer,
+                    "title": string,
+                    "category": {
+                        "id": integer,
+                        "name": string
+                    },
+                    "date_modified": Datetime
+                }
+            ],
+            "token": integer
+        }
+    }
+    ```
+    """
+    recent = max(0, min(recent, app.config['BOARD_MAX_RECENT_NOTES']))
+    return {
+        'profile': active_user().to_jsondict('profile'),
+        'categories': Category.tree(active_user(), notes_count=True),
+        'notes': Note.row_view('excerpt').serialize(Note.recent_by_author(active_user(), limit=recent)),
+        'token': g.board_token
+    }
 
 
 @east.route(api, '/notes', method='GET', auth='JWT')
-def list_all_notes(start: int = 0, limit: int = 20) -> JSON([Note], view='excerpt'):
+def list_all_notes(start: int = 0, limit: int = 20,
+                   ids: str = None) -> JSON([Note], view='excerpt', rows=True, by_id='full'):
     """
     List notes
 
     Returns a paginated list of user's own notes.
 
+    If `ids` are given, returns those notes instead, in the same order and
+    in their full representation (with `content` and `date_created`) - an ID
+    of a note which doesn't exist, or isn't user's, is returned as
+    `{"id": integer, "missing": true}`. `ids` can't be combined with the
+    listing's `start`, `limit` and `fields`.
+
+    @exceptions: BadParameterError
     @response_description: User's notes
     """
-    return Note.select().where(Note._author == active_user()).offset(start).limit(limit)
+    if ids is not None:
+        listing_params = [name for name in ('start', 'limit', 'fields') if name in request.values]
+        if listing_params:
+            raise BadParameterError('Parameter `ids` can\'t be combined with %s.'
+                                    % ', '.join('`%s`' % name for name in listing_params))
+        ids = [int(id) for id in ids.split(',')]
+        # All of the notes are loaded by a single query
+        return ByID(ids, Note.select().join(Category)
+                    .where((Note.id << ids) & (Note._author == active_user()) &
+                           (Category.deleted == False)))
+    return Note.visible_by_author(active_user(), offset=start, limit=limit)
 
 
 @east.route(api, '/categories', method='GET', auth='JWT')
-def list_categories() -> JSON([Category], view='extended'):
+def list_categories() -> JSON([Category], view='extended', rows=True):
     """
     List categories
 
@@ -134,10 +236,10 @@ def list_categories() -> JSON([Category], view='extended'):
 
     @response_description: User's categories
     """
-    return Category.select().where(Category.owner == active_user())
+    return Category.visible_by_owner(active_user())
 
 
-@east.route(api, '/categories', method='POST', auth='JWT')
+@east.route(api, '/categories', method='POST', auth='JWT', transactional=True)
 def add_category(name: str, parent: str = None) -> Success:
     """
     Create new category
@@ -145,17 +247,50 @@ def add_category(name: str, parent: str = None) -> Success:
     Creates a new category for the user, can be either top-level or nested.
     **Has to have a unique name.**
 
-    @exceptions: BadParameterError, DoesNotExistError, MissingParameterError
+    @exceptions: AuthorizationError, BadParameterError, DoesNotExistError,
+                 MissingParameterError
     @response_status: 201
     """
     if parent is not None:
-        parent = Category.get(Category.name == parent)
+        parent = Category.resolve(active_user(), parent)
 
-    category = Category.create(name=name, parent=parent, owner=active_user())
+    category = Category.create(name=name, _parent=parent, owner=active_user())
+    token = ChangeLog.record(active_user(), 'category', category.id)
+    east.on_commit(publish_change, active_user(), 'category', category.id, token)
     return 'Category successfuly created.', 201, {'Location': '/api/categories/%d' % category.id}
 
 
-@east.route(api, '/categories/<string:category_name>', method='GET', auth='JWT')
+@east.route(api, '/categories/tree', method='GET', auth='JWT', rate_limit=expensive_limit,
+             coalesce=app.config['COALESCE_WAIT'], query_timeout=app.config['QUERY_TIMEOUT'])
+def get_category_tree() -> JSON:
+    """
+    Get category tree
+
+    Returns all user's categories arranged in a tree - a list of top-level
+    categories, each with a nested list of its `children`.
+
+    @exceptions: QueryTimeoutError
+    @response_description: User's category tree
+    @response_format:
+    ```js
+    {
+        "data": {
+            "categories": [
+                {
+                    "id": integer,
+                    "name": string,
+                    "children": [...]
+                }
+            ]
+        }
+    }
+    ```
+    """
+    return {'categories': Category.tree(active_user())}
+
+
+@east.route(api, '/categories/<string:category_name>', method='GET', auth='JWT',
+             coalesce=app.config['COALESCE_WAIT'], query_timeout=app.config['QUERY_TIMEOUT'])
 def get_category(category_name) -> JSON(Category, view='full'):
     """
     Get category
@@ -163,18 +298,14 @@ def get_category(category_name) -> JSON(Category, view='full'):
     Returns basic category info together with the number of notes present in the
     category.
 
-    @exceptions: AuthorizationError, DoesNotExistError
+    @exceptions: AuthorizationError, DoesNotExistError, QueryTimeoutError
     @response_description: Category info
     """
-    category = Category.get(Category.name == category_name)
-
-    if category.owner != active_user():
-        raise AuthorizationError('Not allowed to access this category.')
+    return Category.get(Category.id == Category.resolve(active_user(), category_name))
 
-    return category
 
-
-@east.route(api, '/categories/<string:category_name>', method='PUT', auth='JWT')
+@east.route(api, '/categories/<string:category_name>', method='PUT', auth='JWT',
+             transactional=True)
 def edit_category(category_name, name: str = None,
                   parent: str = None) -> JSON(Category, view='full'):
     """
@@ -185,62 +316,75 @@ def edit_category(category_name, name: str = None,
     @exceptions: AuthorizationError, BadParameterError, DoesNotExistError
     @response_description: Updated category info
     """
-    category = Category.get(Category.name == category_name)
-
-    if category.owner != active_user():
-        raise AuthorizationError('Not allowed to access this category.')
+    category_id = Category.resolve(active_user(), category_name)
 
     new_values = {
         'name': name,
-        '_parent': Category.get(Category.name == parent)
+        '_parent': Category.resolve(active_user(), parent)
                   if parent is not None else None
     }
 
     (Category.update(**{k: v for k, v in new_values.items() if v is not None})
-     .where(Category.id == category.id).execute())
+     .where(Category.id == category_id).execute())
+    token = ChangeLog.record(active_user(), 'category', category_id)
+    east.on_commit(publish_change, active_user(), 'category', category_id, token)
+    if name is not None:
+        east.on_commit(Category.forget_name, active_user(), category_name)
 
-    return Category.get(Category.id == category.id)
+    return Category.get(Category.id == category_id)
 
 
-@east.route(api, '/categories/<string:category_name>', method='DELETE', auth='JWT')
+@east.route(api, '/categories/<string:category_name>', method='DELETE', auth='JWT',
+             transactional=True)
 def delete_category(category_name) -> NoResponse:
     """
     Delete category
 
-    Deletes existing category and returns an empty response.
+    Deletes existing category, together with its subcategories and notes,
+    and returns an empty response. The categories are gone right away, while
+    the rows are deleted by a background job - the `Location` header points
+    to its status.
 
-    @exceptions: AuthorizationError
-    @response_status: 204
+    @exceptions: AuthorizationError, DoesNotExistError
+    @response_status: 202
     """
-    category = Category.get(Category.name == category_name)
-
-    if category.owner != active_user():
-        raise AuthorizationError('Not allowed to access this category.')
+    category_id = Category.resolve(active_user(), category_name)
 
-    Category.delete().where(Category.id == category.id).execute()
+    for category in Category.mark_deleted(category_id):
+        token = ChangeLog.record(active_user(), 'category', category.id, deleted=True)
+        east.on_commit(publish_change, active_user(), 'category', category.id, token, deleted=True)
+        east.on_commit(Category.forget_name, active_user(), category.name)
+    job = jobs.enqueue(purge_category, active_user().id, category_id, owner=active_user().id)
 
-    return '', 204
+    return '', 202, {'Location': '/api/jobs/%d' % job.id}
 
 
-@east.route(api, '/categories/<string:category_name>/notes', method='GET', auth='JWT')
-def list_category_notes(category_name, start: int = 0, limit: int = 20) -> JSON([Note], view='excerpt'):
+@east.route(api, '/categories/<string:category_name>/notes', method='GET', auth='JWT',
+             rate_limit=expensive_limit, coalesce=app.config['COALESCE_WAIT'],
+             query_timeout=app.config['QUERY_TIMEOUT'])
+def list_category_notes(category_name, start: int = 0, limit: int = 20,
+                        recursive: int = 0) -> JSON([Note], view='excerpt', rows=True):
     """
     List category notes
 
-    Returns a paginated list of notes belonging to the category.
+    Returns a paginated list of notes belonging to the category, or, if
+    `recursive` is 1, to the category and all of its subcategories.
 
-    @exceptions: AuthorizationError, DoesNotExistError
+    @exceptions: AuthorizationError, DoesNotExistError, QueryTimeoutError
     @response_description: Notes belonging to the category
     """
-    category = Category.get(Category.name == category_name)
-
-    if category.owner != active_user():
-        raise AuthorizationError('Not allowed to access this category.')
+    category_id = Category.resolve(active_user(), category_name)
 
-    return Note.select().where((Note._author == active_user()) & (Note._category == category))
+    # Descendants are marked deleted together with their ancestor, and stay
+    # in the subtree until they are purged
+    in_category = ((Note._category << Category.subtree(category_id)) & (Category.deleted == False)
+                   if recursive else Note._category == category_id)
+    return (Note.select().join(Category).where((Note._author == active_user()) & in_category)
+            .offset(start).limit(limit))
 
 
-@east.route(api, '/categories/<string:category_name>/notes', method='POST', auth='JWT')
+@east.route(api, '/categories/<string:category_name>/notes', method='POST', auth='JWT',
+             transactional=writer is None)
 def add_note(category_name, title: str, content: str) -> Success:
     """
     Create new note
@@ -250,14 +394,10 @@ def add_note(category_name, title: str, content: str) -> Success:
     @exceptions: AuthorizationError, BadParameterError, DoesNotExistError, MissingParameterError
     @response_status: 201
     """
-    category = Category.get(Category.name == category_name)
+    category_id = Category.resolve(active_user(), category_name)
 
-    if category.owner != active_user():
-        raise AuthorizationError('Not allowed to add notes to this category.')
-
-    note = Note.create(title=title, content=content, _category=category,
-                       _author=active_user(), date_created=datetime.now(),
-                       date_modified=datetime.now())
+    note, token = _write(_create_note, active_user().id, category_id, title, content)
+    east.on_commit(publish_change, active_user(), 'note', note.id, token)
     return 'Note successfully added', 201, {'Location': '/api/notes/%d' % note.id}
 
 
@@ -272,15 +412,16 @@ def get_note(category_name, note_id) -> JSON(Note, view='full'):
     @exceptions: AuthorizationError, DoesNotExistError
     @response_description: Note content and info
     """
-    note = Note.get(Note.id == note_id)
-
-    if note._author != active_user():
-        raise AuthorizationError('Not allowed to access this note.')
-
+    note = Note.visible.first(note_id, active_user())
+    if note is None:
+        # Tells apart a missing note from another user's one, and raises
+        Note.get_owned(note_id, active_user(), Note.select().join(Category)
+                       .where(Category.deleted == False))
     return note
 
 
-@east.route(api, '/categories/<string:category_name>/notes/<int:note_id>', method='PUT', auth='JWT')
+@east.route(api, '/categories/<string:category_name>/notes/<int:note_id>', method='PUT', auth='JWT',
+             transactional=writer is None)
 def edit_note(category_name, note_id, title: str = None, content: str = None,
               category: str = None) -> JSON(Note, view='full'):
     """
@@ -292,25 +433,22 @@ def edit_note(category_name, note_id, title: str = None, content: str = None,
     @exceptions: AuthorizationError, BadParameterError, DoesNotExistError
     @response_description: Updated note content
     """
-    note = Note.get(Note.id == note_id)
-
-    if note._author != active_user():
-        raise AuthorizationError('Not allowed to access this note.')
-
     new_values = {
         'title': title, 'content': content,
-        '_category': Category.get(Category.name == category)
+        '_category': Category.resolve(active_user(), category)
                     if category is not None else None,
         'date_modified': datetime.now()
     }
 
-    (Note.update(**{k: v for k, v in new_values.items() if v is not None})
-     .where(Note.id == note_id).execute())
+    token = _write(_update_note, active_user().id, note_id,
+                   {k: v for k, v in new_values.items() if v is not None})
+    east.on_commit(publish_change, active_user(), 'note', note_id, token)
 
-    return Note.get(Note.id == note_id)
+    return Note.select(Note, Category).join(Category).where(Note.id == note_id).get()
 
 
-@east.route(api, '/categories/<string:category_name>/notes/<int:note_id>', method='DELETE', auth='JWT')
+@east.route(api, '/categories/<string:category_name>/notes/<int:note_id>', method='DELETE', auth='JWT',
+             transactional=True)
 def delete_note(category_name, note_id) -> NoResponse:
     """
     Delete existing note
@@ -320,14 +458,132 @@ def delete_note(category_name, note_id) -> NoResponse:
     @exceptions: AuthorizationError, DoesNotExistError
     @response_status: 204
     """
-    note = Note.get(Note.id == note_id)
+    Note.delete_owned(note_id, active_user())
+    token = ChangeLog.record(active_user(), 'note', note_id, deleted=True)
+    east.on_commit(publish_change, active_user(), 'note', note_id, token, deleted=True)
 
-    if note._author != active_user():
-        raise AuthorizationError('Not allowed to access this note.')
+    return '', 204
 
-    Note.delete().where(Note.id == note_id).execute()
 
-    return '', 204
+@east.route(api, '/jobs/<int:job_id>', method='GET', auth='JWT')
+def get_job(job_id) -> JSON(Job, view='status'):
+    """
+    Get job status
+
+    Returns the status of a background job started by one of user's
+    requests - `queued`, `running`, `done` or `failed` - together with its
+    `progress` while it runs, and its `result` or last `error`.
+
+    @exceptions: AuthorizationError, DoesNotExistError
+    @response_description: Job status
+    """
+    return Job.get_owned(job_id, active_user())
+
+
+@east.route(api, '/sync', method='GET', auth='JWT', rate_limit=expensive_limit)
+def sync_changes(since: int = 0, limit: int = 500) -> JSONStream('changes'):
+    """
+    Synchronize changes
+
+    Returns notes and categories created, modified or deleted after the change
+    token `since` (use 0 for the first synchronization), oldest first. Each
+    change carries the object's current state, or only its `id` if it was
+    deleted. The response is streamed, and paginated by `limit` changes (at
+    most 1000) - `next` is the token to pass as `since` in the next request,
+    and `has_more` tells whether there are more changes to fetch right away.
+
+    @response_description: Changes since the given token
+    @response_format:
+    ```js
+    {
+        "data": {
+            "changes": [
+                {
+                    "token": integer,
+                    "type": string,
+                    "id": integer,
+                    "deleted": bool,
+                    "object": object
+                }
+            ],
+            "next": integer,
+            "has_more": bool
+        }
+    }
+    ```
+    """
+    limit = max(1, min(limit, 1000))
+    changes = list(ChangeLog.select()
+                   .where((ChangeLog.owner == active_user().id) & (ChangeLog.id > since))
+                   .order_by(ChangeLog.id).limit(limit + 1))
+    return _stream_changes(changes[:limit], since, len(changes) > limit)
+
+
+def _stream_changes(changes, since, has_more, batch_size=100):
+    # Objects are loaded a batch at a time, while the response is streamed
+    for start in range(0, len(changes), batch_size):
+        batch = changes[start:start + batch_size]
+        ids = {kind: [c.object_id for c in batch if c.kind == kind and not c.deleted]
+               for kind in ('note', 'category')}
+        objects = {'note': {}, 'category': {}}
+        if ids['note']:
+            objects['note'] = {note.id: note.to_jsondict('full') for note in
+                               Note.select(Note, Category).join(Category)
+                               .where((Note.id << ids['note']) & (Category.deleted == False))}
+        if ids['category']:
+            objects['category'] = {category.id: category.to_jsondict('sync') for category in
+                                   Category.select().where((Category.id << ids['category']) &
+                                                           (Category.deleted == False))}
+
+        for change in batch:
+            obj = objects[change.kind].get(change.object_id)
+            yield {'token': change.id, 'type': change.kind, 'id': change.object_id,
+                   'deleted': obj is None, 'object': obj}
+
+    return {'next': changes[-1].id if changes else since, 'has_more': has_more}
+
+
+@east.route(api, '/events', method='GET', auth='JWT', rate_limit=expensive_limit)
+def stream_events(last_event_id: int = None) -> EventStream:
+    """
+    Stream change events
+
+    Opens a server-sent events stream of `change` events, one for each note
+    or category created, modified or deleted by the user, as they happen.
+    Each event's `id` is the change's token, so a reconnecting client (its
+    `Last-Event-ID` header, or `last_event_id`) receives the changes it has
+    missed first - a client which fell too far behind is disconnected and
+    should resume with `GET /api/sync`. Each server process keeps a limited
+    number of streams open, further ones are refused with a 503 and a
+    `Retry-After` header.
+
+    @response_description: Stream of change events
+    @response_format:
+    ```
+    id: integer
+    event: change
+    data: {"type": string, "id": integer, "deleted": bool}
+    ```
+    """
+    if last_event_id is None and request.headers.get('Last-Event-ID', '').isdigit():
+        last_event_id = int(request.headers['Last-Event-ID'])
+    return events.subscribe(active_user().id, last_event_id)
+
+def _write(fn, *args):
+    # Small note writes go through the group commit writer if it is enabled,
+    # otherwise they run in the request's own transaction
+    return writer.call(fn, *args) if writer is not None else fn(*args)
+
+
+def _create_note(author_id, category_id, title, content):
+    note = Note.create(title=title, content=content, _category=category_id, _author=author_id,
+                       date_created=datetime.now(), date_modified=datetime.now())
+    return note, ChangeLog.record(author_id, 'note', note.id)
+
+
+def _update_note(author_id, note_id, values):
+    Note.update_owned(note_id, author_id, **values)
+    return ChangeLog.record(author_id, 'note', note_id)
 
 ################################################################################
 
@@ -345,12 +601,18 @@ if app.config['EAST_GENERATE_API_DOCS']:
     east.document_parameter('query', str, 'Query string containing a term to be searched for among the items.', example='abc')
     east.document_parameter('start', int, 'Index of the first requested item.')
     east.document_parameter('limit', int, 'Amount of requested items to be returned in the response.')
+    east.document_parameter('since', int, 'Change token returned by the previous synchronization, 0 for the first one.')
+    east.document_parameter('recent', int, 'Number of the most recently modified notes to be returned.')
+    east.document_parameter('last_event_id', int, 'ID of the last event received, overrides the `Last-Event-ID` header.')
 
     east.document_parameter('fullname', str, 'User\'s full name, first and last names combined.', example='John Doe')
     east.document_parameter('user_id', int, 'User\'s ID, allows unique identification of each user.', location='path', example='7324')
     east.document_parameter('email', str, 'User\'s email address, used for password recovery, important communications and sending notifications about interesting updates.\n\n**Must be unique**.', example='johndoe@mail.com')
     east.document_parameter('password', str, 'User\'s password, used together with username for API access authentication.\n\n**Minimum length: 6 characters.**')
 
+    east.document_parameter('job_id', int, 'Background job ID, from the `Location` header of a response with status 202.', location='path', example='12')
+
+    east.document_parameter('ids', str, 'Comma-separated list of note IDs, at most %d of them.' % app.config['MULTI_GET_MAX_IDS'], example='3241,3242,3250')
     east.document_parameter('note_id', int, 'Unique note ID, used to identify it among all the others.', location='path', example='3241')
     east.document_parameter('title', str, 'Note\'s title, limited to **255** characters', example='Shopping list')
     east.document_parameter('content', str, 'Note\'s content, either plain text or Markdown-formatted. Unlimited length.')
@@ -366,6 +628,7 @@ if app.config['EAST_GENERATE_API_DOCS']:
                               UnknownUserError, APIFeatureNotImplemented,
                               FileSystemError, BadParameterError,
                               MissingParameterError, RemoteOperationError,
-                              AuthorizationError])
+                              AuthorizationError, RateLimitExceededError,
+                              ServiceOverloadedError, QueryTimeoutError])
 
     east.generate_docs()
@@ -0,0 +1,15 @@
+import os
+
+os.environ.setdefault('BITBOARD_CONFIG', 'production')
+
+from east.asgi import ASGIAdapter
+
+from app import app
+from app.schema import migrate
+from app.tasks import jobs
+
+
+# Served by any ASGI server, eg. `uvicorn asgi:application`
+application = ASGIAdapter(app)
+migrate()
+jobs.start()
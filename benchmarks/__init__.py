@@ -0,0 +1,19 @@
+"""
+    benchmarks
+    ==========
+    Bitboard API benchmark suite
+
+    Seeds a separate database with a configurable amount of users, nested
+    categories and notes, drives a realistic mix of API requests through the
+    WSGI application in-process (sequentially or from concurrent workers)
+    and reports throughput and per-endpoint latency percentiles.
+
+    Usage (from the repository root):
+
+        python -m benchmarks.seed --notes 10000
+        python -m benchmarks.load --requests 5000 --workers 1,4 \\
+                                  --compare benchmarks/baselines/default.json
+
+    Results can be stored as a JSON baseline (`--save`), so that performance
+    regressions show up as diffs of the baseline files.
+"""
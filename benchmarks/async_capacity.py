@@ -0,0 +1,160 @@
+"""
+    benchmarks.async_capacity
+    =========================
+    Concurrent-connection capacity of async routes under the ASGI adapter,
+    compared with sync routes served by a fixed pool of WSGI threads
+
+    A small East app with two equivalent endpoints is built - a sync one
+    blocking for `--delay` seconds and an `async def` one awaiting for the
+    same time - standing in for a route waiting on a slow dependency. For
+    each concurrency level, that many simultaneous clients hit each endpoint:
+    the sync one through a `--threads` sized thread pool calling the WSGI app
+    (a threaded WSGI server), the async one through the ASGI adapter with a
+    pool of the same size. Both are driven in-process, so no HTTP server is
+    involved and the numbers reflect only how many requests each mode can
+    keep in flight.
+
+    With `--db`, `POST /api/auth` of the Bitboard app (password hashing
+    offloaded with `run_blocking`) is measured under the adapter as well.
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from flask import Flask
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from east import East
+from east.asgi import ASGIAdapter
+from east.data import JSON
+from east.metrics import Histogram
+
+
+def make_app(delay):
+    """Return a Flask app with sync (`/sync`) and async (`/async`) waiting routes"""
+    app = Flask(__name__)
+    app.config.update(EAST_GENERATE_API_DOCS=False)
+    east = East(app)
+
+    @east.route(app, '/sync')
+    def wait_sync() -> JSON:
+        time.sleep(delay)
+        return {'waited': delay}
+
+    @east.route(app, '/async')
+    async def wait_async() -> JSON:
+        await asyncio.sleep(delay)
+        return {'waited': delay}
+
+    return app
+
+
+def measure_wsgi(app, path, concurrency, requests, threads):
+    """Serve `requests` requests from `concurrency` clients with `threads` threads"""
+    histogram, lock, client = Histogram(), threading.Lock(), Client(app.wsgi_app, BaseResponse)
+
+    # Requests beyond the thread count queue up, just like connections waiting
+    # in a threaded server's backlog, and the wait counts into their latency
+    with ThreadPoolExecutor(threads) as server, ThreadPoolExecutor(concurrency) as clients:
+        def call(_):
+            started = time.perf_counter()
+            server.submit(client.get, path).result()
+            with lock:
+                histogram.record((time.perf_counter() - started) * 1e6)
+
+        started = time.perf_counter()
+        list(clients.map(call, range(requests)))
+        duration = time.perf_counter() - started
+    return requests / duration, histogram
+
+
+def measure_asgi(adapter, path, concurrency, requests, method='GET', body=b''):
+    """Serve `requests` requests from `concurrency` concurrent ASGI clients"""
+    histogram, remaining = Histogram(), [requests]
+    headers = [(b'content-type', b'application/x-www-form-urlencoded')]
+
+    async def call():
+        sent, messages = [], [{'type': 'http.request', 'body': body}]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        started = time.perf_counter()
+        await adapter({'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+                       'headers': headers}, receive, send)
+        histogram.record((time.perf_counter() - started) * 1e6)
+
+    async def connection():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await call()
+
+    loop = asyncio.new_event_loop()
+    started = time.perf_counter()
+    loop.run_until_complete(asyncio.gather(*[connection() for _ in range(concurrency)], loop=loop))
+    duration = time.perf_counter() - started
+    loop.close()
+    return requests / duration, histogram
+
+
+def _row(mode, concurrency, throughput, histogram):
+    print('%-14s %11d %10.1f %10.1f %10.1f' % (mode, concurrency, throughput,
+                                                histogram.percentile(50) / 1000,
+                                                histogram.percentile(99) / 1000))
+    return {'throughput_rps': round(throughput, 1),
+            'p50_ms': round(histogram.percentile(50) / 1000, 2),
+            'p99_ms': round(histogram.percentile(99) / 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare async and sync route capacity.')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds each request waits')
+    parser.add_argument('--threads', type=int, default=16, help='WSGI threads / ASGI pool size')
+    parser.add_argument('--concurrency', default='16,64,256', help='comma-separated client counts')
+    parser.add_argument('--requests', type=int, default=1024, help='requests per measurement')
+    parser.add_argument('--db', help='seeded benchmark database, enables the auth measurement')
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    app = make_app(args.delay)
+    adapter = ASGIAdapter(app, pool_size=args.threads)
+    results = {'delay_s': args.delay, 'threads': args.threads, 'runs': {}}
+
+    print('%-14s %11s %10s %10s %10s' % ('mode', 'concurrency', 'req/s', 'p50 ms', 'p99 ms'))
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        throughput, histogram = measure_wsgi(app, '/sync', concurrency, args.requests, args.threads)
+        results['runs']['wsgi/c=%d' % concurrency] = _row('wsgi', concurrency, throughput, histogram)
+        throughput, histogram = measure_asgi(adapter, '/async', concurrency, args.requests)
+        results['runs']['asgi/c=%d' % concurrency] = _row('asgi', concurrency, throughput, histogram)
+
+    if args.db:
+        from app import app as bitboard_app
+        from benchmarks.seed import PASSWORD, use_database, user_email
+
+        use_database(args.db)
+        bitboard = ASGIAdapter(bitboard_app, pool_size=args.threads)
+        body = urlencode({'email': user_email(1), 'password': PASSWORD}).encode()
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            throughput, histogram = measure_asgi(bitboard, '/api/auth', concurrency,
+                                                 args.requests // 8, 'POST', body)
+            results['runs']['asgi-auth/c=%d' % concurrency] = _row('asgi-auth', concurrency,
+                                                                    throughput, histogram)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+    benchmarks.category_tree
+    ========================
+    Category tree loading - recursive CTE against level-by-level traversal
+
+    A single user with a deep category tree (10k categories, 10 levels by
+    default) is seeded, and the time and number of queries needed to load
+    the whole tree and all notes of a top-level category's subtree are
+    measured for two strategies:
+
+        - levels:   one query for the children of each tree level, the best
+                    that the ORM's parent relation allows
+        - cte:      `Category.tree` / `Category.subtree`, a single recursive
+                    query regardless of depth
+
+    The `GET /api/categories/tree` and recursive note listing endpoints are
+    timed end-to-end as well.
+"""
+
+import argparse
+import json
+import time
+
+from east.metrics import Histogram, MetricsRegistry, clear_tracker
+from east.security import generate_access_token
+
+from app import app
+from app.models import Category, Note
+from benchmarks.seed import seed_database
+
+
+def tree_by_levels(owner):
+    nodes, roots = {}, []
+    level = list(Category.select(Category.id, Category.name, Category._parent)
+                 .where((Category.owner == owner) & (Category._parent >> None)))
+    while level:
+        for category in level:
+            node = nodes[category.id] = {'id': category.id, 'name': category.name, 'children': []}
+            parent_id = category._data['_parent']
+            (nodes[parent_id]['children'] if parent_id is not None else roots).append(node)
+        level = list(Category.select(Category.id, Category.name, Category._parent)
+                     .where(Category._parent << [c.id for c in level]))
+    return roots
+
+
+def subtree_notes_by_levels(category):
+    ids, level = [category.id], [category.id]
+    while level:
+        level = [c.id for c in Category.select(Category.id).where(Category._parent << level)]
+        ids.extend(level)
+    return list(Note.select().where(Note._category << ids))
+
+
+def tree_by_cte(owner):
+    return Category.tree(owner)
+
+
+def subtree_notes_by_cte(category):
+    return list(Note.select().where(Note._category << Category.subtree(category)))
+
+
+def measure(fn, arg, repeat):
+    """Return (histogram of µs, queries per call) of calling `fn(arg)` `repeat` times"""
+    histogram, registry = Histogram(), MetricsRegistry()
+    for _ in range(repeat):
+        tracker = registry.track('benchmark')
+        started = time.perf_counter()
+        fn(arg)
+        histogram.record((time.perf_counter() - started) * 1e6)
+        clear_tracker()
+    return histogram, tracker.query_count
+
+
+def measure_endpoint(client, url, headers, repeat):
+    histogram = Histogram()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        histogram.record((time.perf_counter() - started) * 1e6)
+        assert response.status_code == 200, response.status_code
+    return histogram
+
+
+def _row(name, histogram, queries=None):
+    print('%-34s %9s %10.2f %10.2f' % (name, '-' if queries is None else queries,
+                                       histogram.percentile(50) / 1000,
+                                       histogram.percentile(99) / 1000))
+    return {'queries': queries, 'p50_ms': round(histogram.percentile(50) / 1000, 2),
+            'p99_ms': round(histogram.percentile(99) / 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark category tree queries.')
+    parser.add_argument('--db', default='bench_tree.db', help='database file, it is overwritten')
+    parser.add_argument('--categories', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=10)
+    parser.add_argument('--notes', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    seed_database(args.db, users=1, categories=args.categories, depth=args.depth,
+                  notes=args.notes, content_length=100)
+    owner, tree = 1, tree_by_cte(1)
+    assert _normalize(tree) == _normalize(tree_by_levels(owner))
+    # The top-level category with the largest subtree
+    root = Category.get(Category.id == max(tree, key=_size)['id'])
+
+    results = {'config': vars(args), 'runs': {}}
+    print('%-34s %9s %10s %10s' % ('strategy', 'queries', 'p50 ms', 'p99 ms'))
+    for name, fn, arg in [('tree/levels', tree_by_levels, owner),
+                          ('tree/cte', tree_by_cte, owner),
+                          ('subtree_notes/levels', subtree_notes_by_levels, root),
+                          ('subtree_notes/cte', subtree_notes_by_cte, root)]:
+        results['runs'][name] = _row(name, *measure(fn, arg, args.repeat))
+
+    with app.app_context():
+        token = generate_access_token(owner)['access_token']
+    headers, client = {'Authorization': 'Bearer %s' % token}, app.test_client()
+    for name, url in [('GET /api/categories/tree', '/api/categories/tree'),
+                      ('GET .../notes?recursive=1', '/api/categories/%s/notes?recursive=1&limit=100'
+                       % root.name)]:
+        results['runs'][name] = _row(name, measure_endpoint(client, url, headers, args.repeat))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def _normalize(nodes):
+    return sorted((node['id'], node['name'], _normalize(node['children'])) for node in nodes)
+
+
+def _size(node):
+    return 1 + sum(_size(child) for child in node['children'])
+
+
+if __name__ == '__main__':
+    main()
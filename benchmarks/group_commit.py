@@ -0,0 +1,103 @@
+"""
+    benchmarks.group_commit
+    =======================
+    Note creation throughput - a transaction per request against group commit
+
+    For each concurrency level, that many clients - each one a different user,
+    on a thread of its own - create notes in a loop through `add_note`,
+    against an on-disk database. The route is run in two modes:
+
+        - request:  every request writes and commits in its own transaction,
+                    competing with the others for the write lock
+        - group:    the writes are handed over to `GroupCommitWriter`, which
+                    commits everything queued in a single transaction
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from east.database import GroupCommitWriter
+from east.metrics import Histogram
+from east.security import generate_access_token
+
+import app.views as views
+from app import app, db, east
+from benchmarks.seed import category_name, seed_database
+
+
+def use_group_commit(enabled):
+    """Switch `add_note` between its own transaction and the group commit writer"""
+    if views.writer is not None:
+        views.writer.close()
+    views.writer = GroupCommitWriter(db) if enabled else None
+    east._routes[views.add_note.__wrapped__]['transactional'] = not enabled
+
+
+def measure(clients, requests_per_client):
+    histogram, lock, errors = Histogram(), threading.Lock(), [0]
+
+    def run(user_id):
+        client = app.test_client()
+        with app.app_context():
+            headers = {'Authorization': 'Bearer %s' % generate_access_token(user_id)['access_token']}
+        url = '/api/categories/%s/notes' % category_name(user_id, 0)
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            response = client.post(url, data={'title': 'Note %d' % i, 'content': 'Benchmark note'},
+                                   headers=headers)
+            with lock:
+                histogram.record((time.perf_counter() - started) * 1e6)
+                if response.status_code != 201:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(run, range(1, clients + 1)))
+    duration = time.perf_counter() - started
+    return clients * requests_per_client / duration, histogram, errors[0]
+
+
+def _row(mode, clients, throughput, histogram, errors):
+    print('%-10s %8d %10.1f %10.2f %10.2f %8d' % (mode, clients, throughput,
+                                                  histogram.percentile(50) / 1000,
+                                                  histogram.percentile(99) / 1000, errors))
+    return {'throughput_rps': round(throughput, 1), 'errors': errors,
+            'p50_ms': round(histogram.percentile(50) / 1000, 2),
+            'p99_ms': round(histogram.percentile(99) / 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark group commit of note writes.')
+    parser.add_argument('--db', default='bench_group_commit.db',
+                        help='database file, it is overwritten')
+    parser.add_argument('--clients', default='1,8,64', help='comma-separated client counts')
+    parser.add_argument('--requests', type=int, default=100, help='requests per client')
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    client_counts = [int(c) for c in args.clients.split(',')]
+    results = {'config': vars(args), 'runs': {}}
+
+    print('%-10s %8s %10s %10s %10s %8s' % ('mode', 'clients', 'req/s', 'p50 ms', 'p99 ms',
+                                            'errors'))
+    for clients in client_counts:
+        for mode in ('request', 'group'):
+            seed_database(args.db, users=max(client_counts), categories=1, depth=1, notes=0)
+            use_group_commit(mode == 'group')
+            east.rate_limiter.backend.clear()
+            results['runs']['%s/c=%d' % (mode, clients)] = _row(mode, clients,
+                                                                *measure(clients, args.requests))
+    use_group_commit(False)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
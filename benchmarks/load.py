@@ -0,0 +1,244 @@
+"""
+    benchmarks.load
+    ===============
+    Load test - drives a weighted mix of API requests through the WSGI app
+
+    Each worker authenticates as one of the seeded users and repeatedly picks
+    a request from `REQUEST_MIX` (with a seeded random generator, so runs are
+    reproducible), recording its latency into a per-endpoint histogram.
+    Workers run either as threads sharing the process or as forked
+    processes, each with its own database connection.
+
+    The API has no search endpoint yet, so the read side of the mix consists
+    of note/category listings and single note fetches.
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import string
+import threading
+import time
+
+from collections import defaultdict
+
+from east.metrics import Histogram
+from east.security import generate_access_token
+
+from app import app, db
+from app.models import User, Category, Note
+from benchmarks.seed import DEFAULT_DATABASE, PASSWORD, use_database, user_email
+
+
+class UserContext:
+    """Seeded data of a single benchmark user, used to build requests"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.email = user_email(user_id)
+        self.categories = [c.name for c in Category.select(Category.name)
+                           .where(Category.owner == user_id)]
+        self.notes = [n.id for n in Note.select(Note.id).where(Note._author == user_id)]
+        with app.app_context():
+            token = generate_access_token(user_id)['access_token']
+        self.headers = {'Authorization': 'Bearer %s' % token}
+
+
+def _auth(client, ctx, rand):
+    return client.post('/api/auth', data={'email': ctx.email, 'password': PASSWORD})
+
+
+def _list_notes(client, ctx, rand):
+    return client.get('/api/notes?start=%d&limit=20' % rand.randint(0, max(len(ctx.notes) - 20, 0)),
+                      headers=ctx.headers)
+
+
+def _list_categories(client, ctx, rand):
+    return client.get('/api/categories', headers=ctx.headers)
+
+
+def _list_category_notes(client, ctx, rand):
+    return client.get('/api/categories/%s/notes' % rand.choice(ctx.categories), headers=ctx.headers)
+
+
+def _get_note(client, ctx, rand):
+    return client.get('/api/categories/%s/notes/%d' % (ctx.categories[0], rand.choice(ctx.notes)),
+                      headers=ctx.headers)
+
+
+def _edit_note(client, ctx, rand):
+    return client.put('/api/categories/%s/notes/%d' % (ctx.categories[0], rand.choice(ctx.notes)),
+                      data={'content': _random_text(rand, 200)}, headers=ctx.headers)
+
+
+def _add_note(client, ctx, rand):
+    return client.post('/api/categories/%s/notes' % rand.choice(ctx.categories),
+                       data={'title': _random_text(rand, 20), 'content': _random_text(rand, 200)},
+                       headers=ctx.headers)
+
+
+# (endpoint name, relative weight, request function)
+REQUEST_MIX = [
+    ('auth', 1, _auth),
+    ('list_notes', 30, _list_notes),
+    ('list_categories', 10, _list_categories),
+    ('list_category_notes', 20, _list_category_notes),
+    ('get_note', 25, _get_note),
+    ('edit_note', 10, _edit_note),
+    ('add_note', 4, _add_note),
+]
+
+
+def run_worker(worker_id, requests, contexts, seed, mix=REQUEST_MIX):
+    """Send `requests` requests, return {endpoint: (histogram of µs, error count)}"""
+    rand = random.Random('%s-%d' % (seed, worker_id))
+    client = app.test_client()
+    ctx = contexts[worker_id % len(contexts)]
+    names, weights, functions = zip(*mix)
+    cumulative = [sum(weights[:i + 1]) for i in range(len(weights))]
+
+    results = defaultdict(lambda: [Histogram(), 0])
+    for _ in range(requests):
+        index = rand.choices(range(len(mix)), cum_weights=cumulative)[0]
+        started = time.perf_counter()
+        response = functions[index](client, ctx, rand)
+        elapsed = time.perf_counter() - started
+
+        result = results[names[index]]
+        result[0].record(elapsed * 1e6)
+        if response.status_code >= 400:
+            result[1] += 1
+    return {name: tuple(result) for name, result in results.items()}
+
+
+def run_load(workers=1, requests=1000, mode='thread', seed=0, mix=REQUEST_MIX):
+    """Run a load test, return its throughput and per-endpoint statistics"""
+    contexts = [UserContext(u.id) for u in User.select(User.id).order_by(User.id)]
+    per_worker = requests // workers
+
+    started = time.perf_counter()
+    if workers == 1:
+        partials = [run_worker(0, per_worker, contexts, seed, mix)]
+    elif mode == 'thread':
+        partials = [None] * workers
+
+        def target(i):
+            partials[i] = run_worker(i, per_worker, contexts, seed, mix)
+
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        # Forked workers must not share the parent's database connection
+        db.close()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            partials = pool.starmap(run_worker, [(i, per_worker, contexts, seed, mix)
+                                                 for i in range(workers)])
+    duration = time.perf_counter() - started
+
+    merged = defaultdict(lambda: [Histogram(), 0])
+    for partial in partials:
+        for name, (histogram, errors) in partial.items():
+            _merge(merged[name][0], histogram)
+            merged[name][1] += errors
+
+    total = sum(h.count for h, _ in merged.values())
+    return {
+        'requests': total,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(total / duration, 1),
+        'endpoints': {name: _summary(histogram, errors)
+                      for name, (histogram, errors) in sorted(merged.items())}
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return a list of human-readable regressions of `results` against `baseline`"""
+    regressions = []
+    for run, result in results['runs'].items():
+        base = baseline['runs'].get(run)
+        if base is None:
+            continue
+        if result['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append('%s: throughput %.1f rps (baseline %.1f)'
+                               % (run, result['throughput_rps'], base['throughput_rps']))
+        for name, stats in result['endpoints'].items():
+            base_stats = base['endpoints'].get(name)
+            if base_stats and stats['p99_ms'] > base_stats['p99_ms'] * (1 + tolerance):
+                regressions.append('%s/%s: p99 %.2f ms (baseline %.2f ms)'
+                                   % (run, name, stats['p99_ms'], base_stats['p99_ms']))
+    return regressions
+
+
+def print_report(results):
+    for run, result in results['runs'].items():
+        print('\n%s - %d requests in %.2fs, %.1f req/s'
+              % (run, result['requests'], result['duration_s'], result['throughput_rps']))
+        print('  %-22s %7s %7s %9s %9s %9s' % ('endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, stats in result['endpoints'].items():
+            print('  %-22s %7d %7d %9.2f %9.2f %9.2f' % (name, stats['count'], stats['errors'],
+                                                        stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+
+
+def _summary(histogram, errors):
+    return {
+        'count': histogram.count,
+        'errors': errors,
+        'p50_ms': round(histogram.percentile(50) / 1000, 2),
+        'p95_ms': round(histogram.percentile(95) / 1000, 2),
+        'p99_ms': round(histogram.percentile(99) / 1000, 2),
+    }
+
+
+def _merge(target, histogram):
+    for index, count in histogram.counts.items():
+        target.counts[index] = target.counts.get(index, 0) + count
+    target.count += histogram.count
+    target.total += histogram.total
+    target.max = max(target.max, histogram.max)
+
+
+def _random_text(rand, length):
+    return ''.join(rand.choice(string.ascii_lowercase + ' ') for _ in range(length))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Bitboard API load test.')
+    parser.add_argument('--db', default=DEFAULT_DATABASE, help='seeded benchmark database')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--workers', default='1,4', help='comma-separated worker counts')
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='BASELINE', help='store results as a JSON baseline')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare results with a baseline')
+    args = parser.parse_args()
+
+    use_database(args.db)
+    results = {
+        'config': {'requests': args.requests, 'mode': args.mode, 'seed': args.seed,
+                   'users': User.select().count(), 'categories': Category.select().count(),
+                   'notes': Note.select().count()},
+        'runs': {}
+    }
+    for workers in (int(w) for w in args.workers.split(',')):
+        results['runs']['workers=%d' % workers] = run_load(workers, args.requests, args.mode, args.seed)
+
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        print('\nRegressions against %s:' % args.compare)
+        print('\n'.join('  ' + r for r in regressions) if regressions else '  none')
+
+
+if __name__ == '__main__':
+    main()
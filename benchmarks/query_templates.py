@@ -0,0 +1,111 @@
+"""
+    benchmarks.query_templates
+    ==========================
+    Query building overhead - Peewee query objects against query templates
+
+    The hot-path queries of `list_all_notes`, `get_note` and the JWT
+    identity loader are run in two ways:
+
+        - peewee:   the query object is built and compiled to SQL on every
+                    call, as the endpoints did before templates
+        - template: the `QueryTemplate` declared on the model binds the
+                    parameters to its cached SQL
+
+    For each, the time to produce the SQL and its parameters (the building
+    overhead alone), and the time of the whole call including the query's
+    execution and materialization of the rows, are measured in microseconds.
+"""
+
+import argparse
+import json
+import time
+
+from east.metrics import Histogram
+
+from app.models import User, Note, Category
+from benchmarks.seed import seed_database
+
+
+def list_notes_query(author):
+    return (Note.select(Note, Category).join(Category)
+            .where((Note._author == author) & (Category.deleted == False))
+            .order_by(Note.id).offset(0).limit(20))
+
+
+def get_note_query(note_id, author):
+    return (Note.select(Note, Category).join(Category)
+            .where((Note.id == note_id) & (Note._author == author) & (Category.deleted == False)))
+
+
+def identity_query(user_id):
+    return User.select().where((User.id == user_id) & (User.deleted == False))
+
+
+def cases(note):
+    """Return (name, build, template call, run with peewee, run with template) of each query"""
+    author = note._data['_author']
+    return [
+        ('list_all_notes', lambda: list_notes_query(author).sql(),
+         lambda: Note.visible_by_author.template.bind(Note, author, offset=0, limit=20),
+         lambda: list(list_notes_query(author)),
+         lambda: list(Note.visible_by_author(author, offset=0, limit=20))),
+        ('get_note', lambda: get_note_query(note.id, author).sql(),
+         lambda: Note.visible.template.bind(Note, note.id, author),
+         lambda: get_note_query(note.id, author).get(),
+         lambda: Note.visible.get(note.id, author)),
+        ('identity', lambda: identity_query(author).sql(),
+         lambda: User.active.template.bind(User, author),
+         lambda: identity_query(author).get(),
+         lambda: User.active.get(author)),
+    ]
+
+
+def measure(fn, repeat):
+    histogram = Histogram()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        histogram.record((time.perf_counter() - started) * 1e6)
+    return histogram
+
+
+def _row(name, histogram):
+    mean = histogram.total / histogram.count
+    print('%-28s %10.1f %10.1f %10.1f' % (name, histogram.percentile(50), histogram.percentile(99),
+                                          mean))
+    return {'p50_us': round(histogram.percentile(50), 1), 'p99_us': round(histogram.percentile(99), 1),
+            'mean_us': round(mean, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark query building against templates.')
+    parser.add_argument('--db', default='bench_templates.db', help='database file, it is overwritten')
+    parser.add_argument('--notes', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5000)
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    seed_database(args.db, users=10, categories=20, depth=4, notes=args.notes, content_length=100)
+    note = Note.get(Note.id == 1)
+
+    results = {'config': vars(args), 'runs': {}}
+    print('%-28s %10s %10s %10s' % ('query', 'p50 us', 'p99 us', 'mean us'))
+    for name, build, bind, run_peewee, run_template in cases(note):
+        assert _rows(run_peewee()) == _rows(run_template()), name
+        for mode, fn in [('build/peewee', build), ('build/template', bind),
+                         ('call/peewee', run_peewee), ('call/template', run_template)]:
+            results['runs']['%s/%s' % (name, mode)] = _row('%s %s' % (name, mode),
+                                                           measure(fn, args.repeat))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def _rows(result):
+    return [row._data for row in (result if isinstance(result, list) else [result])]
+
+
+if __name__ == '__main__':
+    main()
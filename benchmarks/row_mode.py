@@ -0,0 +1,97 @@
+"""
+    benchmarks.row_mode
+    ===================
+    List serialization - model instances against row mode
+
+    Pages of `page` notes (excerpt view, with their category) and a user's
+    categories (extended view, with their parent) are serialized in two ways:
+
+        - instances:    the query's rows are turned into model instances,
+                        which are then serialized one by one, as `JSON`
+                        does by default
+        - rows:         `RowView` selects only the view's columns and builds
+                        the dictionaries straight from the cursor rows, as
+                        `JSON(..., rows=True)` does
+
+    Both produce identical output. The time to serialize a page and the peak
+    memory allocated while doing so (traced with `tracemalloc`) are reported.
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from east.metrics import Histogram
+
+from app.models import Note, Category
+from benchmarks.seed import seed_database
+
+
+def note_page(author, page):
+    return (Note.select(Note, Category).join(Category)
+            .where(Note._author == author).order_by(Note.id).limit(page))
+
+
+def instances(query, model, view):
+    # Select queries cache their results, a clone is executed afresh
+    query = query.clone() if hasattr(query, 'clone') else query
+    return [item.to_jsondict(view) for item in query]
+
+
+def rows(query, model, view):
+    return model.row_view(view).serialize(query)
+
+
+def measure(fn, query, model, view, repeat):
+    histogram = Histogram()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(query, model, view)
+        histogram.record((time.perf_counter() - started) * 1e6)
+
+    tracemalloc.start()
+    fn(query, model, view)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return histogram, peak
+
+
+def _row(name, histogram, peak):
+    print('%-28s %10.2f %10.2f %12.1f' % (name, histogram.percentile(50) / 1000,
+                                          histogram.percentile(99) / 1000, peak / 1024))
+    return {'p50_ms': round(histogram.percentile(50) / 1000, 2),
+            'p99_ms': round(histogram.percentile(99) / 1000, 2), 'peak_kb': round(peak / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark row mode list serialization.')
+    parser.add_argument('--db', default='bench_rows.db', help='database file, it is overwritten')
+    parser.add_argument('--page', type=int, default=1000, help='notes per page')
+    parser.add_argument('--categories', type=int, default=1000, help='categories per user')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    seed_database(args.db, users=2, categories=args.categories, depth=4, notes=args.page * 4,
+                  content_length=500)
+
+    results = {'config': vars(args), 'runs': {}}
+    print('%-28s %10s %10s %12s' % ('serialization', 'p50 ms', 'p99 ms', 'peak KiB'))
+    for name, query, model, view in [('notes', note_page(1, args.page), Note, 'excerpt'),
+                                     ('categories', Category.visible_by_owner(1), Category,
+                                      'extended')]:
+        assert instances(query, model, view) == rows(query, model, view), name
+        for mode, fn in [('instances', instances), ('rows', rows)]:
+            results['runs']['%s/%s' % (name, mode)] = _row('%s %s' % (name, mode),
+                                                           *measure(fn, query, model, view,
+                                                                    args.repeat))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+    benchmarks.seed
+    ===============
+    Benchmark database seeding - users, nested categories and notes
+
+    Rows are inserted in bulk, in a single transaction per table, and all users
+    share one precomputed password hash, so that even databases with millions
+    of notes are created in reasonable time.
+"""
+
+import argparse
+import os
+import random
+
+from datetime import datetime, timedelta
+
+from east.testing import bulk_insert, precomputed_password_hash
+
+from app import db
+from app.models import User, Category, Note, ChangeLog
+from app.tasks import Job
+
+
+MODELS = [User, Category, Note, ChangeLog, Job]
+PASSWORD = 'benchmark'
+DEFAULT_DATABASE = 'bench.db'
+
+
+def use_database(path):
+    """Point the application to the benchmark database at `path`"""
+    if not db.is_closed():
+        db.close()
+    db.init(path)
+    db.create_tables(MODELS, safe=True)
+
+
+def seed_database(path=DEFAULT_DATABASE, users=10, categories=20, depth=4,
+                  notes=1000, content_length=500, seed=0):
+    """
+    Create a fresh benchmark database
+
+    :param path:            Database file, it is overwritten if it exists
+    :param users:           Number of users
+    :param categories:      Number of categories per user
+    :param depth:           Maximal depth of the category tree
+    :param notes:           Total number of notes, spread over all users
+    :param content_length:  Length of each note's content
+    :param seed:            Random generator seed, for reproducible databases
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    use_database(path)
+    rand = random.Random(seed)
+
+    password_hash = precomputed_password_hash(PASSWORD)
+    bulk_insert(User, [{'id': u, 'fullname': 'Benchmark User %d' % u, 'email': user_email(u),
+                        'password_hash': password_hash} for u in range(1, users + 1)])
+
+    category_rows, user_categories = [], {}
+    for u in range(1, users + 1):
+        levels, candidates = {}, []
+        for c in range(categories):
+            category_id = len(category_rows) + 1
+            parent = rand.choice(candidates) if candidates and rand.random() < 0.7 else None
+            levels[category_id] = levels[parent] + 1 if parent is not None else 0
+            if levels[category_id] < depth - 1:
+                candidates.append(category_id)
+            category_rows.append({'id': category_id, 'name': category_name(u, c),
+                                  '_parent': parent, 'owner': u})
+        user_categories[u] = list(levels)
+    bulk_insert(Category, category_rows)
+
+    now = datetime.now()
+    alphabet = 'abcdefghijklmnopqrstuvwxyz     '
+    contents = [''.join(rand.choice(alphabet) for _ in range(content_length)) for _ in range(64)]
+
+    def note_rows():
+        for n in range(1, notes + 1):
+            user = rand.randint(1, users)
+            created = now - timedelta(minutes=rand.randint(0, 10 ** 6))
+            yield {'id': n, 'title': 'Note %d' % n, 'content': rand.choice(contents),
+                   '_author': user, '_category': rand.choice(user_categories[user]),
+                   'date_created': created, 'date_modified': created}
+    bulk_insert(Note, note_rows())
+    ChangeLog.backfill()
+
+
+def user_email(user_id):
+    return 'bench.user.%d@mail.com' % user_id
+
+
+def category_name(user_id, index):
+    return 'u%d-c%d' % (user_id, index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the Bitboard benchmark database.')
+    parser.add_argument('--db', default=DEFAULT_DATABASE, help='database file')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=20, help='categories per user')
+    parser.add_argument('--depth', type=int, default=4, help='maximal category tree depth')
+    parser.add_argument('--notes', type=int, default=1000, help='total number of notes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    seed_database(args.db, args.users, args.categories, args.depth, args.notes, seed=args.seed)
+    print('Seeded %s: %d users, %d categories, %d notes'
+          % (args.db, User.select().count(), Category.select().count(), Note.select().count()))
+
+
+if __name__ == '__main__':
+    main()
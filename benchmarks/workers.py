@@ -0,0 +1,137 @@
+"""
+    benchmarks.workers
+    ==================
+    Throughput scaling of the pre-forking server with the number of workers
+
+    For each worker count, a `PreforkServer` serving the app is started on a
+    free local port, and a fixed number of client processes (so that the
+    clients are never the bottleneck of a single-process server) send
+    authenticated `GET /api/notes` requests over HTTP for a fixed time.
+    Scaling is only meaningful on a box with at least as many cores as the
+    largest worker count plus the clients' share.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from east.security import generate_access_token
+from east.server import PreforkServer
+
+from app import app, db, east
+from app.models import User
+from benchmarks.seed import DEFAULT_DATABASE, use_database
+
+
+class _Unlimited:
+    # Server throughput is measured, not the per-user rate limits
+    def consume(self, key, rate, burst):
+        return 0
+
+
+def _serve(port, workers, threads):
+    east.rate_limiter.backend = _Unlimited()
+    PreforkServer(app, host='127.0.0.1', port=port, workers=workers, threads=threads,
+                  graceful_timeout=5).run()
+
+
+def _client(port, headers, duration, results):
+    deadline, count, errors = time.monotonic() + duration, 0, 0
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        try:
+            connection.request('GET', '/api/notes?limit=20', headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                count += 1
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+        finally:
+            connection.close()
+    results.put((count, errors))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('Server did not start on port %d' % port)
+
+
+def measure(workers, clients, duration, headers, threads=1):
+    """Return (requests per second, errors) for a server with `workers` workers"""
+    context = multiprocessing.get_context('fork')
+    port = _free_port()
+    if not db.is_closed():
+        db.close()
+    server = context.Process(target=_serve, args=(port, workers, threads))
+    server.start()
+    try:
+        _wait_for(port)
+        results = context.Queue()
+        processes = [context.Process(target=_client, args=(port, headers, duration, results))
+                     for _ in range(clients)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join()
+
+    return sum(c for c, _ in totals) / duration, sum(e for _, e in totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure server throughput by worker count.')
+    parser.add_argument('--db', default=DEFAULT_DATABASE, help='seeded benchmark database')
+    parser.add_argument('--workers', default='1,2,4,8', help='comma-separated worker counts')
+    parser.add_argument('--threads', type=int, default=1, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per measurement')
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    use_database(args.db)
+    with app.app_context():
+        token = generate_access_token(User.select().first().id)['access_token']
+    headers = {'Authorization': 'Bearer %s' % token}
+
+    results, base = {'cpu_count': os.cpu_count(), 'clients': args.clients,
+                     'threads': args.threads, 'runs': {}}, None
+    print('%8s %12s %9s %7s' % ('workers', 'req/s', 'scaling', 'errors'))
+    for workers in (int(w) for w in args.workers.split(',')):
+        throughput, errors = measure(workers, args.clients, args.duration, headers, args.threads)
+        base = base or throughput
+        results['runs']['workers=%d' % workers] = {'throughput_rps': round(throughput, 1),
+                                                   'scaling': round(throughput / base, 2),
+                                                   'errors': errors}
+        print('%8d %12.1f %8.2fx %7d' % (workers, throughput, throughput / base, errors))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+    benchmarks.write_throughput
+    ===========================
+    Write endpoint throughput - autocommit against request-scoped transactions
+
+    Every write route of the API is run twice: once with each statement
+    committed on its own (SQLite autocommit, the behaviour before routes could
+    be declared transactional), and once in a single transaction per request.
+    For each concurrency level, that many clients - each one a different user
+    - edit their notes and create categories in a loop, through the test
+    client against an on-disk database, so every commit pays for its journal
+    syncs.
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from east.metrics import Histogram
+from east.security import generate_access_token
+
+from app import app, east
+from app.models import Category, Note
+from benchmarks.seed import seed_database
+
+
+def set_transactional(enabled):
+    """Switch the routes declared transactional to autocommit, or back"""
+    for route in east._routes.values():
+        route.setdefault('declared_transactional', route['transactional'])
+        route['transactional'] = enabled and route['declared_transactional']
+
+
+def client_requests(user_id, requests):
+    """Return a list of (method, url, data, headers) requests of user `user_id`"""
+    with app.app_context():
+        token = generate_access_token(user_id)['access_token']
+    headers = {'Authorization': 'Bearer %s' % token}
+    note = Note.select(Note, Category).join(Category).where(Note._author == user_id).first()
+    url = '/api/categories/%s/notes/%d' % (note._category.name, note.id)
+    return [('PUT', url, {'title': 'Edited %d' % i}, headers) if i % 2 == 0 else
+            ('POST', '/api/categories', {'name': 'bench-%d-%d' % (user_id, i)}, headers)
+            for i in range(requests)]
+
+
+def measure(clients, requests_per_client):
+    histogram, lock, errors = Histogram(), threading.Lock(), [0]
+    plans = [client_requests(user_id, requests_per_client) for user_id in range(1, clients + 1)]
+
+    def run(plan):
+        client = app.test_client()
+        for method, url, data, headers in plan:
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data, headers=headers)
+            with lock:
+                histogram.record((time.perf_counter() - started) * 1e6)
+                if response.status_code >= 300:
+                    errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        list(executor.map(run, plans))
+    duration = time.perf_counter() - started
+    return clients * requests_per_client / duration, histogram, errors[0]
+
+
+def _row(mode, clients, throughput, histogram, errors):
+    print('%-14s %8d %10.1f %10.2f %10.2f %8d' % (mode, clients, throughput,
+                                                  histogram.percentile(50) / 1000,
+                                                  histogram.percentile(99) / 1000, errors))
+    return {'throughput_rps': round(throughput, 1), 'errors': errors,
+            'p50_ms': round(histogram.percentile(50) / 1000, 2),
+            'p99_ms': round(histogram.percentile(99) / 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark write endpoint throughput.')
+    parser.add_argument('--db', default='bench_writes.db', help='database file, it is overwritten')
+    parser.add_argument('--clients', default='1,4,16', help='comma-separated client counts')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--save', metavar='FILE', help='store results as JSON')
+    args = parser.parse_args()
+
+    client_counts = [int(c) for c in args.clients.split(',')]
+    results = {'config': vars(args), 'runs': {}}
+
+    print('%-14s %8s %10s %10s %10s %8s' % ('mode', 'clients', 'req/s', 'p50 ms', 'p99 ms',
+                                            'errors'))
+    for clients in client_counts:
+        for mode, transactional in [('autocommit', False), ('transactional', True)]:
+            seed_database(args.db, users=max(client_counts), categories=10, depth=2,
+                          notes=max(client_counts) * 10, content_length=100)
+            set_transactional(transactional)
+            east.rate_limiter.backend.clear()
+            results['runs']['%s/c=%d' % (mode, clients)] = _row(mode, clients,
+                                                                *measure(clients, args.requests))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
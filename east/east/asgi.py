@@ -0,0 +1,332 @@
+"""
+    east.asgi
+    =========
+    ASGI adapter for East applications - serves `async def` routes on an
+    event loop and offloads blocking work to a bounded thread pool
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import asyncio
+import functools
+import io
+import sys
+import threading
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import _app_ctx_stack, _request_ctx_stack, current_app, g
+from flask.signals import request_started
+from werkzeug.exceptions import HTTPException
+
+from .metrics import attach_tracker, clear_tracker
+
+
+# Tasks serving ASGI requests, each of them has its own Flask context stacks
+_request_tasks = weakref.WeakSet()
+_loops = threading.local()
+
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+
+class ASGIAdapter:
+    """
+    ASGI 3 application wrapping a Flask application with East routes
+
+    Every request is handled in a task of its own. Requests for `async def`
+    East routes are dispatched on the event loop, so a request waiting for
+    I/O doesn't occupy a thread - blocking calls (database queries, password
+    hashing) made by these routes through `run_blocking` are executed by a
+    thread pool of `pool_size` threads. Requests for all other views are
+    handed over to the pool in their entirety, exactly as a threaded WSGI
+    server would handle them.
+
+    Flask keeps request and application contexts per thread, so while the
+    adapter serves requests it switches the context stacks to be per task
+    instead, and switches them back once none are left. The request profiler
+    still keys requests by thread and should only be enabled in WSGI mode.
+
+    Usage (with any ASGI server, eg. uvicorn):
+
+        application = ASGIAdapter(app)
+    """
+
+    def __init__(self, flask_app, pool_size=None):
+        """
+        :param flask_app:   Flask application
+        :param pool_size:   Number of threads running blocking calls (default:
+                            `EAST_ASYNC_POOL_SIZE` config value, or 16)
+        """
+        self.app = flask_app
+        self.pool_size = pool_size or flask_app.config.get('EAST_ASYNC_POOL_SIZE', 16)
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix='east-async')
+
+        flask_app.extensions['east.asgi'] = self
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type `%s`' % scope['type'])
+
+        environ = _build_environ(scope, await _read_body(receive))
+        with _task_contexts:
+            task = asyncio.ensure_future(self._handle(environ))
+            _request_tasks.add(task)
+            response = await task
+            if getattr(response, 'east_async_body', None) is not None:
+                await self._send_async_response(response, receive, send)
+            else:
+                await self._send_response(response, environ, send)
+
+    async def _handle(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+            view = self.app.view_functions.get(endpoint)
+        except HTTPException:
+            view = None
+
+        coroutine_function = getattr(view, 'east_async', None)
+        if coroutine_function is None:
+            return await asyncio.get_event_loop().run_in_executor(self.executor, self._dispatch,
+                                                                  environ)
+        return await self._dispatch_async(environ, coroutine_function)
+
+    def _dispatch(self, environ):
+        # Flask.wsgi_app, returning the response object instead of calling it
+        app, ctx, error = self.app, self.app.request_context(environ), None
+        ctx.push()
+        try:
+            try:
+                return app.full_dispatch_request()
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+            except:
+                error = sys.exc_info()[1]
+                raise
+        finally:
+            if app.should_ignore_error(error):
+                error = None
+            ctx.auto_pop(error)
+
+    async def _dispatch_async(self, environ, coroutine_function):
+        # Flask.wsgi_app and Flask.full_dispatch_request, awaiting the view
+        app, ctx, error = self.app, self.app.request_context(environ), None
+        ctx.push()
+        try:
+            try:
+                app.try_trigger_before_first_request_functions()
+                try:
+                    request_started.send(app)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        if ctx.request.routing_exception is not None:
+                            app.raise_routing_exception(ctx.request)
+                        rv = await coroutine_function(**ctx.request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+            except:
+                error = sys.exc_info()[1]
+                raise
+        finally:
+            if app.should_ignore_error(error):
+                error = None
+            ctx.auto_pop(error)
+
+    async def _send_response(self, response, environ, send):
+        app_iter, status, headers = response.get_wsgi_response(environ)
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers]
+        })
+        try:
+            if response.is_sequence:
+                await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+                return
+
+            # Streamed responses may block while producing their chunks
+            loop, chunks = asyncio.get_event_loop(), iter(app_iter)
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    async def _send_async_response(self, response, receive, send):
+        # Body produced by an async generator, until it ends or the client leaves
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.to_wsgi_list()]
+        })
+        chunks = response.east_async_body()
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            async for chunk in chunks:
+                if disconnect.done():
+                    return
+                await send({'type': 'http.response.body', 'more_body': True,
+                            'body': chunk.encode('utf-8') if isinstance(chunk, str) else chunk})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            await chunks.aclose()
+            response.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Call a blocking function `fn` from an `async def` route
+
+    In ASGI mode, `fn` is run by the adapter's thread pool, with the current
+    request's contexts and metrics tracker available to it. In WSGI mode the
+    request already has a thread of its own, so `fn` is simply called.
+    """
+    if not is_async_request():
+        return fn(*args, **kwargs)
+
+    call = functools.partial(_call_in_context, _app_ctx_stack.top, _request_ctx_stack.top,
+                             g.get('east_tracker'), fn, args, kwargs)
+    return await asyncio.get_event_loop().run_in_executor(
+        current_app.extensions['east.asgi'].executor, call)
+
+
+def run_coroutine(coroutine):
+    """Run `coroutine` to completion on the event loop of the current thread"""
+    loop = getattr(_loops, 'loop', None)
+    if loop is None:
+        loop = _loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+def is_async_request():
+    """Return True if called from a request served on the ASGI event loop"""
+    return _request_task() is not None
+
+
+def _request_task():
+    if asyncio._get_running_loop() is None:
+        return None
+    task = _current_task()
+    return task if task is not None and task in _request_tasks else None
+
+
+def _context_ident(fallback):
+    return _request_task() or fallback()
+
+
+class _TaskContexts:
+    # Keys the Flask context stacks by request task for as long as any ASGI
+    # request is being served, restoring their own ident functions afterwards
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._saved = None
+
+    def __enter__(self):
+        with self._lock:
+            if self._requests == 0:
+                self._saved = (_request_ctx_stack.__ident_func__, _app_ctx_stack.__ident_func__)
+                _request_ctx_stack.__ident_func__ = functools.partial(_context_ident, self._saved[0])
+                _app_ctx_stack.__ident_func__ = functools.partial(_context_ident, self._saved[1])
+            self._requests += 1
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._requests -= 1
+            if self._requests == 0:
+                _request_ctx_stack.__ident_func__, _app_ctx_stack.__ident_func__ = self._saved
+                self._saved = None
+
+
+_task_contexts = _TaskContexts()
+
+
+def _call_in_context(app_ctx, request_ctx, tracker, fn, args, kwargs):
+    # Contexts are shared with the request task, not pushed anew - signals and
+    # teardown functions are run by the task only
+    if app_ctx is not None:
+        _app_ctx_stack.push(app_ctx)
+    if request_ctx is not None:
+        _request_ctx_stack.push(request_ctx)
+    attach_tracker(tracker)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        clear_tracker()
+        if request_ctx is not None:
+            _request_ctx_stack.pop()
+        if app_ctx is not None:
+            _app_ctx_stack.pop()
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for name, value in scope.get('headers', ()):
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    return environ
@@ -0,0 +1,76 @@
+"""
+    east.coalescing
+    ===============
+    Single-flight coalescing of identical concurrent calls
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import threading
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls made with the same key into one
+
+    The first caller of a key (the leader) runs the function, and callers
+    arriving while it runs (followers) wait for its result instead of
+    running it again. A follower whose wait runs out, or whose leader
+    fails, runs the function itself - coalescing only ever saves work, it
+    never turns a slow or failed call into an error of other callers.
+    Nothing is kept once the leader's call is over, so calls which don't
+    overlap are never coalesced.
+
+    Calls are coalesced only among the threads of one process - processes
+    don't share their calls, so under a pre-forking server each worker
+    coalesces its own requests, and single-threaded workers coalesce none.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, fn, timeout=None):
+        """
+        Return the result of `fn()`, shared by concurrent calls with `key`,
+        and whether it was shared from another caller
+
+        :param key:     Hashable key, equal for calls which can share a result
+        :param fn:      Function computing the result
+        :param timeout: Maximal number of seconds a follower waits for the
+                        leader (default: until it finishes)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+                call.failed = False
+                return call.result, False
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.done.wait(timeout) and not call.failed:
+            return call.result, True
+        return fn(), False
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'failed')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = True
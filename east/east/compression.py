@@ -0,0 +1,273 @@
+"""
+    east.compression
+    ================
+    Response compression - content encoding negotiation, on-the-fly
+    compression of regular and streamed responses, and serving of files
+    precompressed at build time
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import mimetypes
+import os
+import zlib
+
+from flask import current_app, request, safe_join, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Supported encodings, most preferred first
+ENCODINGS = ('br', 'zstd', 'gzip')
+
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml'}
+
+
+class GzipEncoder:
+    """gzip content encoding, always available"""
+
+    name, suffix = 'gzip', '.gz'
+    default_level, max_level = 6, 9
+
+    @staticmethod
+    def compress(data, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def stream(level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return (compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+                compressor.flush)
+
+
+class BrotliEncoder:
+    """Brotli content encoding, requires the `brotli` package"""
+
+    name, suffix = 'br', '.br'
+    default_level, max_level = 4, 11
+
+    @staticmethod
+    def compress(data, level):
+        return brotli.compress(data, quality=level)
+
+    @staticmethod
+    def stream(level):
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.flush, compressor.finish
+
+
+class ZstdEncoder:
+    """Zstandard content encoding, requires the `zstandard` package"""
+
+    name, suffix = 'zstd', '.zst'
+    default_level, max_level = 3, 19
+
+    @staticmethod
+    def compress(data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    @staticmethod
+    def stream(level):
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        return (compressor.compress,
+                lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush)
+
+
+ENCODERS = {encoder.name: encoder for encoder, module in [(BrotliEncoder, brotli),
+                                                          (ZstdEncoder, zstandard),
+                                                          (GzipEncoder, zlib)]
+            if module is not None}
+
+
+class Compression:
+    """
+    Compression of API responses
+
+    Responses of a compressible type are compressed with the best encoding
+    accepted by the client, in order of preference from `encodings` - brotli
+    and zstd are used only if their packages are installed. Bodies smaller
+    than `min_size` bytes aren't worth compressing and are sent as they are.
+
+    Streamed responses (and the ASGI adapter's async bodies) are compressed
+    chunk by chunk, flushing the compressor after every chunk, so clients
+    receive each chunk as soon as it is produced. Files are never compressed
+    on the fly - use `precompress` when generating them and serve them with
+    `send_precompressed`.
+    """
+
+    def __init__(self, encodings=ENCODINGS, levels=None, min_size=512):
+        """
+        :param encodings:   Names of encodings to use, most preferred first
+        :param levels:      Compression level of each encoding, by name
+        :param min_size:    Minimal size of compressed bodies, in bytes
+        """
+        self.encodings = [name for name in encodings if name in ENCODERS]
+        self.levels = {name: (levels or {}).get(name, ENCODERS[name].default_level)
+                       for name in self.encodings}
+        self.min_size = min_size
+
+    def compress_response(self, response):
+        """Compress `response` for the current request, if possible"""
+        if not _is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''), self.encodings)
+        if encoding is None:
+            return response
+        encoder, level = ENCODERS[encoding], self.levels[encoding]
+
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoder, level)
+            async_body = getattr(response, 'east_async_body', None)
+            if async_body is not None:
+                response.east_async_body = lambda: _compress_async_stream(async_body(), encoder,
+                                                                          level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressed = encoder.compress(data, level)
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag('%s-%s' % (etag, encoding), weak)
+        return response
+
+
+def negotiate(accept_encoding, encodings):
+    """
+    Return the first of `encodings` accepted by the `Accept-Encoding` header
+    value `accept_encoding`, or None if none of them is
+    """
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip()] = quality
+
+    for name in encodings:
+        if accepted.get(name, accepted.get('*', 0.0)) > 0:
+            return name
+    return None
+
+
+def precompress(path, encodings=None):
+    """
+    Store compressed copies of file `path` next to it, eg. `docs.html.gz`
+
+    Copies are compressed with every available encoding (or the ones in
+    `encodings`) at its highest level, as it is done only once. Returns the
+    paths of the copies.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    paths = []
+    for name in (encodings or [name for name in ENCODINGS if name in ENCODERS]):
+        encoder = ENCODERS[name]
+        with open(path + encoder.suffix, 'wb') as f:
+            f.write(encoder.compress(data, encoder.max_level))
+        paths.append(path + encoder.suffix)
+    return paths
+
+
+def precompress_directory(directory, encodings=None):
+    """Precompress all files of a compressible type in `directory`, recursively"""
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            mimetype, encoding = mimetypes.guess_type(filename)
+            if encoding is None and mimetype is not None and _is_compressible_type(mimetype):
+                paths.extend(precompress(os.path.join(root, filename), encodings))
+    return paths
+
+
+def send_precompressed(directory, filename, **options):
+    """
+    Send file `filename` from `directory`, like `flask.send_from_directory`,
+    or its precompressed copy if there is an up-to-date one accepted by the
+    client
+    """
+    if not os.path.isabs(directory):
+        directory = os.path.join(current_app.root_path, directory)
+    path = safe_join(directory, filename)
+
+    available = [name for name, encoder in ENCODERS.items()
+                 if _is_fresh(path + encoder.suffix, path)]
+    encoding = negotiate(request.headers.get('Accept-Encoding', ''),
+                         [name for name in ENCODINGS if name in available])
+    if encoding is None:
+        response = send_from_directory(directory, filename, **options)
+    else:
+        response = send_from_directory(directory, filename + ENCODERS[encoding].suffix,
+                                       **options)
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _is_compressible(response):
+    return (200 <= response.status_code < 300 and response.status_code != 204 and
+            not response.direct_passthrough and 'Content-Encoding' not in response.headers and
+            _is_compressible_type(response.mimetype or ''))
+
+
+def _is_compressible_type(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _is_fresh(copy, original):
+    try:
+        return os.path.getmtime(copy) >= os.path.getmtime(original)
+    except OSError:
+        return False
+
+
+def _compress_stream(chunks, encoder, level):
+    compress, flush, finish = encoder.stream(level)
+    try:
+        for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+async def _compress_async_stream(chunks, encoder, level):
+    compress, flush, finish = encoder.stream(level)
+    try:
+        async for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        await chunks.aclose()
@@ -1,7 +1,8 @@
 """
     east.data
     =========
-    Endpoint return types definitions (ResponseType baseclass, JSON, HTML)
+    Endpoint return types definitions (ResponseType baseclass, JSON,
+    JSONStream, EventStream, HTML)
 
     :copyright: (c) 2016 by Zvonimir Jurelinac
     :license: MIT
@@ -9,24 +10,40 @@
 
 import json
 
-from flask import jsonify, render_template
+from flask import Response, current_app, g, has_app_context, jsonify, render_template
 from .helpers import clear_json_quotes, get_class_plural_name, parse_argdict, to_jsondict
 
 
 class ResponseType:
     """
     East response generator baseclass
+
+    Response types can accept request parameters of their own, in `params` -
+    they are parsed and validated together with the endpoint's parameters,
+    and documented with them, but kept in `g.east_response_params` instead
+    of being passed to the endpoint.
     """
 
     content_type = 'text/plain'
     description = 'Response description'
     status = 200
+    params = []
 
     @classmethod
     def format(cls, obj):
         """Return a representation of `obj` for an API response"""
         raise NotImplementedError
 
+    @classmethod
+    def serialize(cls, obj):
+        """Convert `obj` to an encodable structure, first step of `format`"""
+        return obj
+
+    @classmethod
+    def encode(cls, data):
+        """Encode serialized `data` as the response body, second step of `format`"""
+        return cls.format(data)
+
     @classmethod
     def document(cls):
         """Return a dictionary describing ResponseType's expected return values"""
@@ -44,57 +61,234 @@ class JSON(ResponseType):
 
     Constructor options include: specifying object type, passing kwargs for conversion,
     appending extra fields to the result
+
+    Lists of models declared with `rows=True` are serialized in row mode - the
+    endpoint's select query (or query template call) is executed with only
+    the view's columns, and the rows are turned into dictionaries directly,
+    see `EastModel.row_view`.
+
+    Models serialized with a view accept the `fields` request parameter, a
+    comma-separated subset of the view's fields, to which the response is
+    narrowed - in row mode, so are the selected columns and joins. It can be
+    turned off with `fields=False`.
+
+    Lists declared with `by_id=<view>` can also be requested by id - the
+    endpoint returns `ByID(ids, query)` instead of its listing, and the found
+    models are serialized in that view, in row mode, in the order of the
+    ids. Each id is listed once, those without a model as
+    `{"id": integer, "missing": true}`.
     """
 
     content_type = 'application/json'
     description = 'JSON-formatted response'
     status = 200
 
-    def __init__(self, *args, view=None, extras={}):
+    def __init__(self, *args, view=None, extras={}, rows=False, fields=True, by_id=None):
         self.format = self._format
+        self.serialize = self._serialize
         self.document = self._document
 
         self.type = args[0] if args else None
         self.view = view
         self.extras = extras
+        self.rows = rows
+        self.by_id = by_id
+
+        base_item = self.type[0] if isinstance(self.type, list) else self.type
+        self.params = ([{
+            'name': 'fields',
+            'type': str,
+            'default': None,
+            'auto_fill': True,
+            'validator': self._parse_fields,
+            'description': ('Comma-separated list of the fields to be returned, out of: %s '
+                            '(default: all of them).'
+                            % ', '.join('`%s`' % key for key in base_item.__serialization__[view]))
+        }] if fields and view and hasattr(base_item, '__serialization__') else [])
 
     @classmethod
     def format(cls, obj):
-        return jsonify({'data': to_jsondict(obj)})
+        return cls.encode(cls.serialize(obj))
+
+    @classmethod
+    def serialize(cls, obj):
+        return {'data': to_jsondict(obj)}
+
+    @classmethod
+    def encode(cls, data):
+        return jsonify(data)
 
     def _format(self, obj):
+        return self.encode(self._serialize(obj))
+
+    def _serialize(self, obj):
         parsed_obj = None
-        if hasattr(self, 'type') and isinstance(self.type, list):
+        fields = self._requested_fields()
+        if isinstance(obj, ByID):
+            parsed_obj = {get_class_plural_name(self.type[0]): self._serialize_by_id(obj)}
+        elif hasattr(self, 'type') and isinstance(self.type, list):
             parsed_obj = {get_class_plural_name(self.type[0]):
-                          [to_jsondict(elem, self.view) for elem in obj]}
+                          self.type[0].row_view(self.view, fields).serialize(obj) if self.rows else
+                          [self._to_jsondict(elem, fields) for elem in obj]}
         else:
-            parsed_obj = to_jsondict(obj, self.view)
+            parsed_obj = self._to_jsondict(obj, fields)
 
         if self.extras:
             parsed_obj.update(parse_argdict(self.extras))
 
-        return jsonify({'data': parsed_obj})
+        return {'data': parsed_obj}
+
+    def _serialize_by_id(self, obj):
+        model = self.type[0]
+        key = model._meta.primary_key.name
+        found = {item[key]: item for item in model.row_view(self.by_id).serialize(obj.query)}
+        return [found.get(id, {key: id, 'missing': True}) for id in dict.fromkeys(obj.ids)]
+
+    def _to_jsondict(self, obj, fields):
+        return obj.to_jsondict(self.view, fields) if fields else to_jsondict(obj, self.view)
+
+    def _requested_fields(self):
+        # Validated while the request's parameters were parsed
+        value = (g.get('east_response_params', {}).get('fields')
+                 if self.params and has_app_context() else None)
+        return self._parse_fields(value) if value is not None else None
+
+    def _parse_fields(self, value):
+        """Return the fields listed in `value`, in the view's order"""
+        allowed = (self.type[0] if isinstance(self.type, list) else self.type).__serialization__[self.view]
+        requested = {key.strip() for key in value.split(',')} - {''}
+        if not requested:
+            raise ValueError('No fields listed.')
+        unknown = requested.difference(allowed)
+        if unknown:
+            raise ValueError('Unknown fields: %s.' % ', '.join(sorted(unknown)))
+        return tuple(key for key in allowed if key in requested)
 
     def _document(self):
+        format = self._document_format(self.view)
+        if self.by_id:
+            format += '\n\nRequested by id:\n\n' + self._document_format(self.by_id)
+
+        return {
+            'content_type': self.content_type,
+            'description': self.description,
+            'format': format,
+            'status': self.status
+        }
+
+    def _document_format(self, view):
         format = ''
         base_item = self.type[0] if isinstance(self.type, list) else self.type
         if hasattr(base_item, 'document_response'):
-            base_format = base_item.document_response(self.view)
+            base_format = base_item.document_response(view)
             response_format = {'data':
                                {get_class_plural_name(self.type[0]): [base_format]}
                                if isinstance(self.type, list) else base_format}
             format = clear_json_quotes(json.dumps(response_format, indent=4,
                                                   separators=(', ', ': '),
                                                   sort_keys=True))
+        return '```js\n%s\n```' % format
+
+
+class ByID:
+    """
+    Models requested by their `ids`, found by a select `query` - returned by
+    endpoints whose JSON list type is declared with `by_id`
+    """
 
+    def __init__(self, ids, query):
+        self.ids = ids
+        self.query = query
+
+
+class JSONStream(ResponseType):
+    """
+    Streamed JSON response generator
+
+    The endpoint returns an iterable of items, which are serialized one by one
+    while the response is being sent, as the `key` list of the response data -
+    so that large results are neither held in memory nor delayed until fully
+    loaded. If the iterable is a generator, the dictionary it returns is added
+    to the data after the list, eg. to pass a pagination cursor.
+
+    Items are produced after the endpoint has returned, outside of the request
+    context, so the generator must not rely on it.
+    """
+
+    content_type = 'application/json'
+    description = 'Streamed JSON-formatted response'
+    status = 200
+
+    def __init__(self, key, view=None, buffer_size=16384):
+        self.key = key
+        self.view = view
+        self.buffer_size = buffer_size
+
+    def format(self, obj):
+        return self.encode(self.serialize(obj))
+
+    def encode(self, data):
+        encoder = current_app.json_encoder
+        return Response(self._generate(data, encoder), mimetype=self.content_type)
+
+    def _generate(self, items, encoder):
+        buffer, separator = ['{"data": {%s: [' % json.dumps(self.key)], ''
+        size, iterator = 0, iter(items)
+        while True:
+            try:
+                item = next(iterator)
+            except StopIteration as stop:
+                trailer = stop.value or {}
+                break
+            chunk = separator + json.dumps(to_jsondict(item, self.view), cls=encoder)
+            buffer.append(chunk)
+            separator, size = ', ', size + len(chunk)
+            if size >= self.buffer_size:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+
+        buffer.append(']')
+        buffer.extend(', %s: %s' % (json.dumps(k), json.dumps(v, cls=encoder))
+                      for k, v in sorted(trailer.items()))
+        buffer.append('}}\n')
+        yield ''.join(buffer)
+
+    def document(self):
         return {
             'content_type': self.content_type,
             'description': self.description,
-            'format': '```js\n%s\n```' % format,
+            'format': '```js\n{\n    "data": {\n        "%s": [...]\n    }\n}\n```' % self.key,
             'status': self.status
         }
 
 
+class EventStream(ResponseType):
+    """
+    Server-sent events response generator
+
+    The endpoint returns an `east.events.Subscription`, whose events are
+    streamed to the client until it disconnects. Under the ASGI adapter the
+    stream is produced on the event loop, so open connections don't hold any
+    threads.
+    """
+
+    content_type = 'text/event-stream'
+    description = 'Server-sent events stream'
+    status = 200
+
+    @classmethod
+    def format(cls, obj):
+        return cls.encode(cls.serialize(obj))
+
+    @classmethod
+    def encode(cls, subscription):
+        response = Response(subscription.stream(), mimetype=cls.content_type)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.east_async_body = subscription.stream_async
+        return response
+
+
 class HTML(ResponseType):
     """HTML response generator"""
 
@@ -105,4 +299,7 @@ class HTML(ResponseType):
         self.template = template
 
     def format(self, obj):
-        return render_template(self.template, **obj)
+        return self.encode(self.serialize(obj))
+
+    def encode(self, data):
+        return render_template(self.template, **data)
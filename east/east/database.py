@@ -6,15 +6,38 @@
     :copyright: (c) 2016 by Zvonimir Jurelinac
     :license: MIT
 """
+import atexit
 import inspect
+import os
+import queue
+import threading
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from time import monotonic, perf_counter
 
 from peewee import *
+from peewee import Expression, Func, ModelAlias, OP, Passthrough, Query, SelectQuery
+from playhouse.migrate import SchemaMigrator, migrate
 
 from .exceptions import *
 from .helpers import serialize, to_jsontype
+from .metrics import active_tracker
 
 
 class EastDatabase:
+    """
+    East extension of Peewee database
+
+    Maps database driver exceptions to BaseAPIException subclasses and reports
+    every executed query to the metrics tracker of the current request, if one
+    is active.
+
+    Queries can also be given a `deadline`, past which they fail with
+    QueryTimeoutError - a query is checked before it starts, and databases
+    which can interrupt a running statement (SQLite) do so.
+    """
+
     exceptions = {
         'ConstraintError': IntegrityViolationError,
         'DatabaseError': DatabaseError,
@@ -27,6 +50,98 @@ class EastDatabase:
         'ProgrammingError': APIInternalError
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._deadlines = threading.local()
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        if getattr(self._deadlines, 'at', None) is not None and self._deadline_passed():
+            raise QueryTimeoutError('Query started after the deadline.')
+        tracker = active_tracker()
+        if tracker is None:
+            return super().execute_sql(sql, params, require_commit)
+
+        started = perf_counter()
+        try:
+            return super().execute_sql(sql, params, require_commit)
+        finally:
+            tracker.query(perf_counter() - started)
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Limit the queries run by the current thread within the context to
+        `seconds` in total
+
+        The first query to run past the deadline fails, and any error it
+        causes is raised as QueryTimeoutError. The deadline is lifted then,
+        so that the transaction can still be rolled back. A nested deadline
+        can only make the enclosing one earlier.
+        """
+        state = self._deadlines
+        previous = getattr(state, 'at', None)
+        state.at = monotonic() + seconds if previous is None else min(previous, monotonic() + seconds)
+        state.expired = False
+        connection = self._watch_deadline()
+        try:
+            yield
+        except QueryTimeoutError:
+            raise
+        except Exception as e:
+            if state.expired:
+                raise QueryTimeoutError('Queries took longer than %g seconds.' % seconds) from e
+            raise
+        finally:
+            state.at = previous
+            if previous is None:
+                self._unwatch_deadline(connection)
+
+    def ensure_schema(self, models):
+        """
+        Bring the schema up to date with `models`, meant to run at startup
+
+        Missing tables are created, and missing columns and indexes are added
+        to the existing ones, all in a single transaction. Nothing is dropped
+        or altered - other changes need a migration of their own. Models must
+        be given in dependency order, like to `create_tables`.
+        """
+        migrator = SchemaMigrator.from_database(self)
+        compiler = self.compiler()
+        with self.atomic():
+            tables = set(self.get_tables())
+            for model in models:
+                table = model._meta.db_table
+                if table not in tables:
+                    model.create_table()
+                    continue
+
+                columns = {column.name for column in self.get_columns(table)}
+                indexes = {index.name for index in self.get_indexes(table)}
+                operations = [migrator.add_column(table, field.db_column, field.clone_base())
+                              for field in model._meta.sorted_fields
+                              if field.db_column not in columns]
+                for fields, unique in model._index_data():
+                    index_columns = [(model._meta.fields[field] if isinstance(field, str)
+                                      else field).db_column for field in fields]
+                    if compiler.index_name(table, index_columns) not in indexes:
+                        operations.append(migrator.add_index(table, index_columns, unique))
+                migrate(*operations)
+
+    def _deadline_passed(self):
+        # Called by the thread whose deadline it is, which is lifted once passed
+        state = self._deadlines
+        if state.at is None or monotonic() < state.at:
+            return False
+        state.at, state.expired = None, True
+        return True
+
+    def _watch_deadline(self):
+        """Start interrupting statements running past the deadline, if supported"""
+        return None
+
+    def _unwatch_deadline(self, connection):
+        pass
+
 
 class EastModel(Model):
     """
@@ -39,10 +154,23 @@ class EastModel(Model):
     Also, provides a `to_jsondict` method for direct model object
     serialization to JSON for returning responses from the API.
 
-    And finally, it supplies a `document_response` method for describing model
+    It supplies a `document_response` method for describing model
     instance's JSON representation defined using `__serialization__` class
     variable - return fields and their JSON datatypes. Aside from fields, it
     can also include methods, in which case it describes their return type.
+
+    Views can also be serialized straight from cursor rows (`row_view`),
+    without constructing model instances - methods in such views have to be
+    given columns to be computed from, in the `__row_fields__` class
+    variable, as `{name: (columns, function)}`, where the function receives
+    the columns' values.
+
+    And finally, models owned by a user can name the owner foreign key in the
+    `__owner__` class variable, enabling owner-scoped lookups and mutations
+    (`get_owned`, `update_owned`, `delete_owned`). Each of them costs a
+    single statement, comparing the raw foreign key value - telling apart a
+    missing instance from one owned by someone else takes another query, but
+    only on the error path.
     """
 
     _TYPE_MAP = {IntegerField: 'integer', BigIntegerField: 'Bigint',
@@ -53,14 +181,73 @@ class EastModel(Model):
                  DateField: 'Date', TimeField: 'Time',
                  TimestampField: 'Timestamp', BooleanField: 'bool'}
 
-    def to_jsondict(self, view=''):
-        """Serialize the model instance to a JSON-encodable dictionary"""
+    def to_jsondict(self, view='', fields=None):
+        """
+        Serialize the model instance to a JSON-encodable dictionary - only
+        the given `fields` of the view, if any
+        """
         if hasattr(self, '__serialization__') and view:
             return {key: serialize(getattr(self, key), view)
-                    for key in self.__serialization__[view]}
+                    for key in fields or self.__serialization__[view]}
         else:
             return self._data
 
+    @classmethod
+    def row_view(cls, view, fields=None):
+        """
+        Return the `RowView` serializing `view` from rows - only its `fields`
+        (a tuple), if given - built once per view and fields
+        """
+        row_view = _row_views.get((cls, view, fields))
+        if row_view is None:
+            row_view = _row_views[(cls, view, fields)] = RowView(cls, view, fields)
+        return row_view
+
+    @classmethod
+    def get_owned(cls, pk, owner, query=None):
+        """
+        Return the instance with primary key `pk` owned by `owner`
+
+        :param pk:      Primary key value
+        :param owner:   Owner model instance, or its primary key value
+        :param query:   Select query to use, eg. to join related models
+        """
+        query = query if query is not None else cls.select()
+        try:
+            return query.where(cls._owned_by(pk, owner)).get()
+        except DoesNotExist:
+            raise cls._ownership_error(pk, query)
+
+    @classmethod
+    def update_owned(cls, pk, owner, **values):
+        """Update the instance with primary key `pk` owned by `owner`"""
+        if cls.update(**values).where(cls._owned_by(pk, owner)).execute() == 0:
+            # MySQL counts only the rows an update has changed, so the
+            # instance may be there, already holding the values
+            if not cls.select().where(cls._owned_by(pk, owner)).exists():
+                raise cls._ownership_error(pk)
+
+    @classmethod
+    def delete_owned(cls, pk, owner):
+        """Delete the instance with primary key `pk` owned by `owner`"""
+        if cls.delete().where(cls._owned_by(pk, owner)).execute() == 0:
+            raise cls._ownership_error(pk)
+
+    @classmethod
+    def _owned_by(cls, pk, owner):
+        owner_id = owner._get_pk_value() if isinstance(owner, Model) else owner
+        return (cls._meta.primary_key == pk) & (getattr(cls, cls.__owner__) == owner_id)
+
+    @classmethod
+    def _ownership_error(cls, pk, query=None):
+        # The instance is looked for with the same query, so that instances
+        # it filters out are reported as missing rather than someone else's
+        name = cls.__name__.lower()
+        query = query if query is not None else cls.select()
+        if query.where(cls._meta.primary_key == pk).exists():
+            return AuthorizationError('Not allowed to access this %s.' % name)
+        return DoesNotExistError('%s with id `%s` does not exist.' % (cls.__name__, pk))
+
     @classmethod
     def document_response(cls, view):
         """Return a dictionary describing model's JSON representation"""
@@ -91,10 +278,384 @@ class EastModel(Model):
         return 'object'
 
 
+class RowView:
+    """
+    Serialization of a model view straight from cursor rows
+
+    A select query is executed with only the columns the view needs, and each
+    row is turned into the view's dictionary directly - instead of a model
+    instance (with its field data, dirty tracking and related object lookups)
+    serialized and thrown away. Columns of joined models, used by computed
+    fields, have to be joined by the query itself - LEFT OUTER joins which
+    none of the selected columns come from are dropped, see `select_only`.
+
+    A row view can be limited to some of the view's `fields`, which narrows
+    the selected columns too.
+    """
+
+    def __init__(self, model, view, fields=None):
+        self.model = model
+        self.view = view
+        self.fields = fields
+        self.columns = []
+        self._fields, self._computed = [], []
+        row_fields = getattr(model, '__row_fields__', {})
+        for key in fields or model.__serialization__[view]:
+            attr = getattr(model, key, None)
+            if isinstance(attr, Field):
+                self._fields.append((key, len(self.columns), _row_converter(attr)))
+                self.columns.append(attr)
+            elif key in row_fields:
+                columns, function = row_fields[key]
+                self._computed.append((key, len(self.columns), len(self.columns) + len(columns),
+                                       function))
+                self.columns.extend(columns)
+            else:
+                raise ValueError('Field `%s` of view `%s` of %s has no columns to be serialized from.'
+                                 % (key, view, model.__name__))
+
+    def serialize(self, obj):
+        """
+        Return the view's dictionaries of the rows of `obj`
+
+        `obj` can be a select query, a query template call, or any other
+        iterable of model instances, which are serialized as usual.
+        """
+        if isinstance(obj, _TemplateCall):
+            query, sql, params = obj.bind(row_view=self)
+        elif isinstance(obj, SelectQuery):
+            query = select_only(obj, self.columns)
+            sql, params = query.sql()
+        else:
+            return [item.to_jsondict(self.view, self.fields) for item in obj]
+        cursor = query.database.execute_sql(sql, params, require_commit=False)
+        return [self.to_dict(row) for row in cursor]
+
+    def to_dict(self, row):
+        """Return the view's dictionary of a row of its `columns`"""
+        data = {key: row[index] if convert is None or row[index] is None else convert(row[index])
+                for key, index, convert in self._fields}
+        for key, start, end, function in self._computed:
+            data[key] = function(*row[start:end])
+        return data
+
+
+def _row_converter(field):
+    # Values of these fields come from the driver just as they are serialized
+    if (isinstance(field, (IntegerField, FloatField, CharField, TextField)) and
+            not isinstance(field, TimestampField)):
+        return None
+    if isinstance(field, DateTimeField):
+        return lambda value: _row_datetime(field, value)
+    return lambda value: serialize(field.python_value(value))
+
+
+def _row_datetime(field, value):
+    # SQLite keeps datetimes as text, which only needs the ISO separator
+    if isinstance(value, str) and len(value) in (19, 26) and value[10] == ' ':
+        return value[:10] + 'T' + value[11:]
+    return serialize(field.python_value(value))
+
+
+_row_views = {}
+
+
+def select_only(query, columns):
+    """
+    Return a copy of select `query` selecting only `columns`, without the
+    joins none of them need
+
+    A join is dropped only if leaving it out can't change the rows - a LEFT
+    OUTER join to at most one row (on the joined model's primary key, or a
+    foreign key pointing to it), which has no joins of its own and isn't
+    referenced by any of the query's clauses.
+    """
+    query = query.select(*columns)
+    referenced = _models_of([columns, query._where, query._order_by, query._group_by,
+                             query._having])
+    for source, joins in query._joins.items():
+        query._joins[source] = [join for join in joins
+                                if join.dest in referenced or not _is_optional(query, join)]
+    return query
+
+
+def _is_optional(query, join):
+    if join.join_type != JOIN.LEFT_OUTER or query._joins.get(join.dest) or isinstance(join.dest, Query):
+        return False
+    dest = join.dest.model_class if isinstance(join.dest, ModelAlias) else join.dest
+    if join.on is None:
+        field, is_backref = join.get_foreign_key(join.src, dest)
+        return field is not None and not is_backref
+    on = join.on
+    return (isinstance(on, Expression) and on.op == OP.EQ and
+            any(isinstance(side, Field) and side.model_class is join.dest and
+                side.name == dest._meta.primary_key.name for side in (on.lhs, on.rhs)))
+
+
+def _models_of(nodes):
+    # Models and aliases whose fields appear anywhere in the query nodes
+    models, stack = set(), list(nodes)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Field):
+            models.add(node.model_class)
+        elif isinstance(node, Expression):
+            stack.extend((node.lhs, node.rhs))
+        elif isinstance(node, Clause):
+            stack.extend(node.nodes)
+        elif isinstance(node, Func):
+            stack.extend(node.arguments)
+        elif isinstance(node, SelectQuery):
+            stack.extend((node._select, node._where))
+            models.update(join.dest for joins in node._joins.values() for join in joins)
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+    return models
+
+
+class QueryTemplate:
+    """
+    Parameterized select query, compiled to SQL only once
+
+    Templates are declared as model class attributes - `build` receives the
+    model class and a placeholder for each of its other parameters, and
+    returns the select query. The query is built and compiled the first time
+    the template is used; after that, calling it (`Model.template(...)`) only
+    binds the parameter values to the cached SQL and executes it, and rows
+    are turned into model instances - joined models included - or tuples or
+    dicts, as the query asks, by Peewee's own result wrappers - or straight
+    into view dictionaries, by a `RowView`.
+
+    Placeholders can be compared to fields, but are bound as they are given
+    (model instances are replaced by their primary key), without the field's
+    conversion. Peewee compiles LIMIT and OFFSET as literals, so templates
+    declared with `paginate=True` add them as the `limit` and `offset`
+    keyword arguments instead.
+    """
+
+    def __init__(self, build, paginate=False):
+        self.build = build
+        self.paginate = paginate
+        self.parameters = list(inspect.signature(build).parameters)[1:]
+        self._compiled = {}
+
+    def __get__(self, instance, model):
+        return _BoundTemplate(self, model)
+
+    def compile(self, model, row_view=None):
+        """
+        Return the query of the template for `model`, its SQL and parameter
+        slots - selecting only the columns of `row_view`, if given
+        """
+        compiled = self._compiled.get((model, row_view))
+        if compiled is None:
+            query = self.build(model, *(Passthrough(_Placeholder(name)) for name in self.parameters))
+            if row_view is not None:
+                query = select_only(query, row_view.columns)
+            sql, slots = query.sql()
+            if self.paginate:
+                sql += ' LIMIT ? OFFSET ?'
+                slots = slots + [_Placeholder('limit'), _Placeholder('offset')]
+            # Compiling twice in a race is harmless, the results are the same
+            compiled = self._compiled[(model, row_view)] = (query, sql, slots)
+        return compiled
+
+    def bind(self, model, *args, row_view=None, limit=-1, offset=0, **kwargs):
+        """Return the template's query for `model`, its SQL and the parameters to execute it with"""
+        query, sql, slots = self.compile(model, row_view)
+        values = dict(zip(self.parameters, args), limit=limit, offset=offset, **kwargs)
+        return query, sql, [_db_param(values[slot.name]) if isinstance(slot, _Placeholder) else slot
+                            for slot in slots]
+
+    def execute(self, model, *args, **kwargs):
+        """Execute the template with the given parameter values, return the rows"""
+        query, sql, params = self.bind(model, *args, **kwargs)
+        cursor = query.database.execute_sql(sql, params, require_commit=False)
+        return query._get_result_wrapper()(query.model_class, cursor, query.get_query_meta())
+
+
+class _BoundTemplate:
+    def __init__(self, template, model):
+        self.template = template
+        self.model = model
+
+    def __call__(self, *args, **kwargs):
+        return _TemplateCall(self.template, self.model, args, kwargs)
+
+    def first(self, *args, **kwargs):
+        """Return the first row, or None if there are no rows"""
+        return next(iter(self(*args, **kwargs)), None)
+
+    def get(self, *args, **kwargs):
+        """Return the first row, raise the model's DoesNotExist if there are no rows"""
+        row = self.first(*args, **kwargs)
+        if row is None:
+            raise self.model.DoesNotExist('%s matching template parameters %s does not exist.'
+                                          % (self.model.__name__, args or kwargs))
+        return row
+
+
+class _TemplateCall:
+    """Template call with bound parameters, executed once iterated"""
+
+    def __init__(self, template, model, args, kwargs):
+        self.template = template
+        self.model = model
+        self.args = args
+        self.kwargs = kwargs
+
+    def __iter__(self):
+        return iter(self.template.execute(self.model, *self.args, **self.kwargs))
+
+    def bind(self, row_view=None):
+        return self.template.bind(self.model, *self.args, row_view=row_view, **self.kwargs)
+
+
+class _Placeholder:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _db_param(value):
+    return value._get_pk_value() if isinstance(value, Model) else value
+
+
+def write_transaction(database):
+    """
+    Return a transaction context manager for `database`, meant for writing
+
+    SQLite transactions begin IMMEDIATE, taking the write lock right away -
+    a deferred transaction which reads before it writes fails at once if
+    another one is writing, instead of waiting for the lock.
+    """
+    return database.atomic('IMMEDIATE' if isinstance(database, SqliteDatabase) else None)
+
+
+class GroupCommitWriter:
+    """
+    Group commit of small writes, performed by a single writer thread
+
+    Request handlers `submit` write operations - functions making a few
+    queries - instead of running them themselves. The writer runs whatever
+    operations have been queued in the meantime in a single transaction,
+    each one in a savepoint of its own, so many concurrent writers pay for
+    one commit and never contend for the write lock. Each caller gets the
+    result of its own operation, or its exception (which rolls back only
+    that operation), once the whole transaction is committed.
+
+    Operations run in the writer thread, without the request's context, and
+    should receive all the data they need as arguments. They must not be
+    submitted from within a transaction holding the write lock, which the
+    writer would wait for.
+    """
+
+    def __init__(self, database, max_batch=256, max_delay=0.0):
+        """
+        :param database:    Peewee database to write to
+        :param max_batch:   Maximal number of operations per transaction
+        :param max_delay:   Seconds to wait for more operations before
+                            committing a batch - by default, only operations
+                            queued while the previous batch was committed
+                            are grouped
+        """
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a call of `fn(*args, **kwargs)`, return its `Future`"""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Call `fn(*args, **kwargs)` in the writer, wait for and return its result"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self, timeout=None):
+        """Commit the queued operations and stop the writer thread"""
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _ensure_thread(self):
+        # A forked process doesn't inherit the thread, and starts its own
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='east-writer', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.max_delay
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - monotonic()))
+                                 if self.max_delay else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch, running = batch[:-1], False
+            if batch:
+                self._commit(batch)
+        if not self.database.is_closed():
+            self.database.close()
+
+    def _commit(self, batch):
+        batch = [op for op in batch if op[0].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with write_transaction(self.database):
+                for future, fn, args, kwargs in batch:
+                    try:
+                        with self.database.atomic():
+                            outcomes.append((fn(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((None, e))
+        except Exception as e:
+            for future, *_ in batch:
+                future.set_exception(e)
+            return
+
+        for (future, *_), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
 # Extensions of peewee database classes with East exceptions
 
 class EastSqliteDatabase(EastDatabase, SqliteDatabase):
-    pass
+    # Number of virtual machine instructions between deadline checks
+    progress_interval = 1000
+
+    def _watch_deadline(self):
+        connection = self.get_conn()
+        connection.set_progress_handler(self._deadline_passed, self.progress_interval)
+        return connection
+
+    def _unwatch_deadline(self, connection):
+        # The connection may have been closed within the deadline
+        if not self.is_closed() and self.get_conn() is connection:
+            connection.set_progress_handler(None, 0)
 
 
 class EastMySQLDatabase(EastDatabase, MySQLDatabase):
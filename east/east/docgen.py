@@ -28,6 +28,7 @@ import shutil
 from collections import defaultdict
 from jinja2 import Environment, FileSystemLoader
 
+from .compression import precompress, precompress_directory
 from .helpers import EastMarkdownParser, OrderedDefaultDict, to_jsontype
 
 
@@ -78,6 +79,10 @@ class Docs:
 
         shutil.copytree(os.path.join(src_assets_path, 'styles'), dest_assets_path)
 
+        if self.config.get('EAST_COMPRESS_RESPONSES', False):
+            precompress(self.config['EAST_API_DOCS_LOCATION'])
+            precompress_directory(dest_assets_path)
+
     def make_route_doc(self, route):
         _docstring = inspect.getdoc(route['endpoint'])
         if _docstring:
@@ -95,9 +100,10 @@ class Docs:
             'required': param['default'] is inspect._empty,
             'default': (param['default']
                         if param['default'] is not inspect._empty else None),
-            'description': self.param_docs[param['name']]['description'],
+            'description': (param.get('description') or
+                            self.param_docs[param['name']]['description']),
             'example': self.param_docs[param['name']]['example'] or None
-        } for param in route['params']]
+        } for param in route['params'] + route['response_params']]
 
         return {
             'id': route['endpoint'].__name__,
@@ -0,0 +1,284 @@
+"""
+    east.events
+    ===========
+    In-process publish/subscribe of server-sent events (SSE), with pluggable
+    backends for delivering events across processes
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import asyncio
+import json
+import threading
+
+from collections import defaultdict, deque, namedtuple
+from itertools import count
+
+from .exceptions import ServiceOverloadedError
+
+
+Event = namedtuple('Event', ('id', 'type', 'data'))
+
+
+class EventBroker:
+    """
+    Publish/subscribe hub for server-sent events
+
+    Events are published to a channel (eg. a user id) and delivered to every
+    subscription of that channel in this process. How published events get to
+    the brokers - and which events can be replayed to a client reconnecting
+    with the id of the last event it received - is up to the backend:
+    `LocalBackend` works within a single process, backends for multi-process
+    deployments share events through eg. the database.
+
+    Every subscription buffers at most `buffer_size` undelivered events. A
+    subscriber which falls behind is disconnected rather than slowing down
+    publishers, and catches up by reconnecting with its last event id.
+
+    Under a WSGI server each open stream holds one of the server's threads
+    for as long as it is open, so the number of subscriptions in a process
+    is capped by `max_subscriptions` - keep it below the number of request
+    threads, so that the rest of the API stays available. Subscriptions
+    over the limit fail with ServiceOverloadedError.
+    """
+
+    def __init__(self, backend=None, buffer_size=256, heartbeat=15.0, retry=3.0,
+                 max_subscriptions=None):
+        """
+        :param backend:             Event backend (default: LocalBackend)
+        :param buffer_size:         Maximal number of undelivered events per
+                                    subscription
+        :param heartbeat:           Seconds of inactivity after which a
+                                    heartbeat comment is sent, to keep
+                                    connections open
+        :param retry:               Seconds clients should wait before
+                                    reconnecting
+        :param max_subscriptions:   Maximal number of open subscriptions in
+                                    this process (default: unlimited)
+        """
+        self.backend = backend if backend is not None else LocalBackend()
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.retry = retry
+        self.max_subscriptions = max_subscriptions
+
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self.backend.attach(self._deliver)
+
+    def publish(self, channel, type, data, id=None):
+        """Publish an event of `type` with JSON-encodable `data` to `channel`"""
+        self.backend.publish(channel, Event(id, type, data))
+
+    def subscribe(self, channel, last_event_id=None):
+        """
+        Subscribe to events of `channel`
+
+        If `last_event_id` is given, events published after it which the
+        backend can still replay are delivered first.
+        """
+        subscription = Subscription(self, channel)
+        with self._lock:
+            if (self.max_subscriptions is not None and
+                    sum(len(s) for s in self._subscriptions.values()) >= self.max_subscriptions):
+                raise ServiceOverloadedError('Too many open event streams, try again later.',
+                                             retry_after=self.retry)
+            self._subscriptions[channel].add(subscription)
+        self.backend.watch(channel)
+        if last_event_id is not None:
+            subscription.backlog = self.backend.replay(channel, last_event_id)
+        return subscription
+
+    def subscriber_count(self, channel=None):
+        """Return the number of subscriptions, to `channel` or in total"""
+        with self._lock:
+            if channel is not None:
+                return len(self._subscriptions.get(channel, ()))
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def close(self):
+        """
+        End all subscriptions, eg. when the process is shutting down - their
+        streams finish right away, and clients reconnect elsewhere
+        """
+        with self._lock:
+            subscriptions = [s for channel in self._subscriptions.values() for s in channel]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def _deliver(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription._push(event)
+
+
+class Subscription:
+    """
+    Subscription of a single client to a channel
+
+    Produces the SSE stream sent to the client, either synchronously
+    (`stream`, for WSGI servers) or asynchronously (`stream_async`, used by
+    the ASGI adapter).
+    """
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.backlog = []
+        self.overflowed = False
+        self.closed = False
+
+        self._events = deque()
+        self._replayed = set()
+        self._condition = threading.Condition()
+        self._waiter = None
+
+    def get(self, timeout=None):
+        """Return the next event, or None if there is none within `timeout` seconds"""
+        with self._condition:
+            if not self._events and not self.overflowed and not self.closed:
+                self._condition.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    async def get_async(self, timeout=None):
+        """Coroutine version of `get`, to be awaited on the event loop"""
+        with self._condition:
+            if self._events or self.overflowed or self.closed:
+                return self._events.popleft() if self._events else None
+            loop = asyncio.get_event_loop()
+            waiter = self._waiter = (loop, loop.create_future())
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._condition:
+            self._waiter = None
+            return self._events.popleft() if self._events else None
+
+    def stream(self):
+        """Generate the SSE stream of this subscription"""
+        try:
+            yield 'retry: %d\n\n' % (self.broker.retry * 1000)
+            for event in self.backlog:
+                yield self._format(event, replayed=True)
+            while not self.closed:
+                event = self.get(self.broker.heartbeat)
+                if event is None and (self.overflowed or self.closed):
+                    break
+                chunk = self._format(event)
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    async def stream_async(self):
+        """Generate the SSE stream of this subscription, asynchronously"""
+        try:
+            yield 'retry: %d\n\n' % (self.broker.retry * 1000)
+            for event in self.backlog:
+                yield self._format(event, replayed=True)
+            while not self.closed:
+                event = await self.get_async(self.broker.heartbeat)
+                if event is None and (self.overflowed or self.closed):
+                    break
+                chunk = self._format(event)
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """End the subscription, waking up its stream if it is waiting for events"""
+        self.closed = True
+        self.broker._unsubscribe(self)
+        with self._condition:
+            self._condition.notify_all()
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            waiter[0].call_soon_threadsafe(_resolve, waiter[1])
+
+    def _push(self, event):
+        with self._condition:
+            if len(self._events) >= self.broker.buffer_size:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._condition.notify()
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            waiter[0].call_soon_threadsafe(_resolve, waiter[1])
+
+    def _format(self, event, replayed=False):
+        if event is None:
+            return ': heartbeat\n\n'
+        # Replayed events may be delivered live as well. Live events aren't
+        # necessarily published in id order, so only the replayed ids are skipped
+        if event.id is not None:
+            if replayed:
+                self._replayed.add(event.id)
+            elif event.id in self._replayed:
+                self._replayed.discard(event.id)
+                return ''
+        lines = ['id: %s' % event.id] if event.id is not None else []
+        lines.append('event: %s' % event.type)
+        lines.extend('data: %s' % line for line in json.dumps(event.data).splitlines())
+        return '\n'.join(lines) + '\n\n'
+
+
+class LocalBackend:
+    """
+    Single-process event backend
+
+    Backends implement `attach(deliver)`, called once with the broker's
+    delivery function, `watch(channel)`, called when a subscription to
+    `channel` is opened, `publish(channel, event)` and
+    `replay(channel, last_event_id)`.
+
+    Delivers events directly to the broker and keeps the last `history`
+    events of each channel for replay. Events published without an id get
+    one from a process-wide counter.
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+        self._deliver = None
+        self._events = defaultdict(lambda: deque(maxlen=self.history))
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def attach(self, deliver):
+        self._deliver = deliver
+
+    def watch(self, channel):
+        pass
+
+    def publish(self, channel, event):
+        with self._lock:
+            if event.id is None:
+                event = event._replace(id=next(self._ids))
+            self._events[channel].append(event)
+        self._deliver(channel, event)
+
+    def replay(self, channel, last_event_id):
+        with self._lock:
+            return [event for event in self._events.get(channel, ()) if event.id > last_event_id]
+
+    def clear(self):
+        """Forget all events kept for replay"""
+        with self._lock:
+            self._events.clear()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
@@ -8,6 +8,8 @@
     :license: MIT
 """
 
+import math
+
 from flask import jsonify
 
 
@@ -108,6 +110,11 @@ class DoesNotExistError(DatabaseError):
     status_code = 404
 
 
+class QueryTimeoutError(DatabaseError):
+    """Database queries took longer than the time budget of the request."""
+    status_code = 503
+
+
 class ImpossibleRelationshipError(BaseAPIException):
     """Cannot create an impossible relationship."""
     status_code = 400
@@ -139,4 +146,30 @@ class UnknownUserError(JWTException):
 
 class AuthorizationError(BaseAPIException):
     """User not allowed to perform this operation."""
-    status_code = 403
\ No newline at end of file
+    status_code = 403
+
+
+# Load shedding exceptions
+
+class RetryLaterError(BaseAPIException):
+    """Request was rejected, but can be retried after `retry_after` seconds."""
+    status_code = 503
+
+    def __init__(self, description='', retry_after=1, **kwargs):
+        super().__init__(description, **kwargs)
+        self.retry_after = retry_after
+
+    def make_response(self):
+        response, status_code = super().make_response()
+        response.headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return response, status_code
+
+
+class RateLimitExceededError(RetryLaterError):
+    """Client has made too many requests."""
+    status_code = 429
+
+
+class ServiceOverloadedError(RetryLaterError):
+    """Server is handling too many requests at once."""
+    status_code = 503
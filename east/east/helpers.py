@@ -8,9 +8,11 @@
 """
 
 import mistune
+import threading
 
 from collections import OrderedDict
 from datetime import date, datetime
+from time import monotonic
 
 from pygments import highlight
 from pygments.lexers import get_lexer_by_name
@@ -39,6 +41,11 @@ def to_jsontype(type):
     return typename
 
 
+def response_size(response):
+    """Return the body size of a response, or None if the response is streamed"""
+    return None if response.is_streamed else response.calculate_content_length()
+
+
 # Meta functions
 
 def clear_json_quotes(json_data):
@@ -122,6 +129,57 @@ class OrderedDefaultDict(OrderedDict):
                                                super().__repr__())
 
 
+class LRUCache:
+    """
+    Thread-safe mapping of bounded size
+
+    Once `maxsize` entries are stored, setting a new one evicts the least
+    recently used entry. If `ttl` is given, entries also expire that many
+    seconds after being set - which bounds how long an entry can stay stale
+    in processes that don't see the invalidation of its source.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value stored under `key`, or `default` if there is none"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] is not None and entry[1] < monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        """Store `value` under `key`"""
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Remove the entry stored under `key`, if any"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class EastMarkdownParser:
     """
     Custom markdown parser
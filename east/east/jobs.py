@@ -0,0 +1,309 @@
+"""
+    east.jobs
+    =========
+    Durable background jobs - an SQLite-backed job queue and the worker pool
+    running its jobs
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import json
+import os
+import threading
+
+from datetime import datetime
+from time import monotonic, time
+
+from peewee import *
+
+from .database import EastModel, write_transaction
+
+
+class Job(EastModel):
+    """
+    Queued job - a call of a task function with JSON-encodable arguments
+
+    Jobs are `queued` until they are due (`run_at`), `running` while a
+    worker holds their lease (`locked_until`), and end up `done` or, once
+    all of their attempts have failed, `failed`. A job whose worker died is
+    taken over by another one when its lease expires, or fails if that was
+    its last attempt.
+    """
+
+    task = CharField(max_length=128)
+    _args = TextField()
+    owner = IntegerField(null=True)
+    status = CharField(max_length=16, default='queued')
+    priority = IntegerField(default=0)
+    attempts = IntegerField(default=0)
+    max_attempts = IntegerField(default=5)
+    run_at = DoubleField()
+    locked_until = DoubleField(null=True)
+    _progress = TextField(null=True)
+    _result = TextField(null=True)
+    error = TextField(null=True)
+    date_created = DateTimeField(default=datetime.now)
+    date_finished = DateTimeField(null=True)
+
+    class Meta:
+        indexes = (
+            (('status', 'priority', 'run_at'), False),
+        )
+
+    __owner__ = 'owner'
+
+    __serialization__ = {
+        'status': ['id', 'task', 'status', 'attempts', 'max_attempts', 'progress', 'result',
+                   'error', 'date_created', 'date_finished']
+    }
+
+    def progress(self, view=None) -> dict:
+        return json.loads(self._progress) if self._progress is not None else None
+
+    def result(self, view=None) -> dict:
+        return json.loads(self._result) if self._result is not None else None
+
+
+class JobQueue:
+    """
+    Durable job queue, kept in a table of the application's database
+
+    Route handlers `enqueue` calls of registered tasks - within their own
+    transaction, so a job is queued only if the request's writes are
+    committed - and usually respond with 202 and the job's status URL.
+    Jobs are run by a pool of `workers` threads in each process which calls
+    `start`; processes sharing the database share the queue, as jobs are
+    claimed in write transactions.
+
+    Jobs are picked by descending `priority`, then by age. A failing job is
+    retried after `backoff` seconds, doubled with each attempt (up to
+    `max_backoff`), until it runs out of attempts.
+    """
+
+    def __init__(self, database, workers=2, poll_interval=1.0, lease=300, backoff=2.0,
+                 max_backoff=3600, metrics=None, logger=None, table='east_job'):
+        """
+        :param database:        Peewee database holding the queue
+        :param workers:         Number of worker threads per process
+        :param poll_interval:   Seconds an idle worker waits before looking
+                                for jobs queued by other processes
+        :param lease:           Seconds a job is held by its worker, unless
+                                it reports progress in the meantime
+        :param backoff:         Seconds before the first retry of a failed job
+        :param max_backoff:     Maximal number of seconds before a retry
+        :param metrics:         `MetricsRegistry` collecting job metrics
+        :param logger:          `StructuredLogger` for finished and failed jobs
+        :param table:           Name of the queue table
+        """
+        self.database = database
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self.logger = logger
+        self.model = type('Job', (Job,), {'Meta': type('Meta', (), {'database': database,
+                                                                     'db_table': table}),
+                                          '__module__': __name__})
+
+        self._tasks = {}
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def task(self, name=None, max_attempts=5, priority=0):
+        """
+        Register the decorated function as a task
+
+        :param name:            Task name (default: the function's name)
+        :param max_attempts:    Number of times a job is run before it fails
+        :param priority:        Default priority of the task's jobs
+        """
+        def decorator(fn):
+            self._tasks[name or fn.__name__] = (fn, max_attempts, priority)
+            fn.task_name = name or fn.__name__
+            return fn
+        return decorator
+
+    def enqueue(self, task, *args, owner=None, priority=None, delay=0, **kwargs):
+        """
+        Queue a call of `task` (a task function or its name), return the job
+
+        :param owner:       Id of the user allowed to see the job's status
+        :param priority:    Priority overriding the task's default one
+        :param delay:       Seconds before the job is due
+        """
+        name = getattr(task, 'task_name', task)
+        if name not in self._tasks:
+            raise ValueError('Unknown task `%s`.' % name)
+        _, max_attempts, default_priority = self._tasks[name]
+        job = self.model.create(task=name, _args=json.dumps([args, kwargs]), owner=owner,
+                                priority=priority if priority is not None else default_priority,
+                                max_attempts=max_attempts, run_at=time() + delay)
+        self.wake()
+        return job
+
+    def wake(self):
+        """Have an idle worker of this process look for jobs right away"""
+        self._wakeup.set()
+
+    def current(self):
+        """Return the job being run on this thread, or None"""
+        return getattr(self._local, 'job', None)
+
+    def report(self, **progress):
+        """
+        Store the progress of the job being run on this thread
+
+        The progress is shown in the job's status, and reporting it renews
+        the worker's lease of the job, so that long jobs aren't taken over.
+        Nothing is stored once the job has been taken over by another worker.
+        """
+        Job, job = self.model, self.current()
+        job._progress = json.dumps(progress)
+        (Job.update(_progress=job._progress, locked_until=time() + self.lease)
+         .where((Job.id == job.id) & (Job.attempts == job.attempts)).execute())
+
+    def start(self):
+        """
+        Start the worker pool in this process, if it isn't running yet
+
+        A forked process starts a pool of its own, as threads don't survive
+        the fork - with a prefork server, call it in each worker process.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._work, name='east-jobs-%d' % i,
+                                              daemon=True) for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker pool, waiting for up to `timeout` seconds for running jobs"""
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads, self._pid = [], None
+
+    def run_pending(self):
+        """Run all due jobs in the calling thread, return their number"""
+        count = 0
+        job = self._claim()
+        while job is not None:
+            self._run(job)
+            count += 1
+            job = self._claim()
+        return count
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                self._log_error('job_claim_failed', e)
+                job = None
+            if job is not None:
+                try:
+                    self._run(job)
+                except Exception as e:
+                    self._log_error('job_update_failed', e, id=job.id, task=job.task)
+                continue
+            if not self.database.is_closed():
+                self.database.close()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim(self):
+        # Idle polls only read, the write lock is taken once there is a job to
+        # claim - and the claim only succeeds if no other worker has made it
+        # in between, otherwise the next due job is tried
+        Job = self.model
+        while True:
+            now = time()
+            due = (((Job.status == 'queued') |
+                    ((Job.status == 'running') & (Job.locked_until < now))) &
+                   (Job.run_at <= now))
+            job = Job.select().where(due).order_by(Job.priority.desc(), Job.run_at, Job.id).first()
+            if job is None:
+                return None
+            if job.status == 'running' and job.attempts >= job.max_attempts:
+                # Lease of the last attempt expired, the task may well be what
+                # keeps killing its workers - so it isn't run again
+                self._fail_abandoned(job, due)
+                continue
+            job.status, job.attempts, job.locked_until = 'running', job.attempts + 1, now + self.lease
+            with write_transaction(self.database):
+                claimed = (Job.update(status=job.status, attempts=job.attempts,
+                                      locked_until=job.locked_until)
+                           .where((Job.id == job.id) & due).execute())
+            if claimed:
+                break
+        if self.metrics is not None:
+            self.metrics.observe('job_wait_seconds', (('task', job.task),), (now - job.run_at) * 1e6)
+        return job
+
+    def _fail_abandoned(self, job, due):
+        Job = self.model
+        with write_transaction(self.database):
+            failed = (Job.update(status='failed', locked_until=None, date_finished=datetime.now(),
+                                 error='Lease of the last attempt expired.')
+                      .where((Job.id == job.id) & (Job.attempts == job.attempts) & due).execute())
+        if not failed:
+            return
+        if self.metrics is not None:
+            self.metrics.increment('jobs_total', (('task', job.task), ('status', 'failed')))
+        self._log_error('job_abandoned', None, id=job.id, task=job.task, attempt=job.attempts)
+
+    def _run(self, job):
+        Job, started = self.model, monotonic()
+        self._local.job = job
+        try:
+            if job.task not in self._tasks:
+                raise LookupError('Unknown task `%s`.' % job.task)
+            args, kwargs = json.loads(job._args)
+            result = self._tasks[job.task][0](*args, **kwargs)
+        except Exception as e:
+            retry = job.attempts < job.max_attempts and not isinstance(e, LookupError)
+            status, values = ('queued' if retry else 'failed'), {'error': '%s: %s' % (type(e).__name__, e)}
+            if retry:
+                values['run_at'] = time() + min(self.backoff * 2 ** (job.attempts - 1), self.max_backoff)
+            else:
+                values['date_finished'] = datetime.now()
+            self._log_error('job_failed', e, id=job.id, task=job.task, attempt=job.attempts,
+                            retry=retry)
+        else:
+            status, values = 'done', {'_result': json.dumps(result) if result is not None else None,
+                                      'error': None, 'date_finished': datetime.now()}
+        finally:
+            self._local.job = None
+
+        duration = monotonic() - started
+        updated = (Job.update(status=status, locked_until=None, **values)
+                   .where((Job.id == job.id) & (Job.attempts == job.attempts)).execute())
+        if not updated:
+            # Lease expired and the job was claimed again, its new attempt owns it now
+            self._log_error('job_lease_lost', None, id=job.id, task=job.task, attempt=job.attempts,
+                            status=status, duration=round(duration, 3))
+            return
+        if self.metrics is not None:
+            labels = (('task', job.task),)
+            outcome = 'retried' if status == 'queued' else status
+            self.metrics.increment('jobs_total', labels + (('status', outcome),))
+            self.metrics.observe('job_duration_seconds', labels, duration * 1e6)
+        if self.logger is not None and status == 'done':
+            self.logger.info('job', id=job.id, task=job.task, attempt=job.attempts,
+                             duration=round(duration, 3))
+
+    def _log_error(self, event, exc, **fields):
+        if self.logger is not None:
+            self.logger.error(event, exc=exc, **fields)
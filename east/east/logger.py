@@ -0,0 +1,151 @@
+"""
+    east.logger
+    ===========
+    Non-blocking structured logger - records are queued by request threads and
+    written out as JSON lines by a background thread
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+
+
+class StructuredLogger:
+    """
+    Queue-backed JSON lines logger
+
+    Logging a record costs a dictionary construction and a non-blocking queue
+    put - formatting, serialization and I/O are all done by a background
+    writer thread, which drains the queue in batches. The queue is bounded:
+    when it is full, new records are dropped and counted instead of blocking
+    the caller.
+
+    Successful requests are sampled (`sample_rate` is the fraction of them
+    that is kept), while errors are always logged. Exceptions are captured
+    as `traceback.TracebackException`s, without their source lines - queued
+    records don't keep tracebacks' frames alive, and the tracebacks are
+    formatted by the writer thread too.
+    """
+
+    def __init__(self, path=None, queue_size=10000, batch_size=256,
+                 flush_interval=1.0, sample_rate=1.0):
+        """
+        :param path:            Output file, records are appended to it;
+                                standard error is used if not given
+        :param queue_size:      Maximal number of records waiting to be written
+        :param batch_size:      Maximal number of records written at once
+        :param flush_interval:  Maximal time (in seconds) a record can wait
+                                in the queue
+        :param sample_rate:     Fraction of successful requests to be logged
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+
+        self.dropped = 0
+        self.written = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._pid = None
+
+    def info(self, event, **fields):
+        """Log an informational record"""
+        self._enqueue(dict(fields, event=event, level='info'))
+
+    def error(self, event, exc=None, **fields):
+        """Log an error record, with the traceback of `exc` if given"""
+        self._enqueue(dict(fields, event=event, level='error'), exc)
+
+    def request(self, error=False, **fields):
+        """Log a request record, subject to sampling unless it is an `error`"""
+        if error or self.sample_rate >= 1 or random.random() < self.sample_rate:
+            self._enqueue(dict(fields, event='request', level='error' if error else 'info'))
+
+    def flush(self):
+        """Wait until all currently queued records are written"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.join()
+
+    def _enqueue(self, record, exc=None):
+        record['time'] = time.time()
+        if self._pid != os.getpid():
+            self._start_writer()
+        if self._queue.full():
+            self.dropped += 1
+            return
+        if exc is not None:
+            record['exception'] = _capture_exception(exc)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_writer(self):
+        # Writer thread doesn't survive a fork, so each process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._writer is not None:
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._writer = threading.Thread(target=self._write_loop, name='east-logger',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._writer.start()
+
+    def _write_loop(self):
+        stream = open(self.path, 'a', buffering=1) if self.path else sys.stderr
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                stream.write(''.join(_to_json_line(record) for record in batch))
+                stream.flush()
+                self.written += len(batch)
+            except Exception:
+                self.dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+def _capture_exception(exc):
+    # Older Pythons keep the traceback on TracebackException, unused by format()
+    captured = traceback.TracebackException.from_exception(exc, lookup_lines=False)
+    chain = [captured]
+    while chain:
+        exc = chain.pop()
+        if hasattr(exc, 'exc_traceback'):
+            exc.exc_traceback = None
+        chain.extend(e for e in (exc.__cause__, exc.__context__) if e is not None)
+    return captured
+
+
+def _format_exception(exc):
+    return {
+        'type': exc.exc_type.__name__,
+        'message': str(exc),
+        'traceback': ''.join(exc.format())
+    }
+
+
+def _to_json_line(record):
+    if 'exception' in record:
+        record = dict(record, exception=_format_exception(record['exception']))
+    return json.dumps(record, default=str, sort_keys=True) + '\n'
@@ -0,0 +1,277 @@
+"""
+    east.metrics
+    ============
+    Request instrumentation - per-route phase timings, SQL query counts and
+    durations and response sizes, aggregated into HDR-style histograms and
+    rendered in the Prometheus text exposition format
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import threading
+
+from collections import OrderedDict
+from time import perf_counter
+
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative integer values
+
+    Values are counted in log-linear buckets: every power of two is split
+    into `2 ** precision` equally wide sub-buckets, so the relative error of
+    any reported percentile is bounded by `2 ** -precision` over the whole
+    value range, while recording a value costs only a couple of integer
+    operations and a dictionary update.
+    """
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        """Record a single value (negative values are clamped to zero)"""
+        value = int(value) if value > 0 else 0
+        shift = value.bit_length() - self.precision - 1
+        index = value if shift < 0 else (shift << self.precision) + (value >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def bucket_bounds(self, index):
+        """Return the (lowest, highest) value counted in the given bucket"""
+        shift = (index >> self.precision) - 1
+        if shift <= 0:
+            return index, index
+        top = index - (shift << self.precision)
+        return top << shift, ((top + 1) << shift) - 1
+
+    def percentile(self, p):
+        """Return the (upper bound of the) value below which `p`% of values fall"""
+        if not self.count:
+            return 0
+        threshold, seen = self.count * p / 100, 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self.bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def copy(self):
+        histogram = Histogram(self.precision)
+        histogram.counts = dict(self.counts)
+        histogram.count, histogram.total, histogram.max = self.count, self.total, self.max
+        return histogram
+
+
+class RequestTracker:
+    """
+    Collects measurements of a single request
+
+    Phase durations are measured between successive `mark` calls, database
+    queries are reported by `EastDatabase` for the request active on the
+    current thread. Everything is handed over to the registry at once, when
+    the request is finished.
+    """
+
+    __slots__ = ('registry', 'route', 'started', 'last', 'phases',
+                 'query_count', 'query_time')
+
+    def __init__(self, registry, route):
+        self.registry = registry
+        self.route = route
+        self.started = self.last = perf_counter()
+        self.phases = []
+        self.query_count = 0
+        self.query_time = 0.0
+
+    def mark(self, phase):
+        """Finish the current phase, giving it the name `phase`"""
+        now = perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def query(self, duration):
+        """Account a single executed database query"""
+        self.query_count += 1
+        self.query_time += duration
+
+    def finish(self, status, size):
+        """Record request measurements into the registry"""
+        self.registry.record_request(self, perf_counter() - self.started, status, size)
+
+
+class NullTracker:
+    """Stand-in for `RequestTracker` when metrics collection is disabled"""
+
+    __slots__ = ()
+
+    def mark(self, phase):
+        pass
+
+
+NULL_TRACKER = NullTracker()
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of all collected metrics
+
+    Durations are kept in microseconds and sizes in bytes; the exposition
+    format converts durations to seconds, as is the Prometheus convention.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+    def __init__(self, namespace='east', precision=5):
+        self.namespace = namespace
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._histograms = OrderedDict()
+        self._counters = OrderedDict()
+        self._help = {}
+
+    def track(self, route, attach=True):
+        """
+        Start tracking a request of `route`
+
+        The tracker is attached to the current thread unless `attach` is
+        False - requests served by an event loop share its thread, so their
+        trackers are attached only to the threads running their queries.
+        """
+        tracker = RequestTracker(self, route)
+        if attach:
+            _local.tracker = tracker
+        return tracker
+
+    def record_request(self, tracker, duration, status, size):
+        route = (('route', tracker.route),)
+        with self._lock:
+            self._observe('request_duration_seconds', route, duration * 1e6)
+            for phase, elapsed in tracker.phases:
+                self._observe('request_phase_seconds', route + (('phase', phase),), elapsed * 1e6)
+            self._observe('response_size_bytes', route, size)
+            self._observe('db_queries_per_request', route, tracker.query_count)
+            self._observe('db_query_seconds', route, tracker.query_time * 1e6)
+            self._increment('requests_total', route + (('status', str(status)),))
+
+    def increment(self, name, labels=(), value=1):
+        """Increment a counter metric"""
+        with self._lock:
+            self._increment(name, tuple(labels), value)
+
+    def observe(self, name, labels=(), value=0):
+        """Record a value into a histogram metric"""
+        with self._lock:
+            self._observe(name, tuple(labels), value)
+
+    def describe(self, name, help_text):
+        """Set the help text shown for metric `name`"""
+        self._help[name] = help_text
+
+    def histogram(self, name, labels=()):
+        """Return a snapshot of the given histogram, or None if nothing was recorded"""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(labels)))
+            return histogram.copy() if histogram is not None else None
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = [(key, h.copy()) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+
+        # Samples of a metric family have to be grouped together
+        histograms.sort(key=lambda item: item[0][0])
+        counters.sort(key=lambda item: item[0][0])
+
+        lines, described = [], set()
+        for (name, labels), value in counters:
+            lines.extend(self._header(name, 'counter', described))
+            lines.append('%s%s %d' % (self._full_name(name), _format_labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            lines.extend(self._header(name, 'summary', described))
+            scale = 1e-6 if name.endswith('_seconds') else 1
+            full_name = self._full_name(name)
+            for q in self.QUANTILES:
+                lines.append('%s%s %s' % (full_name, _format_labels(labels + (('quantile', str(q)),)),
+                                          _format_value(histogram.percentile(q * 100) * scale)))
+            lines.append('%s_sum%s %s' % (full_name, _format_labels(labels),
+                                          _format_value(histogram.total * scale)))
+            lines.append('%s_count%s %d' % (full_name, _format_labels(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.precision)
+        histogram.record(value)
+
+    def _increment(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _full_name(self, name):
+        return '%s_%s' % (self.namespace, name) if self.namespace else name
+
+    def _header(self, name, kind, described):
+        if name in described:
+            return []
+        described.add(name)
+        full_name = self._full_name(name)
+        return ['# HELP %s %s' % (full_name, self._help.get(name, DEFAULT_HELP.get(name, name))),
+                '# TYPE %s %s' % (full_name, kind)]
+
+
+DEFAULT_HELP = {
+    'requests_total': 'Number of processed requests, by route and response status.',
+    'request_duration_seconds': 'Total time spent processing a request.',
+    'request_phase_seconds': 'Time spent in a single request processing phase.',
+    'response_size_bytes': 'Size of the response body.',
+    'db_queries_per_request': 'Number of SQL queries executed while processing a request.',
+    'db_query_seconds': 'Total time spent executing SQL queries, per request.',
+    'jobs_total': 'Number of finished job attempts, by task and outcome.',
+    'job_duration_seconds': 'Time spent running a single job attempt.',
+    'job_wait_seconds': 'Time a job waited in the queue after it was due.',
+    'query_timeouts_total': 'Number of requests whose queries ran past the route\'s deadline.',
+    'coalesced_requests_total': 'Number of requests given a copy of a concurrent identical '
+                                'request\'s response, by route.',
+}
+
+
+def active_tracker():
+    """Return the tracker of the request being processed on this thread, if any"""
+    return getattr(_local, 'tracker', None)
+
+
+def attach_tracker(tracker):
+    """Attach the current thread to the request tracked by `tracker`"""
+    _local.tracker = tracker
+
+
+def clear_tracker():
+    """Detach the current thread from the request it was tracking"""
+    _local.tracker = None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def _format_value(value):
+    return ('%.9f' % value).rstrip('0').rstrip('.') if isinstance(value, float) else str(value)
@@ -8,15 +8,25 @@
     :license: MIT
 """
 
+import hmac
 import inspect
 import os
 
+from contextlib import contextmanager
 from functools import wraps
-from flask import request, send_from_directory, make_response
+from flask import g, request, make_response, Response
 
+from .asgi import is_async_request, run_blocking, run_coroutine
+from .coalescing import SingleFlight
+from .compression import Compression, ENCODERS, ENCODINGS, send_precompressed
+from .database import write_transaction
 from .docgen import Docs
 from .exceptions import *
-from .security import jwt_required
+from .helpers import response_size
+from .metrics import MetricsRegistry, NULL_TRACKER, clear_tracker
+from .profiling import RequestProfiler
+from .ratelimit import ConcurrencyLimiter, RateLimit, RateLimiter
+from .security import decode_access_token, jwt_required
 
 
 class East:
@@ -26,9 +36,16 @@ class East:
     Description
     """
 
-    def __init__(self, flask_app):
-        """Create East object for the given `flask_app`"""
+    def __init__(self, flask_app, database=None):
+        """
+        Create East object for the given `flask_app`
+
+        :param flask_app:   Flask application
+        :param database:    Peewee database used by the API, required by
+                            transactional routes
+        """
         self._flask_app = flask_app
+        self._database = database
         self._validators = {}
         self._routes = {}
         self._exceptions = {}
@@ -38,6 +55,52 @@ class East:
         self._flask_app.add_url_rule(os.path.join(self._base_url, 'docs'), 'docs', self._serve_docs,
                                      methods=['GET'])
 
+        self._metrics = (MetricsRegistry()
+                         if flask_app.config.get('EAST_COLLECT_METRICS', False) else None)
+        if self._metrics is not None:
+            self._flask_app.add_url_rule(os.path.join(self._base_url, 'metrics'), 'metrics',
+                                         self._serve_metrics, methods=['GET'])
+            self._flask_app.after_request(self._finish_tracking)
+            self._flask_app.teardown_request(lambda exc: clear_tracker())
+
+        # Registered after the metrics hook, so that it runs before it and
+        # response sizes are counted as sent
+        self._compression = (Compression(encodings=flask_app.config.get('EAST_COMPRESS_ENCODINGS', ENCODINGS),
+                                         levels=flask_app.config.get('EAST_COMPRESS_LEVELS'),
+                                         min_size=flask_app.config.get('EAST_COMPRESS_MIN_SIZE', 512))
+                             if flask_app.config.get('EAST_COMPRESS_RESPONSES', False) else None)
+        if self._compression is not None:
+            self._flask_app.after_request(self._compression.compress_response)
+            if 'static' in self._flask_app.view_functions:
+                self._flask_app.view_functions['static'] = self._serve_static
+
+        self._single_flight = SingleFlight()
+        self._rate_limiter = RateLimiter()
+        self._default_rate_limits = ([RateLimit(*flask_app.config['EAST_RATE_LIMIT'], name='default')]
+                                     if flask_app.config.get('EAST_RATE_LIMIT') else [])
+        self._concurrency_limiter = (ConcurrencyLimiter(flask_app.config['EAST_MAX_CONCURRENT_REQUESTS'])
+                                     if flask_app.config.get('EAST_MAX_CONCURRENT_REQUESTS') else None)
+        if self._concurrency_limiter is not None:
+            self._flask_app.before_request(self._acquire_request_slot)
+            self._flask_app.teardown_request(self._release_request_slot)
+
+        self._profiler = (RequestProfiler(flask_app,
+                                          output_dir=flask_app.config.get('EAST_PROFILE_DIR', 'profiles'),
+                                          sample_rate=flask_app.config.get('EAST_PROFILE_SAMPLE_RATE', 0.01),
+                                          threshold=flask_app.config.get('EAST_PROFILE_THRESHOLD', 1.0),
+                                          interval=flask_app.config.get('EAST_PROFILE_INTERVAL', 0.01))
+                          if flask_app.config.get('EAST_PROFILE_REQUESTS', False) else None)
+
+    @property
+    def metrics(self):
+        """Metrics registry of the API, or None if metrics are not collected"""
+        return self._metrics
+
+    @property
+    def rate_limiter(self):
+        """Rate limiter of the API, its `backend` can be replaced by a shared one"""
+        return self._rate_limiter
+
     def register_validator(self, param_name: str, param_validator):
         """Register parameter validator, for all API routes"""
         self._validators[param_name] = param_validator
@@ -97,22 +160,81 @@ class East:
         if self._docs:
             self._docs.exceptions = self._exceptions
 
-    def route(self, base, url_rule: str, method: str = 'GET', auth: str = None):
+    def route(self, base, url_rule: str, method: str = 'GET', auth: str = None,
+              rate_limit=None, transactional: bool = False, etag=None,
+              coalesce: float = None, query_timeout: float = None):
         """
         API route decorator
 
-        :param base:    Flask app or Blueprint object, on which the endpoint
-                        should be added
-        :param route:   URL route rule (can include path variables) for the given
-                        endpoint
-        :param method:  HTTP method accepted by the endpoint (default: GET)
-        :param auth:    API authentication method, currently only 'JWT' is
-                        supported
+        :param base:            Flask app or Blueprint object, on which the
+                                endpoint should be added
+        :param route:           URL route rule (can include path variables) for
+                                the given endpoint
+        :param method:          HTTP method accepted by the endpoint (default: GET)
+        :param auth:            API authentication method, currently only 'JWT'
+                                is supported
+        :param rate_limit:      `east.ratelimit.RateLimit` policy, or a list of
+                                them, applied on top of the API-wide
+                                `EAST_RATE_LIMIT` - checked before any other
+                                work, including authentication
+        :param transactional:   Run the endpoint and the serialization of its
+                                output in a single database transaction,
+                                committed only if both succeed (streamed
+                                responses are produced after the commit) -
+                                callbacks registered with `on_commit` run
+                                after it
+        :param etag:            Function computing the ETag of the endpoint's
+                                current response, called with the endpoint's
+                                arguments before the endpoint - a request whose
+                                `If-None-Match` matches it gets an empty 304
+                                response without the endpoint being called.
+                                Responses are marked `Cache-Control: no-cache`
+                                (and `private` if authenticated), so that
+                                clients revalidate them
+        :param coalesce:        Coalesce concurrent identical requests (of the
+                                same user, with the same parameters) - only
+                                one of them runs the endpoint, while the others
+                                wait for up to `coalesce` seconds to be given
+                                a copy of its response. If it takes longer,
+                                fails, or is streamed, they run the endpoint
+                                themselves. Suits expensive read-only routes.
+                                Requests are coalesced only within a process -
+                                under a multi-process server, only those
+                                served by threads of the same worker
+        :param query_timeout:   Time budget, in seconds, of the queries run by
+                                the endpoint and the serialization of its
+                                output (not by streamed responses) - a query
+                                running past it is interrupted, and the
+                                request fails with QueryTimeoutError
+
+        The endpoint can be an `async def` function, served on the event loop
+        when the app runs under `east.asgi.ASGIAdapter` (and on a per-thread
+        loop otherwise). It should call blocking code through
+        `east.asgi.run_blocking` - response serialization, which can load
+        related models, is offloaded the same way.
         """
         def decorator(f):
-
+            if transactional and self._database is None:
+                raise ValueError('Transactional routes require East to be given a database.')
+            if transactional and inspect.iscoroutinefunction(f):
+                raise ValueError('Async routes cannot be transactional, their queries run '
+                                 'in different threads.')
+            if coalesce is not None and (transactional or inspect.iscoroutinefunction(f)):
+                raise ValueError('Only synchronous, non-transactional routes can be coalesced.')
+            if query_timeout is not None and self._database is None:
+                raise ValueError('Query timeouts require East to be given a database.')
+            if query_timeout is not None and inspect.iscoroutinefunction(f):
+                raise ValueError('Async routes cannot have query timeouts, their queries run '
+                                 'in different threads.')
+
+            key_fn = _coalescing_key(f, auth) if coalesce is not None else None
             if auth == 'JWT':
                 f = jwt_required(f)
+                # The response's ETag and coalescing depend on the user as well
+                etag_fn = jwt_required(etag) if etag is not None else None
+                key_fn = jwt_required(key_fn) if key_fn is not None else None
+            else:
+                etag_fn = etag
 
             params = [{
                 'default': param.default,
@@ -134,44 +256,118 @@ class East:
                 'endpoint': f,
                 'params': params,
                 'url_rule': url_rule,
-                'return': f.__annotations__['return'] or None
+                'return': f.__annotations__['return'] or None,
+                'response_params': getattr(f.__annotations__['return'], 'params', []),
+                'rate_limits': self._default_rate_limits + _as_list(rate_limit),
+                'transactional': transactional,
+                'etag': etag_fn,
+                'coalesce': coalesce,
+                'coalescing_key': key_fn,
+                'query_timeout': query_timeout
             }
 
             if self._docs:
                 self._docs.document_route(base, self._routes[f])
 
-            @wraps(f)
-            def decorated_function(*args, **parsed_params):
-                # REWRITE!!!
-                for param in self._routes[f]['params']:
-                    if param['auto_fill']:
-                        raw_value = _get_request_param(param['name'])
-                        if raw_value is None and param['default'] is inspect._empty:
-                            raise MissingParameterError('Parameter `%s` is not present in the request' % param['name'])
-                        try:
-                            parsed_value = param['type'](raw_value) if raw_value is not None else param['default']
-                            if param['validator'] is not None and raw_value is not None:
-                                param['validator'](parsed_value)
-                        except Exception as e:
-                            raise BadParameterError('Parameter `%s` is invalid [%s]' % (param['name'], e))
-                        parsed_params[param['name']] = parsed_value
-
-                output, status, headers = f(*args, **parsed_params), 200, []
-                if isinstance(output, tuple):
-                    if len(output) == 2:
-                        output, status = output
-                    elif len(output) == 3:
-                        output, status, headers = output
-                    else:
-                        raise APIInternalError('Cannot process route output!')
-
-                return make_response((self._routes[f]['return'].format(output), status, headers))
+            if inspect.iscoroutinefunction(f):
+                @wraps(f)
+                async def decorated_coroutine(*args, **parsed_params):
+                    route = self._routes[f]
+                    tracker = self._track(f, attach=not is_async_request())
+
+                    self._rate_limiter.check(route['rate_limits'], f.__name__)
+                    _parse_params(route, parsed_params)
+                    tracker.mark('params')
+
+                    etag = (await run_blocking(route['etag'], *args, **parsed_params)
+                            if route['etag'] is not None else None)
+                    if etag is not None and _etag_matches(etag):
+                        return _cache_validated(make_response(('', 304)), route, etag)
+
+                    output = await f(*args, **parsed_params)
+                    tracker.mark('handler')
+                    output, status, headers = _unpack_output(output)
+
+                    data = await run_blocking(route['return'].serialize, output)
+                    tracker.mark('serialize')
+                    response = make_response((route['return'].encode(data), status, headers))
+                    tracker.mark('encode')
+                    return _cache_validated(response, route, etag)
+
+                @wraps(f)
+                def decorated_function(*args, **parsed_params):
+                    return run_coroutine(decorated_coroutine(*args, **parsed_params))
+                decorated_function.east_async = decorated_coroutine
+
+            else:
+                @wraps(f)
+                def decorated_function(*args, **parsed_params):
+                    route = self._routes[f]
+                    tracker = self._track(f)
+
+                    self._rate_limiter.check(route['rate_limits'], f.__name__)
+                    _parse_params(route, parsed_params)
+                    tracker.mark('params')
+
+                    etag = route['etag'](*args, **parsed_params) if route['etag'] is not None else None
+                    if etag is not None and _etag_matches(etag):
+                        return _cache_validated(make_response(('', 304)), route, etag)
+
+                    def respond():
+                        with self._deadline(route), self._transaction(route['transactional']):
+                            output = f(*args, **parsed_params)
+                            tracker.mark('handler')
+                            output, status, headers = _unpack_output(output)
+
+                            data = route['return'].serialize(output)
+                            tracker.mark('serialize')
+                            response = make_response((route['return'].encode(data), status, headers))
+                            tracker.mark('encode')
+                        return response
+
+                    response = (respond() if route['coalesce'] is None else
+                                self._coalesced(route, respond, args, parsed_params))
+                    return _cache_validated(response, route, etag)
 
             base.add_url_rule(url_rule, f.__name__, decorated_function, methods=[method])
 
             return decorated_function
         return decorator
 
+    def _coalesced(self, route, respond, args, parsed_params):
+        # Followers are given a copy of the leader's response, taken before
+        # the `after_request` hooks (eg. compression) modify it
+        def respond_shareable():
+            response = respond()
+            return response, (None if response.is_streamed else
+                              (response.get_data(), response.status_code, list(response.headers)))
+
+        key = route['coalescing_key'](*args, **parsed_params)
+        (response, copy), shared = self._single_flight.call(key, respond_shareable, route['coalesce'])
+        if not shared:
+            return response
+        if copy is None:
+            return respond()
+        if self._metrics is not None:
+            self._metrics.increment('coalesced_requests_total',
+                                    (('route', route['endpoint'].__name__),))
+        return Response(copy[0], status=copy[1], headers=copy[2])
+
+    def on_commit(self, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` once the current request's transaction is
+        committed - or right away, if the route is not transactional
+
+        Callbacks are skipped if the transaction is rolled back, so they suit
+        side effects which must not be seen before the changes are, eg.
+        notifications or cache invalidation.
+        """
+        callbacks = g.get('east_on_commit')
+        if callbacks is None:
+            fn(*args, **kwargs)
+        else:
+            callbacks.append((fn, args, kwargs))
+
     def generate_docs(self):
         """Generate API documentation"""
         self._docs.generate()
@@ -179,7 +375,132 @@ class East:
     def _serve_docs(self):
         if 'EAST_API_DOCS_LOCATION' not in self._flask_app.config:
             raise DoesNotExistError('API documentation is not available.')
-        return send_from_directory("../docs", "docs.html")
+        return send_precompressed("../docs", "docs.html")
+
+    def _serve_static(self, filename):
+        return send_precompressed(self._flask_app.static_folder, filename,
+                                  cache_timeout=self._flask_app.get_send_file_max_age(filename))
+
+    def _serve_metrics(self):
+        # Metrics reveal routes and traffic, scrapers authenticate with a shared token
+        token = self._flask_app.config.get('EAST_METRICS_TOKEN')
+        if token is not None and not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(), ('Bearer %s' % token).encode()):
+            raise AuthorizationError('Metrics require the configured access token.')
+        return Response(self._metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def _track(self, f, attach=True):
+        if self._metrics is None:
+            return NULL_TRACKER
+        tracker = g.east_tracker = self._metrics.track(f.__name__, attach)
+        return tracker
+
+    @contextmanager
+    def _transaction(self, transactional):
+        if not transactional:
+            yield
+            return
+
+        g.east_on_commit = []
+        try:
+            with write_transaction(self._database):
+                yield
+            for fn, args, kwargs in g.pop('east_on_commit'):
+                fn(*args, **kwargs)
+        finally:
+            g.pop('east_on_commit', None)
+
+    @contextmanager
+    def _deadline(self, route):
+        if route['query_timeout'] is None:
+            yield
+            return
+
+        try:
+            with self._database.deadline(route['query_timeout']):
+                yield
+        except QueryTimeoutError:
+            if self._metrics is not None:
+                self._metrics.increment('query_timeouts_total',
+                                        (('route', route['endpoint'].__name__),))
+            raise
+
+    def _acquire_request_slot(self):
+        # Only API routes are limited, monitoring and docs stay available
+        if request.endpoint in ('docs', 'metrics', 'static'):
+            return
+        self._concurrency_limiter.acquire()
+        g.east_request_slot = True
+
+    def _release_request_slot(self, exc):
+        if g.pop('east_request_slot', False):
+            self._concurrency_limiter.release()
+
+    def _finish_tracking(self, response):
+        tracker = g.pop('east_tracker', None)
+        if tracker is not None:
+            tracker.finish(response.status_code, response_size(response) or 0)
+            clear_tracker()
+        return response
+
+
+def _parse_params(route, parsed_params):
+    # REWRITE!!!
+    for param in route['params']:
+        if param['auto_fill']:
+            parsed_params[param['name']] = _parse_param(param)
+    g.east_response_params = {param['name']: _parse_param(param)
+                              for param in route['response_params']}
+
+
+def _parse_param(param):
+    raw_value = _get_request_param(param['name'])
+    if raw_value is None and param['default'] is inspect._empty:
+        raise MissingParameterError('Parameter `%s` is not present in the request' % param['name'])
+    try:
+        parsed_value = param['type'](raw_value) if raw_value is not None else param['default']
+        if param['validator'] is not None and raw_value is not None:
+            param['validator'](parsed_value)
+    except Exception as e:
+        raise BadParameterError('Parameter `%s` is invalid [%s]' % (param['name'], e))
+    return parsed_value
+
+
+def _etag_matches(etag):
+    # Compressed responses carry the ETag with the encoding appended
+    return any(request.if_none_match.contains_weak(tag)
+               for tag in [etag] + ['%s-%s' % (etag, encoding) for encoding in ENCODERS])
+
+
+def _cache_validated(response, route, etag):
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers.setdefault('Cache-Control',
+                                    'private, no-cache' if route['auth'] else 'no-cache')
+    return response
+
+
+def _coalescing_key(f, auth):
+    def key(*args, **parsed_params):
+        return (f.__name__, decode_access_token()['user_id'] if auth else None, repr(args),
+                repr(sorted(parsed_params.items())), repr(sorted(g.east_response_params.items())))
+    return key
+
+
+def _unpack_output(output):
+    if not isinstance(output, tuple):
+        return output, 200, []
+    if len(output) == 2:
+        return output[0], output[1], []
+    if len(output) == 3:
+        return output
+    raise APIInternalError('Cannot process route output!')
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
 
 
 def _get_request_param(name: str):
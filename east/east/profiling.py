@@ -0,0 +1,146 @@
+"""
+    east.profiling
+    ==============
+    Sampling profiler for slow requests - periodically snapshots call stacks
+    of in-flight requests and writes flame graph compatible collapsed-stack
+    files for the selected ones
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+
+from collections import Counter
+
+from flask import request
+
+from .security import active_user
+
+
+class RequestProfiler:
+    """
+    Sampling request profiler
+
+    While enabled, a timer thread wakes up every `interval` seconds and
+    records the current call stack of every request in progress. When a
+    request finishes, its samples are written out if it was randomly selected
+    for profiling (with probability `sample_rate`) or if it took longer than
+    `threshold` seconds, and discarded otherwise.
+
+    Output files use the collapsed-stack format (`frame;frame;frame count`,
+    root frame first), accepted by flamegraph.pl, speedscope and similar
+    tools, and are named after the route, user and request duration.
+
+    The profiler hooks into the request cycle only when constructed, so an
+    application which doesn't enable it pays nothing.
+    """
+
+    def __init__(self, flask_app, output_dir='profiles', sample_rate=0.01,
+                 threshold=1.0, interval=0.01):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.interval = interval
+
+        self._sessions = {}
+        self._finished = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler = None
+        self._pid = None
+
+        flask_app.before_request(self._start_session)
+        flask_app.teardown_request(self._finish_session)
+
+    def _start_session(self):
+        if self._pid != os.getpid():
+            self._start_sampler()
+        session = _ProfileSession(random.random() < self.sample_rate)
+        with self._lock:
+            self._sessions[threading.get_ident()] = session
+        self._wakeup.set()
+
+    def _finish_session(self, exc=None):
+        with self._lock:
+            session = self._sessions.pop(threading.get_ident(), None)
+        if session is None:
+            return
+
+        duration = time.perf_counter() - session.started
+        if (session.sampled or duration >= self.threshold) and session.stacks:
+            user = active_user()
+            session.tags = (request.endpoint or 'unknown', user.id if user is not None else None,
+                            duration)
+            with self._lock:
+                self._finished.append(session)
+            self._wakeup.set()
+
+    def _start_sampler(self):
+        # Sampler thread doesn't survive a fork, so each process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._sessions.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name='east-profiler',
+                                             daemon=True)
+            self._pid = os.getpid()
+            self._sampler.start()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, session in self._sessions.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        session.stacks[_collapse_stack(frame)] += 1
+                finished, self._finished = self._finished, []
+                if not self._sessions:
+                    self._wakeup.clear()
+            del frames
+
+            for session in finished:
+                self._write_profile(session)
+
+    def _write_profile(self, session):
+        route, user_id, duration = session.tags
+        filename = '%s_%s_user-%s_%dms.collapsed' % (
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(session.wall_started)),
+            route.replace('/', '.'), user_id, duration * 1000)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, filename), 'w') as f:
+                f.writelines('%s %d\n' % (stack, count)
+                             for stack, count in session.stacks.most_common())
+        except OSError:
+            pass
+
+
+class _ProfileSession:
+    __slots__ = ('sampled', 'started', 'wall_started', 'stacks', 'tags')
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.stacks = Counter()
+        self.tags = None
+
+
+def _collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
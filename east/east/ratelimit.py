@@ -0,0 +1,173 @@
+"""
+    east.ratelimit
+    ==============
+    Request rate limiting with token buckets, and load shedding with a global
+    concurrency limit
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import math
+import threading
+
+from collections import OrderedDict
+from time import monotonic, time
+
+from flask import request
+
+from .exceptions import JWTException, RateLimitExceededError, ServiceOverloadedError
+from .security import decode_access_token
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class RateLimit:
+    """
+    Rate limit policy - a token bucket of `limit` requests per `period`
+    seconds, per client
+
+    Clients are told apart by `key`: 'user' (the user id of the request's
+    access token, or the client IP for unauthenticated requests), 'ip', or a
+    function returning the key for the current request. Requests of all
+    routes with the policy of the same `name` share a budget - by default,
+    each route has its own.
+    """
+
+    def __init__(self, limit: int, period: float, burst: int = None, key='user', name: str = None):
+        """
+        :param limit:   Number of requests allowed per `period`
+        :param period:  Length of the period, in seconds
+        :param burst:   Number of requests which can be made at once, after
+                        a period of inactivity (default: `limit`)
+        :param key:     'user', 'ip' or a function returning the client key
+        :param name:    Name of the budget (default: route's endpoint name)
+        """
+        self.rate = limit / period
+        self.burst = burst if burst is not None else limit
+        self.key = {'user': user_key, 'ip': ip_key}.get(key, key)
+        self.name = name
+
+
+class RateLimiter:
+    """
+    Enforces rate limit policies, keeping the buckets in `backend`
+
+    The default, in-process backend keeps separate counters in each worker
+    process. Deployments with several processes (or servers) which need
+    exact limits can use a shared backend such as `RedisBackend`.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else InMemoryBackend()
+
+    def check(self, policies, route_name):
+        """Consume a token of each policy for the current request, or raise"""
+        for policy in policies:
+            key = '%s:%s' % (policy.name or route_name, policy.key())
+            retry_after = self.backend.consume(key, policy.rate, policy.burst)
+            if retry_after:
+                raise RateLimitExceededError('Too many requests, retry in %d seconds.'
+                                             % math.ceil(retry_after), retry_after=retry_after)
+
+
+class ConcurrencyLimiter:
+    """
+    Global limit of requests handled at once, in this process
+
+    Requests beyond the limit are rejected right away instead of queueing up
+    for database connections and CPU, so an overloaded server keeps its
+    latency for the requests it does accept and clients back off sooner.
+    """
+
+    def __init__(self, max_requests: int, retry_after: float = 1.0):
+        self.max_requests = max_requests
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_requests)
+
+    def acquire(self):
+        """Take a slot for the current request, or raise if there is none"""
+        if not self._slots.acquire(blocking=False):
+            raise ServiceOverloadedError('Server is overloaded, retry in %d seconds.'
+                                         % math.ceil(self.retry_after),
+                                         retry_after=self.retry_after)
+
+    def release(self):
+        self._slots.release()
+
+
+class InMemoryBackend:
+    """
+    In-process token buckets
+
+    At most `max_keys` buckets are kept, the least recently used ones are
+    dropped first - a dropped bucket is as good as a full one.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, burst):
+        """Take a token from bucket `key`, return seconds to wait if it is empty"""
+        now = monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key], retry_after = (tokens - 1, now), 0
+            else:
+                self._buckets[key], retry_after = (tokens, now), (1 - tokens) / rate
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+if redis is not None:
+    class RedisBackend:
+        """Token buckets shared through Redis, consumed atomically by a script"""
+
+        SCRIPT = """
+            local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+            local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+            local tokens = math.min(burst, (tonumber(bucket[1]) or burst) +
+                                           (now - (tonumber(bucket[2]) or now)) * rate)
+            local retry_after = 0
+            if tokens >= 1 then tokens = tokens - 1 else retry_after = (1 - tokens) / rate end
+            redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+            redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+            return tostring(retry_after)
+        """
+
+        def __init__(self, client=None, prefix='east:ratelimit:'):
+            self.client = client if client is not None else redis.StrictRedis()
+            self.prefix = prefix
+            self._consume = self.client.register_script(self.SCRIPT)
+
+        def consume(self, key, rate, burst):
+            return float(self._consume(keys=[self.prefix + key], args=[rate, burst, time()]))
+
+        def clear(self):
+            for key in self.client.scan_iter(self.prefix + '*'):
+                self.client.delete(key)
+
+
+def user_key():
+    """Identify the client by its access token's user id, or its IP address"""
+    try:
+        return 'user:%s' % decode_access_token()['user_id']
+    except (JWTException, KeyError):
+        return ip_key()
+
+
+def ip_key():
+    """Identify the client by its IP address"""
+    return 'ip:%s' % request.remote_addr
@@ -8,6 +8,8 @@
     :license: MIT
 """
 
+import inspect
+
 from datetime import datetime, timedelta
 from functools import wraps
 
@@ -17,6 +19,7 @@ from flask import _request_ctx_stack, current_app, request
 from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash
 
+from .asgi import run_blocking
 from .exceptions import *
 
 
@@ -59,37 +62,65 @@ def jwt_required(f):
     Expects to find `Authorization` header field of the following format:
         `Authorization: JWT token_value`
     Where `token_value` is a valid JWT token.
+
+    Works with `async def` functions as well - the token is then verified on
+    the event loop, and only the identity lookup is run in a thread. The
+    identity is loaded once per request, however many protected functions
+    it calls.
     """
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_coroutine(*args, **kwargs):
+            if active_user() is None:
+                await run_blocking(load_identity, decode_access_token())
+            return await f(*args, **kwargs)
+        return decorated_coroutine
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        header = request.headers.get('Authorization', None)
+        if active_user() is None:
+            load_identity(decode_access_token())
+        return f(*args, **kwargs)
+    return decorated_function
 
-        if header is None:
-            raise AuthenticationError('Authorization token not provided.')
 
-        header_parts = header.split()
+def decode_access_token():
+    """Verify the JWT token sent with the current request, return its payload"""
+    payload = getattr(_request_ctx_stack.top, 'jwt_payload', None)
+    if payload is None:
+        payload = _request_ctx_stack.top.jwt_payload = _decode_access_token()
+    return payload
 
-        if (len(header_parts) != 2 or header_parts[0] != current_app.config['JWT_AUTH_HEADER_PREFIX']):
-            raise MalformedTokenError('Provided authorization token header is malformed: `{}`.'.format(header))
 
-        token = header_parts[1]
-        options = {claim: True for claim in ['verify_signature', 'verify_exp',
-                                             'verify_nbf', 'verify_iat', 'require_exp',
-                                             'require_nbf', 'require_iat']}
-        try:
-            payload = jwt.decode(token, current_app.config['JWT_SECRET_KEY'],
-                                 options=options, algorithms=[current_app.config['JWT_ALGORITHM']],
-                                 leeway=current_app.config['JWT_LEEWAY'])
-        except Exception as e:
-            raise MalformedTokenError(str(e))
+def _decode_access_token():
+    header = request.headers.get('Authorization', None)
 
-        try:
-            _request_ctx_stack.top.user = _jwt.get_identity(payload)
-        except:
-            raise UnknownUserError('There is no user with a given `user_id` in the database.')
+    if header is None:
+        raise AuthenticationError('Authorization token not provided.')
 
-        return f(*args, **kwargs)
-    return decorated_function
+    header_parts = header.split()
+
+    if (len(header_parts) != 2 or header_parts[0] != current_app.config['JWT_AUTH_HEADER_PREFIX']):
+        raise MalformedTokenError('Provided authorization token header is malformed: `{}`.'.format(header))
+
+    token = header_parts[1]
+    options = {claim: True for claim in ['verify_signature', 'verify_exp',
+                                         'verify_nbf', 'verify_iat', 'require_exp',
+                                         'require_nbf', 'require_iat']}
+    try:
+        return jwt.decode(token, current_app.config['JWT_SECRET_KEY'],
+                          options=options, algorithms=[current_app.config['JWT_ALGORITHM']],
+                          leeway=current_app.config['JWT_LEEWAY'])
+    except Exception as e:
+        raise MalformedTokenError(str(e))
+
+
+def load_identity(payload):
+    """Load the user identified by a token `payload` as the active user"""
+    try:
+        _request_ctx_stack.top.user = _jwt.get_identity(payload)
+    except:
+        raise UnknownUserError('There is no user with a given `user_id` in the database.')
 
 
 def generate_access_token(user_id, **extras):
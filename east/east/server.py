@@ -0,0 +1,286 @@
+"""
+    east.server
+    ===========
+    Pre-forking multi-process WSGI server for production deployments
+
+    :copyright: (c) 2016 by Zvonimir Jurelinac
+    :license: MIT
+"""
+
+import errno
+import gc
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+class PreforkServer:
+    """
+    Pre-forking WSGI server
+
+    The master process imports the application once, binds the listening
+    socket, runs an optional warm-up and then forks `workers` worker
+    processes which all accept connections on the shared socket. Before
+    forking, the master collects and freezes all of its objects (`gc.freeze`,
+    Python 3.7+), so that workers don't touch - and so copy - the memory
+    pages they share with it every time the garbage collector runs.
+
+    Workers are recycled after serving `max_requests` requests (0 disables
+    recycling), and dead workers are replaced automatically. Each worker
+    serves up to `threads` requests at once from a pool of threads, so that
+    long-lived responses - like event streams, which hold a thread for as
+    long as the client stays connected - don't block the whole worker; cap
+    such responses below `threads` to leave room for the other requests.
+    When a worker exits, `worker_shutdown` is called before it waits for
+    its threads, to end those responses instead of waiting for clients to
+    disconnect.
+
+    Signals sent to
+    the master control the whole server:
+
+        - SIGHUP:           graceful reload - a fresh set of workers is forked
+                            and the old ones exit once they finish the request
+                            they are serving
+        - SIGTERM, SIGINT:  graceful shutdown, workers still running after
+                            `graceful_timeout` seconds are killed
+
+    As the application is loaded only once, code changes are picked up by
+    restarting the master, not by a reload.
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=5000, workers=None, max_requests=0,
+                 warmup=None, post_fork=None, graceful_timeout=30, backlog=1024,
+                 threads=1, worker_shutdown=None):
+        """
+        :param app:                 WSGI application
+        :param host:                Address to listen on
+        :param port:                Port to listen on
+        :param workers:             Number of worker processes (default: CPU count)
+        :param max_requests:        Number of requests after which a worker is
+                                    replaced by a fresh one, 0 for never
+        :param warmup:              Callable run in the master before forking,
+                                    eg. to import lazily loaded modules
+        :param post_fork:           Callable run in each worker once it is
+                                    forked, eg. to start background threads
+        :param graceful_timeout:    Seconds given to workers to finish their
+                                    requests on shutdown
+        :param backlog:             Listening socket backlog size
+        :param threads:             Number of requests each worker serves
+                                    concurrently, each in its own thread
+        :param worker_shutdown:     Callable run in each worker once it stops
+                                    accepting connections, eg. to end open
+                                    event streams
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests
+        self.warmup = warmup
+        self.post_fork = post_fork
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.threads = max(1, threads)
+        self.worker_shutdown = worker_shutdown
+
+        self.socket = None
+        self._children = {}
+        self._generation = 0
+        self._reload = False
+        self._shutdown = False
+
+    def run(self):
+        """Start the server, return once it is shut down"""
+        self.socket = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET,
+                                    socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        # Workers race for each connection - the losers must not block in accept
+        self.socket.setblocking(False)
+        self.port = self.socket.getsockname()[1]
+
+        if self.warmup is not None:
+            self.warmup()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        signal.signal(signal.SIGTERM, self._handle_shutdown)
+        signal.signal(signal.SIGINT, self._handle_shutdown)
+
+        _log('Master %d listening on %s:%d, %d workers'
+             % (os.getpid(), self.host, self.port, self.workers))
+        try:
+            self._supervise()
+        finally:
+            self.socket.close()
+
+    def _supervise(self):
+        while not self._shutdown:
+            if self._reload:
+                self._reload = False
+                self._generation += 1
+                old = list(self._children)
+                _log('Reloading, replacing workers %s' % old)
+                self._spawn_missing()
+                self._signal_workers(signal.SIGTERM, old)
+            self._reap()
+            self._spawn_missing()
+            time.sleep(0.1)
+
+        self._signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        self._signal_workers(signal.SIGKILL)
+        while self._children:
+            self._reap(block=True)
+
+    def _spawn_missing(self):
+        current = sum(1 for generation in self._children.values()
+                      if generation == self._generation)
+        for _ in range(self.workers - current):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    self._work()
+                except BaseException:
+                    code = 1
+                    sys.excepthook(*sys.exc_info())
+                finally:
+                    os._exit(code)
+            self._children[pid] = self._generation
+
+    def _reap(self, block=False):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self._children.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            self._children.pop(pid, None)
+            if block:
+                return
+
+    def _signal_workers(self, signum, pids=None):
+        for pid in (pids if pids is not None else list(self._children)):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def _handle_shutdown(self, signum, frame):
+        self._shutdown = True
+
+    def _work(self):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._handle_shutdown)
+        self._children = {}
+        if self.post_fork is not None:
+            self.post_fork()
+
+        server = _WorkerServer(self.host, self.port, self.app, handler=_QuietRequestHandler,
+                               fd=self.socket.fileno(), threads=self.threads)
+        server.timeout = 0.5
+        while not self._shutdown and not (self.max_requests and
+                                          server.handled >= self.max_requests):
+            server.serve_one()
+
+        if self.worker_shutdown is not None:
+            self.worker_shutdown()
+        server.join_threads()
+
+
+class _WorkerServer(BaseWSGIServer):
+    """
+    Worker's WSGI server, handing accepted requests over to a fixed pool of
+    threads - a connection is accepted only when a thread is free to serve
+    it, the others are left to the remaining workers
+    """
+    handled = 0
+
+    def __init__(self, *args, threads=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.multithread = threads > 1
+        self._slots = threading.BoundedSemaphore(threads)
+        self._requests = queue.Queue()
+        self._threads = [threading.Thread(target=self._serve_requests, daemon=True)
+                         for _ in range(threads if threads > 1 else 0)]
+        for thread in self._threads:
+            thread.start()
+
+    def serve_one(self):
+        """Wait for a free thread, then for a request, and start serving it"""
+        if not self._slots.acquire(timeout=self.timeout):
+            return
+        handled = self.handled
+        try:
+            self.handle_request()
+        finally:
+            if self.handled == handled:
+                self._slots.release()
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        if self._threads:
+            self._requests.put((request, client_address))
+            return
+        try:
+            super().process_request(request, client_address)
+        finally:
+            self._slots.release()
+
+    def join_threads(self):
+        """Let the threads finish the requests they are serving, and stop them"""
+        for _ in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _serve_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self._slots.release()
+
+    def handle_error(self, request, client_address):
+        # Interrupted system calls are expected when a signal arrives
+        if not isinstance(sys.exc_info()[1], InterruptedError):
+            super().handle_error(request, client_address)
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that leaves access logging to the application"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _log(message):
+    print('[east.server] %s' % message, file=sys.stderr, flush=True)
@@ -1,17 +1,27 @@
 """
     east.testing
     ============
-    EastTester class definition - provides REST API testing functionalities
+    EastTester class definition - provides REST API testing functionalities,
+    together with fast fixture creation and test database isolation helpers
 
     :copyright: (c) 2016 by Zvonimir Jurelinac
     :license: MIT
 """
 
+import hashlib
 import json
 import logging
 import os
+import shutil
+import tempfile
+import unittest
+
+from functools import lru_cache
+
+from peewee import fn
 
 from .helpers import get_class_plural_name
+from .security import make_password_hash
 
 
 class EastTester:
@@ -78,3 +88,170 @@ def obj_compare(source, dest):
             obj_compare(source[key], dest[key])
     else:
         return
+
+
+# Fixtures
+
+def bulk_insert(model, rows, batch_size=None):
+    """
+    Insert `rows` (dictionaries of field values) into `model`'s table
+
+    Rows are inserted with multi-row INSERT statements, all within a single
+    transaction (or a savepoint, if one is already active).
+    """
+    # SQLite limits a single statement to 999 bound parameters
+    batch_size = batch_size or max(999 // len(model._meta.fields), 1)
+    database = model._meta.database
+    batch = []
+    with database.atomic():
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                model.insert_many(batch).execute()
+                batch = []
+        if batch:
+            model.insert_many(batch).execute()
+
+
+@lru_cache(maxsize=None)
+def precomputed_password_hash(password):
+    """Return a valid hash of `password`, computed only once per process"""
+    return make_password_hash(password)
+
+
+class FixtureFactory:
+    """
+    Bulk fixture factory for a single model
+
+    Field values are given either as constants or as callables, which receive
+    the sequence number of the row being built (starting from 1, and
+    continuing across calls). Created rows are assigned consecutive primary
+    keys, so they can be referenced without reading them back.
+    """
+
+    def __init__(self, model, **defaults):
+        self.model = model
+        self.defaults = defaults
+        self.sequence = 0
+
+    def build(self, count=1, **overrides):
+        """Build `count` rows, without inserting them"""
+        values = dict(self.defaults, **overrides)
+        rows = []
+        for _ in range(count):
+            self.sequence += 1
+            rows.append({k: v(self.sequence) if callable(v) else v for k, v in values.items()})
+        return rows
+
+    def create(self, count=1, **overrides):
+        """Build and insert `count` rows, return them (with their primary keys)"""
+        rows = self.build(count, **overrides)
+        pk = self.model._meta.primary_key
+        next_id = (self.model.select(fn.Max(pk)).scalar() or 0) + 1
+        for i, row in enumerate(rows):
+            row.setdefault(pk.name, next_id + i)
+        bulk_insert(self.model, rows)
+        return rows
+
+
+# Test database isolation
+
+class TestDatabase:
+    """
+    Disposable test database
+
+    Points `database` (a Peewee SqliteDatabase) to a private database with
+    the schema of `models` created, in one of two modes:
+
+        - 'memory':     an in-memory database, private to the connection
+                        (and so to the thread) that uses it
+        - 'template':   a per-process copy of a template database file; the
+                        template is built once and shared by all processes
+                        (it is keyed by the schema), so test runs in parallel
+                        processes never touch each other's data
+
+    Either way, the application's real database is left untouched.
+    """
+
+    MODES = ('memory', 'template')
+    __test__ = False
+
+    def __init__(self, database, models, mode='template'):
+        if mode not in self.MODES:
+            raise ValueError('Unknown test database mode `%s`.' % mode)
+        self.database = database
+        self.models = models
+        self.mode = mode
+        self.path = None
+
+    def setup(self):
+        """Switch the database to a fresh test database"""
+        if not self.database.is_closed():
+            self.database.close()
+
+        if self.mode == 'memory':
+            self.path = ':memory:'
+            self.database.init(self.path)
+            self.database.create_tables(self.models)
+        else:
+            template = self._build_template()
+            fd, self.path = tempfile.mkstemp(prefix='east-test-%d-' % os.getpid(), suffix='.db')
+            os.close(fd)
+            shutil.copyfile(template, self.path)
+            self.database.init(self.path)
+
+    def teardown(self):
+        """Close and remove the test database"""
+        if not self.database.is_closed():
+            self.database.close()
+        if self.mode == 'template' and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _build_template(self):
+        schema = '\n'.join(sql for model in self.models for sql in model.sqlall())
+        template = os.path.join(tempfile.gettempdir(), 'east-template-%s.db'
+                                % hashlib.sha1(schema.encode()).hexdigest()[:16])
+        if not os.path.exists(template):
+            # Build under a private name and rename, so that concurrently
+            # starting processes never see a half-built template
+            building = '%s.%d' % (template, os.getpid())
+            self.database.init(building)
+            self.database.create_tables(self.models)
+            self.database.close()
+            os.replace(building, template)
+        return template
+
+
+class TransactionalTestCase(unittest.TestCase):
+    """
+    Test case isolated by transactions instead of table wipes
+
+    Each test class runs inside a single transaction, which is rolled back
+    once the class is done, so fixtures created in `setUpClass` are shared
+    by all its tests. Each test runs inside a SAVEPOINT, rolled back in
+    `tearDown`, so whatever it changes is gone before the next one starts.
+    """
+
+    database = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._transaction = cls.database.transaction()
+        cls._transaction.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._transaction.rollback(False)
+        cls._transaction.__exit__(None, None, None)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self._savepoint = self.database.savepoint()
+        self._savepoint.__enter__()
+
+    def tearDown(self):
+        self._savepoint.rollback()
+        self._savepoint.__exit__(None, None, None)
+        super().tearDown()
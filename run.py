@@ -1,4 +1,8 @@
 from app import app
+from app.schema import migrate
+from app.tasks import jobs
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    migrate()
+    jobs.start()
+    app.run(host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
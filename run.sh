@@ -4,5 +4,7 @@
   docker run -p 5000:5000 \
              --restart="unless-stopped" \
              --name bitboard-rest \
+             -e BITBOARD_CONFIG=production \
+             -e BITBOARD_METRICS_TOKEN \
              -v $(pwd):/code \
-             -it bitboard/rest python3 run.py
\ No newline at end of file
+             -it bitboard/rest python3 serve.py
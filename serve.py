@@ -0,0 +1,28 @@
+import os
+
+os.environ.setdefault('BITBOARD_CONFIG', 'production')
+
+from east.server import PreforkServer
+
+from app import app, db
+from app.events import events
+from app.schema import migrate
+from app.tasks import jobs
+
+
+def warmup():
+    """Run one request through the whole stack, so that lazily initialized
+    modules and state are loaded in the master and shared with workers"""
+    app.test_client().get('/docs')
+    if not db.is_closed():
+        db.close()
+
+
+if __name__ == '__main__':
+    migrate()
+    PreforkServer(app, host=app.config['SERVER_HOST'], port=app.config['SERVER_PORT'],
+                  workers=app.config['SERVER_WORKERS'],
+                  max_requests=app.config['SERVER_MAX_REQUESTS'],
+                  graceful_timeout=app.config['SERVER_GRACEFUL_TIMEOUT'],
+                  threads=app.config['SERVER_THREADS'],
+                  warmup=warmup, post_fork=jobs.start, worker_shutdown=events.close).run()
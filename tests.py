@@ -1,16 +1,47 @@
+import asyncio
+import gc
+import gzip
+import http.client
 import json
+import multiprocessing
+import os
 import random
+import signal
+import socket
 import string
+import tempfile
+import threading
+import time
+import types
 import unittest
 
 from datetime import datetime
-
+from flask import Flask, Response, _app_ctx_stack, _request_ctx_stack
+from peewee import UpdateQuery
+from unittest import mock
+
+from east import East
+from east.asgi import ASGIAdapter
+from east.coalescing import SingleFlight
+from east.compression import negotiate, precompress, send_precompressed
+from east.data import JSON
+from east.database import EastSqliteDatabase, GroupCommitWriter, write_transaction
+from east.events import Event, EventBroker
 from east.exceptions import *
+from east.jobs import JobQueue
+from east.logger import StructuredLogger
+from east.profiling import RequestProfiler
 from east.helpers import get_class_plural_name
-from east.security import generate_access_token, make_password_hash
+from east.ratelimit import RateLimit
+from east.server import PreforkServer
+from east.security import JWT, generate_access_token
+from east.testing import (FixtureFactory, TestDatabase, TransactionalTestCase,
+                          precomputed_password_hash)
 
-from app import app as base_app, db
+from app import app as base_app, db, east as base_east
 import app.models as models
+from app.events import events
+from app.tasks import Job, jobs
 
 
 # Utilities
@@ -34,12 +65,28 @@ def _send_request(app, url, method='GET', data={}, headers={}, jwt_token=None):
     if jwt_token is not None:
         headers['Authorization'] = 'Bearer %s' % jwt_token
     response = getattr(app, method.lower())(url, data=data, headers=headers)
-    data = json.loads(response.get_data(as_text=True)) if response.status_code != 204 else None
-    return response, data
+    body = response.get_data(as_text=True)
+    return response, json.loads(body) if body else None
+
+
+def _send_asgi_request(adapter, path, method='GET', body=b'', headers=()):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', b'application/x-www-form-urlencoded')] + list(headers)}
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.get_event_loop().run_until_complete(adapter(scope, receive, send))
+    return sent[0]['status'], b''.join(m.get('body', b'') for m in sent[1:])
 
 
 class API:
-    MODELS = [models.User, models.Note, models.Category]
+    MODELS = [models.User, models.Note, models.Category, models.ChangeLog, Job]
 
     def __init__(self):
         self.app = base_app
@@ -47,8 +94,6 @@ class API:
         self.user = None
         self.token = None
 
-        db.create_tables(self.MODELS, safe=True)
-
     def send_request(self, url, method='GET', data={}, headers={}, jwt_token=None):
         if jwt_token is None and self.token is not None:
             jwt_token = self.token
@@ -70,33 +115,50 @@ class API:
 
     def create_user(self, fullname):
         return models.User.create(fullname=fullname, email=('%s@mail.com' % fullname.replace(' ', '.').lower()),
-                                  password_hash=make_password_hash('lozinka'))
+                                  password_hash=precomputed_password_hash('lozinka'))
 
     def create_user_note(self, user, title, content, category):
         return models.Note.create(title=title, content=content, _category=category,
                                   _author=user, date_created=datetime.now(),
                                   date_modified=datetime.now())
 
+    def create_user_notes(self, user, category, count):
+        factory = FixtureFactory(models.Note, title=lambda n: 'Note %d' % (n - 1),
+                                 content=lambda n: rand_str(100), _category=category.id,
+                                 _author=user.id, date_created=datetime.now(),
+                                 date_modified=datetime.now())
+        return factory.create(count)
+
     def create_user_category(self, user, name, parent=None):
         return models.Category.create(name=name, _parent=parent, owner=user)
 
 
 _TEST_API = API()
+_TEST_DB = TestDatabase(db, API.MODELS, mode=os.environ.get('TEST_DATABASE_MODE', 'template'))
+
+
+def setUpModule():
+    _TEST_DB.setup()
+
+
+def tearDownModule():
+    _TEST_DB.teardown()
 
 # Tests
 
-class APITest(unittest.TestCase):
+class APITest(TransactionalTestCase):
+    database = db
+
     def __init__(self, methodName='runTest'):
         super().__init__(methodName)
         self.api = _TEST_API
         self.app = _TEST_API.test_app
 
     def setUp(self):
-        self.api.clear_db()
+        super().setUp()
         self.api.clear_user()
-
-    def tearDown(self):
-        pass
+        models.Category.forget_names()
+        base_east.rate_limiter.backend.clear()
 
     def check_success(self, url, method='GET', data={}, headers={},
                       jwt_token=None, expected_status=200):
@@ -124,6 +186,15 @@ class APITest(unittest.TestCase):
         return data['data']
 
 
+def _east_app(database=None, **config):
+    # Throwaway Flask application with an East instance, for tests of
+    # routing features which the Bitboard application doesn't use
+    flask_app = Flask(__name__)
+    flask_app.config.update(EAST_GENERATE_API_DOCS=False, **config)
+    flask_app.register_error_handler(BaseAPIException, lambda e: e.make_response())
+    return flask_app, East(flask_app, database=database)
+
+
 class UserRegistrationTest(APITest):
     def test_registration_ok(self):
         self.check_success('/api/users', 'POST',
@@ -192,8 +263,19 @@ class UserProfileTest(APITest):
     def test_delete_ok(self):
         user = self.api.create_user('Mirko Mirkovic')
         self.api.set_user(user)
-        self.check_success('/api/users/self', 'DELETE', expected_status=204)
+        self.check_success('/api/users/self', 'DELETE', expected_status=202)
         self.check_error('/api/users/self', error=UnknownUserError)
+        self.check_error('/api/auth', 'POST', data={'email': user.email, 'password': 'lozinka'},
+                         error=DoesNotExistError)
+
+    def test_delete_frees_email(self):
+        user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(user)
+        self.check_success('/api/users/self', 'DELETE', expected_status=202)
+        self.check_success('/api/users', 'POST',
+                           data={'fullname': 'Mirko Mirkovic', 'email': user.email, 'password': 'lozinka'},
+                           expected_status=201)
+        self.check_success('/api/auth', 'POST', data={'email': user.email, 'password': 'lozinka'})
 
 
 class NoteTest(APITest):
@@ -205,21 +287,46 @@ class NoteTest(APITest):
         self.category = self.api.create_user_category(self.user, 'stuff')
 
     def test_list_ok(self):
-        for i in range(10):
-            self.api.create_user_note(self.user, 'Note %d' % i, rand_str(100), self.category)
+        self.api.create_user_notes(self.user, self.category, 10)
 
         data = self.check_data('/api/notes', model=models.Note, is_list=True, view='excerpt')
         self.assertEqual(len(data['notes']), 10)
 
     def test_paginate_ok(self):
-        for i in range(10):
-            self.api.create_user_note(self.user, 'Note %d' % i, rand_str(100), self.category)
+        self.api.create_user_notes(self.user, self.category, 10)
 
         data = self.check_data('/api/notes', data={'limit': 5, 'start': 3}, model=models.Note, is_list=True, view='excerpt')
         self.assertEqual(len(data['notes']), 5)
         min_title = min(n['title'] for n in data['notes'])
         self.assertEqual(min_title, 'Note 3')
 
+    def test_multi_get_ok(self):
+        notes = self.api.create_user_notes(self.user, self.category, 3)
+        other_user = self.api.create_user('Slavko Slavkovic')
+        other_note = self.api.create_user_note(other_user, 'Other note', rand_str(10),
+                                               self.api.create_user_category(other_user, 'other'))
+
+        ids = [notes[2]['id'], other_note.id, 172, notes[0]['id']]
+        _, data = self.api.send_request('/api/notes?ids=%s' % ','.join(map(str, ids)))
+        self.assertEqual([note['id'] for note in data['data']['notes']], ids)
+        self.assertTrue(_validate_format(models.Note.document_response('full'), data['data']['notes'][0]))
+        self.assertEqual(data['data']['notes'][1], {'id': other_note.id, 'missing': True})
+        self.assertEqual(data['data']['notes'][2], {'id': 172, 'missing': True})
+
+    def test_multi_get_bad_param(self):
+        self.check_error('/api/notes?ids=1,x', error=BadParameterError)
+        self.check_error('/api/notes?ids=1,,2', error=BadParameterError)
+        self.check_error('/api/notes?ids=%C2%B2', error=BadParameterError)
+        self.check_error('/api/notes?ids=%d' % 10 ** 30, error=BadParameterError)
+        for param in ('start=0', 'limit=5', 'fields=id'):
+            self.check_error('/api/notes?ids=1,2&%s' % param, error=BadParameterError)
+
+    def test_multi_get_documented(self):
+        listing, by_id = JSON([models.Note], view='excerpt', by_id='full').document()['format'].split('Requested by id')
+        self.assertNotIn('content', listing)
+        self.assertIn('content', by_id)
+        self.check_error('/api/notes?ids=%s' % ','.join(map(str, range(1000))), error=BadParameterError)
+
     def test_add_ok(self):
         resp = self.check_success('/api/categories/stuff/notes', 'POST', data={'title': 'Test note', 'content': rand_str(100)}, expected_status=201)
         self.assertIn('Location', resp.headers)
@@ -348,6 +455,29 @@ class CategoryTest(APITest):
     def test_edit_no_parent(self):
         self.check_error('/api/categories/base', 'PUT', data={'parent': 'nonexistent'}, error=DoesNotExistError)
 
+    def test_edit_renamed(self):
+        self.check_success('/api/categories/base')
+        self.check_success('/api/categories/base', 'PUT', data={'name': 'renamed'})
+        self.check_error('/api/categories/base', error=DoesNotExistError)
+        self.check_success('/api/categories/renamed')
+
+    def test_delete_ok(self):
+        self.check_success('/api/categories/base')
+        self.check_success('/api/categories/base', 'DELETE', expected_status=202)
+        self.check_error('/api/categories/base', error=DoesNotExistError)
+
+    def test_delete_frees_name(self):
+        self.api.create_user_category(self.user, 'child', self.category)
+        self.check_success('/api/categories/base', 'DELETE', expected_status=202)
+        self.check_success('/api/categories', 'POST', data={'name': 'base'}, expected_status=201)
+        self.check_success('/api/categories', 'POST', data={'name': 'child', 'parent': 'base'}, expected_status=201)
+        self.check_success('/api/categories/child')
+
+    def test_delete_unauthorized(self):
+        user2 = self.api.create_user('Slavko Slavkovic')
+        self.api.set_user(user2)
+        self.check_error('/api/categories/base', 'DELETE', error=AuthorizationError)
+
     def test_edit_bad_param(self):
         self.check_error('/api/categories/nonexistent', 'PUT', data={'name': rand_str(65)}, error=BadParameterError)
 
@@ -359,6 +489,41 @@ class CategoryTest(APITest):
         data = self.check_data('/api/categories/base/notes', model=models.Note, is_list=True, view='excerpt')
         self.assertEqual(len(data['notes']), 5)
 
+    def test_notes_recursive_ok(self):
+        child = self.api.create_user_category(self.user, 'child', self.category)
+        grandchild = self.api.create_user_category(self.user, 'grandchild', child)
+        self.api.create_user_notes(self.user, self.category, 2)
+        self.api.create_user_notes(self.user, grandchild, 3)
+
+        data = self.check_data('/api/categories/child/notes?recursive=1', model=models.Note, is_list=True, view='excerpt')
+        self.assertEqual(len(data['notes']), 3)
+        data = self.check_data('/api/categories/base/notes?recursive=1', model=models.Note, is_list=True, view='excerpt')
+        self.assertEqual(len(data['notes']), 5)
+
+    def test_notes_recursive_deleted(self):
+        child = self.api.create_user_category(self.user, 'child', self.category)
+        grandchild = self.api.create_user_category(self.user, 'grandchild', child)
+        self.api.create_user_notes(self.user, self.category, 2)
+        self.api.create_user_notes(self.user, child, 1)
+        self.api.create_user_notes(self.user, grandchild, 3)
+
+        self.check_success('/api/categories/child', 'DELETE', expected_status=202)
+        data = self.check_data('/api/categories/base/notes?recursive=1', model=models.Note, is_list=True, view='excerpt')
+        self.assertEqual(len(data['notes']), 2)
+
+    def test_tree_ok(self):
+        self.check_success('/api/categories', 'POST', data={'name': 'child', 'parent': 'base'}, expected_status=201)
+        self.check_success('/api/categories', 'POST', data={'name': 'grandchild', 'parent': 'child'}, expected_status=201)
+        self.api.create_user_category(self.user, 'other')
+        self.api.create_user_category(self.api.create_user('Slavko Slavkovic'), 'foreign')
+
+        resp, data = self.api.send_request('/api/categories/tree')
+        self.assertEqual(resp.status_code, 200)
+        tree = data['data']['categories']
+        self.assertEqual([node['name'] for node in tree], ['base', 'other'])
+        self.assertEqual(tree[0]['children'][0]['name'], 'child')
+        self.assertEqual(tree[0]['children'][0]['children'][0]['name'], 'grandchild')
+
     def test_notes_unauthorized(self):
         user2 = self.api.create_user('Slavko Slavkovic')
         self.api.set_user(user2)
@@ -368,6 +533,1109 @@ class CategoryTest(APITest):
         self.check_error('/api/categories/nonexistent/notes', error=DoesNotExistError)
 
 
+class BoardTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.api.set_user(self.api.create_user('Mirko Mirkovic'))
+        base = self.api.create_user_category(self.api.user, 'base')
+        child = self.api.create_user_category(self.api.user, 'child', base)
+        self.api.create_user_notes(self.api.user, child, 3)
+        self.api.create_user_note(self.api.user, 'Latest', rand_str(10), base)
+
+    def test_board_ok(self):
+        _, data = self.api.send_request('/api/board?recent=2')
+        board = data['data']
+        self.assertEqual(board['profile']['email'], 'mirko.mirkovic@mail.com')
+        self.assertEqual(board['categories'][0]['notes_count'], 1)
+        self.assertEqual(board['categories'][0]['children'][0]['notes_count'], 3)
+        self.assertEqual([note['title'] for note in board['notes']][0], 'Latest')
+        self.assertEqual(len(board['notes']), 2)
+        self.assertEqual(board['token'], models.ChangeLog.latest_token(self.api.user))
+
+    def test_board_queries(self):
+        with mock.patch.object(db, 'execute_sql', wraps=db.execute_sql) as execute_sql:
+            self.check_success('/api/board')
+        self.assertEqual(execute_sql.call_count, 4)
+
+    def test_board_not_modified(self):
+        resp = self.check_success('/api/board')
+        etag = resp.headers['ETag']
+        self.assertIn('private', resp.headers['Cache-Control'])
+
+        resp = self.check_success('/api/board', headers={'If-None-Match': etag}, expected_status=304)
+        self.assertEqual(resp.get_data(), b'')
+        self.check_success('/api/categories/base/notes', 'POST', data={'title': 'New', 'content': 'x'},
+                           expected_status=201)
+        resp = self.check_success('/api/board', headers={'If-None-Match': etag})
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+
+class SyncTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(self.user)
+        self.check_success('/api/categories', 'POST', data={'name': 'base'}, expected_status=201)
+
+    def sync(self, since=0, limit=500):
+        resp, data = self.api.send_request('/api/sync?since=%d&limit=%d' % (since, limit))
+        self.assertEqual(resp.status_code, 200)
+        return data['data']
+
+    def test_sync_ok(self):
+        for i in range(3):
+            self.check_success('/api/categories/base/notes', 'POST', data={'title': 'Note %d' % i, 'content': 'abc'}, expected_status=201)
+
+        data = self.sync()
+        self.assertEqual([c['type'] for c in data['changes']], ['category', 'note', 'note', 'note'])
+        self.assertEqual(data['changes'][1]['object']['title'], 'Note 0')
+        self.assertEqual(data['changes'][1]['object']['category']['name'], 'base')
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.sync(data['next'])['changes'], [])
+
+    def test_sync_changes(self):
+        self.check_success('/api/categories/base/notes', 'POST', data={'title': 'Note', 'content': 'abc'}, expected_status=201)
+        token = self.sync()['next']
+        note_id = models.Note.get().id
+
+        self.check_success('/api/categories/base/notes/%d' % note_id, 'PUT', data={'title': 'Edited'})
+        self.check_success('/api/categories/base/notes/%d' % note_id, 'PUT', data={'content': 'def'})
+        data = self.sync(token)
+        self.assertEqual(len(data['changes']), 1)
+        self.assertEqual(data['changes'][0]['object']['title'], 'Edited')
+
+        self.check_success('/api/categories/base/notes/%d' % note_id, 'DELETE', expected_status=204)
+        data = self.sync(data['next'])
+        self.assertEqual(data['changes'], [{'token': data['next'], 'type': 'note', 'id': note_id,
+                                            'deleted': True, 'object': None}])
+
+    def test_sync_paginate(self):
+        for i in range(4):
+            self.check_success('/api/categories', 'POST', data={'name': 'c%d' % i}, expected_status=201)
+
+        first = self.sync(limit=3)
+        self.assertEqual(len(first['changes']), 3)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['next'], limit=3)
+        self.assertEqual([c['object']['name'] for c in second['changes']], ['c2', 'c3'])
+        self.assertFalse(second['has_more'])
+
+    def test_sync_other_user(self):
+        self.api.set_user(self.api.create_user('Slavko Slavkovic'))
+        self.assertEqual(self.sync()['changes'], [])
+
+
+class EventsTest(APITest):
+    def setUp(self):
+        super().setUp()
+        events.backend.clear()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(self.user)
+        self.check_success('/api/categories', 'POST', data={'name': 'base'}, expected_status=201)
+
+    def test_events_live(self):
+        subscription = events.subscribe(self.user.id)
+        try:
+            self.check_success('/api/categories/base/notes', 'POST', data={'title': 'Note', 'content': 'abc'}, expected_status=201)
+            event = subscription.get(0)
+            self.assertEqual(event.type, 'change')
+            self.assertEqual(event.data, {'type': 'note', 'id': models.Note.get().id, 'deleted': False})
+            self.assertEqual(event.id, models.ChangeLog.latest_token(self.user))
+        finally:
+            subscription.close()
+
+    def test_events_replay(self):
+        token = models.ChangeLog.latest_token(self.user)
+        for i in range(2):
+            self.check_success('/api/categories/base/notes', 'POST', data={'title': 'Note %d' % i, 'content': 'abc'}, expected_status=201)
+
+        resp = self.app.get('/api/events', headers={'Authorization': 'Bearer %s' % self.api.token,
+                                                    'Last-Event-ID': str(token)})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        chunks = iter(resp.response)
+        self.assertTrue(next(chunks).startswith(b'retry: '))
+        replayed = [next(chunks).decode() for _ in range(2)]
+        self.assertTrue(replayed[0].startswith('id: %d\nevent: change\ndata: ' % (token + 1)))
+        self.assertIn('"type": "note"', replayed[1])
+        resp.close()
+        self.assertEqual(events.subscriber_count(self.user.id), 0)
+
+    def test_events_out_of_order(self):
+        broker = EventBroker(heartbeat=60)
+        broker.publish('channel', 'change', {'n': 5}, id=5)
+        subscription = broker.subscribe('channel', last_event_id=4)
+        stream = subscription.stream()
+        next(stream)
+        self.assertTrue(next(stream).startswith('id: 5\n'))
+
+        # Replayed event delivered live too, then concurrent writers' events out of order
+        subscription._push(Event(5, 'change', {'n': 5}))
+        broker.publish('channel', 'change', {'n': 7}, id=7)
+        broker.publish('channel', 'change', {'n': 6}, id=6)
+        self.assertEqual([next(stream).split('\n', 1)[0] for _ in range(2)], ['id: 7', 'id: 6'])
+        stream.close()
+
+    def test_events_heartbeat(self):
+        subscription = EventBroker(heartbeat=0.01).subscribe('channel')
+        stream = subscription.stream()
+        next(stream)
+        self.assertEqual(next(stream), ': heartbeat\n\n')
+        stream.close()
+        self.assertTrue(subscription.closed)
+
+    def test_events_overflow(self):
+        broker = EventBroker(buffer_size=2)
+        subscription = broker.subscribe('channel')
+        for i in range(3):
+            broker.publish('channel', 'change', {'n': i})
+        chunks = list(subscription.stream())
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_events_limit(self):
+        broker = EventBroker(max_subscriptions=2)
+        subscriptions = [broker.subscribe('a'), broker.subscribe('b')]
+        with self.assertRaises(ServiceOverloadedError):
+            broker.subscribe('a')
+        subscriptions[0].close()
+        broker.subscribe('a').close()
+
+        with mock.patch.object(events, 'max_subscriptions', 0):
+            resp = self.app.get('/api/events', headers={'Authorization': 'Bearer %s' % self.api.token})
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn('Retry-After', resp.headers)
+
+    def test_events_close(self):
+        broker = EventBroker(heartbeat=60)
+        chunks = []
+        thread = threading.Thread(target=lambda: chunks.extend(broker.subscribe('channel').stream()))
+        thread.start()
+        while not broker.subscriber_count():
+            time.sleep(0.01)
+        broker.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(broker.subscriber_count(), 0)
+
+
+class CompressionTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(self.user)
+        category = self.api.create_user_category(self.user, 'base')
+        self.api.create_user_notes(self.user, category, 20)
+
+    def get(self, url, accept_encoding):
+        return self.app.get(url, headers={'Authorization': 'Bearer %s' % self.api.token,
+                                          'Accept-Encoding': accept_encoding})
+
+    def test_compress_ok(self):
+        resp = self.get('/api/notes?limit=20', 'br;q=0, gzip')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        data = json.loads(gzip.decompress(resp.get_data()).decode('utf-8'))
+        self.assertEqual(len(data['data']['notes']), 20)
+
+    def test_compress_not_accepted(self):
+        resp = self.get('/api/notes?limit=20', 'identity')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(len(json.loads(resp.get_data(as_text=True))['data']['notes']), 20)
+
+    def test_compress_small(self):
+        resp = self.get('/api/notes?limit=1', 'gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_compress_stream(self):
+        resp = self.get('/api/sync', 'gzip')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        data = json.loads(gzip.decompress(resp.get_data()).decode('utf-8'))
+        self.assertIn('changes', data['data'])
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, br', ['zstd', 'br', 'gzip']), 'br')
+        self.assertEqual(negotiate('br;q=0, *', ['br', 'gzip']), 'gzip')
+        self.assertIsNone(negotiate('', ['gzip']))
+
+    def test_precompressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'docs.html'), 'w') as f:
+                f.write('<html>%s</html>' % ('docs ' * 1000))
+            precompress(os.path.join(directory, 'docs.html'), ['gzip'])
+
+            with base_app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+                resp = send_precompressed(directory, 'docs.html')
+                resp.direct_passthrough = False
+                self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(resp.mimetype, 'text/html')
+                self.assertTrue(gzip.decompress(resp.get_data()).startswith(b'<html>docs'))
+                resp.close()
+            with base_app.test_request_context():
+                resp = send_precompressed(directory, 'docs.html')
+                self.assertNotIn('Content-Encoding', resp.headers)
+                resp.close()
+
+
+class RateLimitTest(APITest):
+    def test_auth_limited(self):
+        for _ in range(base_app.config['RATE_LIMIT_AUTH'][0]):
+            self.check_error('/api/auth', 'POST', data={'email': 'nobody@mail.com', 'password': 'lozinka'}, error=DoesNotExistError)
+        resp = self.check_error('/api/auth', 'POST', data={'email': 'nobody@mail.com', 'password': 'lozinka'}, error=RateLimitExceededError)
+        self.assertGreaterEqual(int(resp.headers['Retry-After']), 1)
+
+    def test_limit_per_user(self):
+        app, east = _east_app(SECRET_KEY='secret')
+        JWT(app, lambda payload: payload['user_id'])
+
+        @east.route(app, '/limited', auth='JWT', rate_limit=RateLimit(2, 60))
+        def limited() -> JSON:
+            return {}
+
+        client = app.test_client()
+        with app.app_context():
+            tokens = [generate_access_token(user_id)['access_token'] for user_id in (1, 2)]
+        statuses = [client.get('/limited', headers={'Authorization': 'Bearer %s' % tokens[i]}).status_code
+                    for i in (0, 0, 0, 1)]
+        self.assertEqual(statuses, [200, 200, 429, 200])
+
+    def test_concurrency_limit(self):
+        app, east = _east_app(EAST_MAX_CONCURRENT_REQUESTS=1)
+        entered, release = threading.Event(), threading.Event()
+
+        @east.route(app, '/slow')
+        def slow() -> JSON:
+            entered.set()
+            release.wait(5)
+            return {}
+
+        thread = threading.Thread(target=app.test_client().get, args=('/slow',))
+        thread.start()
+        entered.wait(5)
+        try:
+            resp = app.test_client().get('/slow')
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(json.loads(resp.get_data(as_text=True))['error']['name'], 'ServiceOverloadedError')
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(app.test_client().get('/slow').status_code, 200)
+
+
+class TransactionTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.flask_app, self.east = _east_app(database=db)
+        self.committed = []
+
+        @self.east.route(self.flask_app, '/write', method='POST', transactional=True)
+        def write(fail: int = 0) -> JSON:
+            models.ChangeLog.record(1, 'note', 1)
+            self.east.on_commit(self.committed.append, 'write')
+            return {'fail': object()} if fail else {}
+
+    def test_commit_ok(self):
+        resp = self.flask_app.test_client().post('/write')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(models.ChangeLog.select().count(), 1)
+        self.assertEqual(self.committed, ['write'])
+
+    def test_rollback_on_serialization_error(self):
+        self.flask_app.register_error_handler(Exception, lambda e: BaseAPIException(str(e)).make_response())
+        resp = self.flask_app.test_client().post('/write', data={'fail': 1})
+        self.assertEqual(resp.status_code, 500)
+        self.assertEqual(models.ChangeLog.select().count(), 0)
+        self.assertEqual(self.committed, [])
+
+    def test_async_not_transactional(self):
+        with self.assertRaises(ValueError):
+            @self.east.route(self.flask_app, '/async', transactional=True)
+            async def write_async() -> JSON:
+                return {}
+
+
+class CoalescingTest(unittest.TestCase):
+    def setUp(self):
+        self.flask_app, self.east = _east_app(EAST_COLLECT_METRICS=True)
+        self.calls, self.entered, self.gate = [], threading.Event(), threading.Event()
+
+        @self.east.route(self.flask_app, '/slow', coalesce=5)
+        def slow(n: int = 0, fail: int = 0) -> JSON:
+            self.calls.append(n)
+            self.entered.set()
+            self.gate.wait(5)
+            if fail:
+                raise DoesNotExistError('Nothing to see.')
+            return {'n': n, 'calls': len(self.calls)}
+
+    def _concurrent(self, urls):
+        responses = [None] * len(urls)
+
+        def get(i):
+            resp = self.flask_app.test_client().get(urls[i])
+            responses[i] = (resp.status_code, resp.get_data(as_text=True))
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(len(urls))]
+        threads[0].start()
+        self.entered.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.2)
+        self.gate.set()
+        for thread in threads:
+            thread.join(5)
+        return responses
+
+    def test_coalesce_ok(self):
+        responses = self._concurrent(['/slow?n=1'] * 3 + ['/slow?n=2'])
+        self.assertEqual(sorted(self.calls), [1, 2])
+        self.assertEqual(len(set(responses[:3])), 1)
+        self.assertEqual(responses[0][0], 200)
+        self.assertIn('east_coalesced_requests_total{route="slow"} 2',
+                      self.flask_app.test_client().get('/metrics').get_data(as_text=True))
+
+    def test_coalesce_error(self):
+        responses = self._concurrent(['/slow?n=1&fail=1'] * 3)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual([status for status, _ in responses], [404] * 3)
+
+    def test_wait_bounded(self):
+        single_flight, gate = SingleFlight(), threading.Event()
+        leader = threading.Thread(target=single_flight.call, args=('key', gate.wait))
+        leader.start()
+        while not len(single_flight):
+            time.sleep(0.01)
+        self.assertEqual(single_flight.call('key', lambda: 'own', timeout=0.05), ('own', False))
+        gate.set()
+        leader.join()
+        self.assertEqual(len(single_flight), 0)
+
+    def test_async_not_coalesced(self):
+        with self.assertRaises(ValueError):
+            @self.east.route(self.flask_app, '/async', coalesce=5)
+            async def read_async() -> JSON:
+                return {}
+
+
+class QueryTimeoutTest(unittest.TestCase):
+    SLOW_SQL = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c'
+
+    def setUp(self):
+        self.database = EastSqliteDatabase(':memory:')
+        self.flask_app, self.east = _east_app(database=self.database, EAST_COLLECT_METRICS=True)
+
+        @self.east.route(self.flask_app, '/slow', query_timeout=0.05)
+        def slow() -> JSON:
+            return {'count': self.database.execute_sql(self.SLOW_SQL).fetchone()[0]}
+
+    def test_deadline_interrupts(self):
+        started = time.monotonic()
+        with self.assertRaises(QueryTimeoutError):
+            with self.database.deadline(0.05):
+                self.database.execute_sql(self.SLOW_SQL).fetchone()
+        self.assertLess(time.monotonic() - started, 1)
+        # Lifted after the deadline, queries run again
+        self.assertEqual(self.database.execute_sql('SELECT 1').fetchone(), (1,))
+
+    def test_deadline_passed(self):
+        with self.assertRaises(QueryTimeoutError):
+            with self.database.deadline(0.01):
+                time.sleep(0.02)
+                self.database.execute_sql('SELECT 1')
+
+    def test_route_timeout(self):
+        client = self.flask_app.test_client()
+        resp = client.get('/slow')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(json.loads(resp.get_data(as_text=True))['error']['name'], 'QueryTimeoutError')
+        self.assertIn('east_query_timeouts_total{route="slow"} 1', client.get('/metrics').get_data(as_text=True))
+
+
+class GroupCommitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = EastSqliteDatabase(os.path.join(self.directory.name, 'writes.db'))
+        self.database.execute_sql('CREATE TABLE item (name TEXT UNIQUE)')
+        self.writer = GroupCommitWriter(self.database)
+
+    def tearDown(self):
+        self.writer.close()
+        self.database.close()
+        self.directory.cleanup()
+
+    def insert(self, name):
+        return self.database.execute_sql('INSERT INTO item VALUES (?)', (name,)).lastrowid
+
+    def test_group_commit_ok(self):
+        futures = [self.writer.submit(self.insert, 'item %d' % i) for i in range(50)]
+        self.assertEqual(sorted(f.result(5) for f in futures), list(range(1, 51)))
+        self.assertEqual(self.database.execute_sql('SELECT COUNT(*) FROM item').fetchone()[0], 50)
+
+    def test_group_commit_error(self):
+        futures = [self.writer.submit(self.insert, name) for name in ('a', 'b', 'a', 'c')]
+        self.assertIsInstance(futures[2].exception(5), IntegrityViolationError)
+        self.assertEqual([f.result(5) for f in (futures[0], futures[1], futures[3])], [1, 2, 3])
+        self.assertEqual(self.writer.call(self.insert, 'd'), 4)
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.database = EastSqliteDatabase(':memory:')
+
+        class Item(models.Model):
+            name = models.CharField()
+            owner = models.IntegerField()
+            deleted = models.BooleanField(default=False)
+
+            class Meta:
+                database = self.database
+                indexes = ((('owner', 'name'), True),)
+
+        class Tag(models.Model):
+            item = models.ForeignKeyField(Item)
+
+            class Meta:
+                database = self.database
+
+        self.models = [Item, Tag]
+
+    def test_ensure_schema_ok(self):
+        self.database.execute_sql('CREATE TABLE item (id INTEGER NOT NULL PRIMARY KEY, '
+                                  'name VARCHAR(255) NOT NULL, owner INTEGER NOT NULL)')
+        self.database.execute_sql("INSERT INTO item (name, owner) VALUES ('old', 1)")
+
+        self.database.ensure_schema(self.models)
+        self.assertEqual(self.database.get_tables(), ['item', 'tag'])
+        self.assertIn('deleted', [c.name for c in self.database.get_columns('item')])
+        self.assertIn('item_owner_name', [i.name for i in self.database.get_indexes('item')])
+        item = self.models[0].get()
+        self.assertEqual((item.name, item.deleted), ('old', False))
+
+        # Up to date schemas are left as they are
+        self.database.ensure_schema(self.models)
+        self.assertEqual(self.models[0].select().count(), 1)
+
+    def test_board_index(self):
+        db.execute_sql('DROP INDEX note__author_id_date_modified')
+        db.ensure_schema(API.MODELS)
+        self.assertIn('note__author_id_date_modified', [i.name for i in db.get_indexes('note')])
+
+        # Recent notes are read in index order instead of being sorted
+        _, sql, params = models.Note.recent_by_author(1, limit=10).bind(models.Note.row_view('excerpt'))
+        plan = ' '.join(row[-1] for row in db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params))
+        self.assertIn('note__author_id_date_modified', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class DeletionTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(self.user)
+        self.base = self.api.create_user_category(self.user, 'base')
+        self.sub = self.api.create_user_category(self.user, 'sub', self.base)
+        self.other = self.api.create_user_category(self.user, 'other')
+        for i in range(7):
+            self.api.create_user_note(self.user, 'Note %d' % i, rand_str(10),
+                                      self.base if i % 2 == 0 else self.sub)
+        self.kept = self.api.create_user_note(self.user, 'Kept', rand_str(10), self.other)
+        self.config = {k: base_app.config[k] for k in ('DELETION_BATCH_SIZE', 'DELETION_PAUSE')}
+        base_app.config.update(DELETION_BATCH_SIZE=3, DELETION_PAUSE=0)
+
+    def tearDown(self):
+        base_app.config.update(self.config)
+        super().tearDown()
+
+    def test_delete_category_ok(self):
+        resp = self.check_success('/api/categories/base', 'DELETE', expected_status=202)
+        location = resp.headers['Location']
+        _, data = self.api.send_request('/api/notes')
+        self.assertEqual([note['id'] for note in data['data']['notes']], [self.kept.id])
+        self.check_error('/api/categories/sub', error=DoesNotExistError)
+        _, data = self.api.send_request(location)
+        self.assertEqual(data['data']['status'], 'queued')
+
+        self.assertEqual(jobs.run_pending(), 1)
+        _, data = self.api.send_request(location)
+        self.assertEqual(data['data']['status'], 'done')
+        self.assertEqual(data['data']['result'], {'notes_deleted': 7, 'categories_deleted': 2})
+        self.assertEqual(models.Note.select().count(), 1)
+        self.assertEqual(models.Category.select().count(), 1)
+        self.assertEqual(models.ChangeLog.select().where(models.ChangeLog.deleted).count(), 9)
+
+    def test_delete_user_ok(self):
+        user2 = self.api.create_user('Slavko Slavkovic')
+        self.api.create_user_note(user2, 'Other', rand_str(10),
+                                  self.api.create_user_category(user2, 'slavko'))
+        models.ChangeLog.backfill()
+        self.check_success('/api/users/self', 'DELETE', expected_status=202)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertFalse(models.User.select().where(models.User.id == self.user.id).exists())
+        for model, owner in [(models.Note, models.Note._author), (models.Category, models.Category.owner),
+                             (models.ChangeLog, models.ChangeLog.owner)]:
+            self.assertEqual(model.select().where(owner == self.user.id).count(), 0)
+            self.assertEqual(model.select().where(owner == user2.id).count(), 1 if model is not models.ChangeLog else 2)
+
+    def test_deletion_unauthorized(self):
+        resp = self.check_success('/api/categories/base', 'DELETE', expected_status=202)
+        self.api.set_user(self.api.create_user('Slavko Slavkovic'))
+        self.check_error(resp.headers['Location'], error=AuthorizationError)
+
+
+class OwnershipTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.other = self.api.create_user('Slavko Slavkovic')
+        category = self.api.create_user_category(self.user, 'base')
+        self.note = self.api.create_user_note(self.user, 'Note', rand_str(10), category)
+
+    def statements(self, fn, *args, **kwargs):
+        """Return the number of statements `fn` executes, and the error it raises"""
+        with mock.patch.object(db, 'execute_sql', wraps=db.execute_sql) as execute_sql:
+            try:
+                fn(*args, **kwargs)
+            except BaseAPIException as e:
+                return execute_sql.call_count, type(e)
+        return execute_sql.call_count, None
+
+    def test_get_owned(self):
+        self.assertEqual(self.statements(models.Note.get_owned, self.note.id, self.user), (1, None))
+        self.assertEqual(self.statements(models.Note.get_owned, self.note.id, self.other.id), (2, AuthorizationError))
+        self.assertEqual(self.statements(models.Note.get_owned, 172, self.user), (2, DoesNotExistError))
+
+    def test_update_owned(self):
+        self.assertEqual(self.statements(models.Note.update_owned, self.note.id, self.user, title='Renamed'), (1, None))
+        self.assertEqual(models.Note.get(models.Note.id == self.note.id).title, 'Renamed')
+        self.assertEqual(self.statements(models.Note.update_owned, self.note.id, self.other, title='Stolen'),
+                         (3, AuthorizationError))
+        self.assertEqual(self.statements(models.Note.update_owned, 172, self.user, title='Missing'),
+                         (3, DoesNotExistError))
+        self.assertEqual(models.Note.get(models.Note.id == self.note.id).title, 'Renamed')
+
+    def test_update_owned_unchanged(self):
+        # MySQL reports no affected rows for updates which change nothing
+        with mock.patch.object(UpdateQuery, 'execute', return_value=0):
+            self.assertEqual(self.statements(models.Note.update_owned, self.note.id, self.user, title='Note'),
+                             (1, None))
+            self.assertEqual(self.statements(models.Note.update_owned, self.note.id, self.other, title='Note'),
+                             (2, AuthorizationError))
+
+    def test_delete_owned(self):
+        self.assertEqual(self.statements(models.Note.delete_owned, self.note.id, self.other), (2, AuthorizationError))
+        self.assertEqual(self.statements(models.Note.delete_owned, self.note.id, self.user), (1, None))
+        self.assertEqual(self.statements(models.Note.delete_owned, self.note.id, self.user), (2, DoesNotExistError))
+
+    def test_delete_queries(self):
+        self.api.set_user(self.user)
+        with mock.patch.object(db, 'execute_sql', wraps=db.execute_sql) as execute_sql:
+            self.check_success('/api/categories/base/notes/%d' % self.note.id, 'DELETE', expected_status=204)
+        # Identity, the note itself and its change log entry - the savepoint
+        # stands in for the route's transaction, within the test's one
+        statements = [args[0] for args, _ in execute_sql.call_args_list if 'SAVEPOINT' not in args[0]]
+        self.assertEqual(len(statements), 3)
+
+
+class QueryTemplateTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.user = self.api.create_user('Mirko Mirkovic')
+        self.category = self.api.create_user_category(self.user, 'base')
+        self.notes = [self.api.create_user_note(self.user, 'Note %d' % i, rand_str(10), self.category)
+                      for i in range(5)]
+
+    def test_template_ok(self):
+        notes = list(models.Note.visible_by_author(self.user, offset=1, limit=2))
+        self.assertEqual([note.id for note in notes], [note.id for note in self.notes[1:3]])
+        self.assertEqual(notes[0]._category.name, 'base')
+        self.assertIs(models.Note.visible_by_author.template.compile(models.Note),
+                      models.Note.visible_by_author.template.compile(models.Note))
+
+    def test_template_get(self):
+        self.assertEqual(models.User.active.get(self.user.id).email, self.user.email)
+        models.User.update(deleted=True).where(models.User.id == self.user.id).execute()
+        with self.assertRaises(models.User.DoesNotExist):
+            models.User.active.get(self.user.id)
+        self.assertIsNone(models.Note.visible.first(self.notes[0].id, self.user.id + 1))
+
+
+class RowModeTest(APITest):
+    def test_rows_match_instances(self):
+        user = self.api.create_user('Mirko Mirkovic')
+        base = self.api.create_user_category(user, 'base')
+        child = self.api.create_user_category(user, 'child', base)
+        for i in range(6):
+            self.api.create_user_note(user, 'Note %d' % i, rand_str(10), base if i % 2 else child)
+
+        notes = models.Note.select().join(models.Category).where(models.Note._author == user)
+        self.assertEqual(models.Note.row_view('excerpt').serialize(notes),
+                         [note.to_jsondict('excerpt') for note in notes])
+        categories = models.Category.visible_by_owner(user)
+        self.assertEqual(models.Category.row_view('extended').serialize(categories),
+                         [category.to_jsondict('extended') for category in categories])
+
+    def test_rows_not_computable(self):
+        with self.assertRaises(ValueError):
+            models.Category.row_view('full')
+
+
+class SparseFieldsTest(APITest):
+    def setUp(self):
+        super().setUp()
+
+        self.api.set_user(self.api.create_user('Mirko Mirkovic'))
+        self.base = self.api.create_user_category(self.api.user, 'base')
+        self.child = self.api.create_user_category(self.api.user, 'child', self.base)
+        self.api.create_user_notes(self.api.user, self.child, 3)
+
+    def test_fields_ok(self):
+        _, data = self.api.send_request('/api/notes?fields=date_modified,id')
+        self.assertEqual(len(data['data']['notes']), 3)
+        self.assertEqual(set(data['data']['notes'][0]), {'id', 'date_modified'})
+        _, data = self.api.send_request('/api/categories?fields=name')
+        self.assertEqual(sorted(data['data']['categories'], key=lambda c: c['name']),
+                         [{'name': 'base'}, {'name': 'child'}])
+        _, data = self.api.send_request('/api/users/self?fields=email')
+        self.assertEqual(data['data'], {'email': 'mirko.mirkovic@mail.com'})
+
+    def test_fields_narrow_query(self):
+        template = models.Category.visible_by_owner.template
+        _, sql, _ = template.compile(models.Category, models.Category.row_view('extended', ('id',)))
+        self.assertNotIn('JOIN', sql)
+        _, sql, _ = template.compile(models.Category, models.Category.row_view('extended'))
+        self.assertIn('LEFT OUTER JOIN', sql)
+        # Inner joins filter rows, and are kept
+        _, sql, _ = models.Note.visible_by_author.template.compile(
+            models.Note, models.Note.row_view('excerpt', ('id',)))
+        self.assertIn('INNER JOIN', sql)
+
+    def test_fields_bad_param(self):
+        self.check_error('/api/notes?fields=id,password_hash', error=BadParameterError)
+        self.check_error('/api/notes?fields=,', error=BadParameterError)
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = EastSqliteDatabase(os.path.join(self.directory.name, 'jobs.db'))
+        self.queue = JobQueue(self.database, poll_interval=0.05, backoff=60)
+        self.database.create_tables([self.queue.model])
+        self.calls = []
+
+        @self.queue.task()
+        def record(value):
+            self.calls.append(value)
+            return value
+
+        @self.queue.task(max_attempts=2)
+        def flaky(failures):
+            self.calls.append(failures)
+            if len(self.calls) <= failures:
+                raise RuntimeError('Attempt %d failed' % len(self.calls))
+
+    def tearDown(self):
+        self.queue.stop()
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_priorities_ok(self):
+        self.queue.enqueue('record', 'low')
+        job = self.queue.enqueue('record', 'high', priority=10)
+        self.assertEqual(self.queue.run_pending(), 2)
+        self.assertEqual(self.calls, ['high', 'low'])
+        job = self.queue.model.get(self.queue.model.id == job.id)
+        self.assertEqual((job.status, job.result()), ('done', 'high'))
+
+    def test_claim_ok(self):
+        Job = self.queue.model
+        with mock.patch.object(self.database, 'begin', wraps=self.database.begin) as begin:
+            self.assertIsNone(self.queue._claim())
+            self.assertEqual(begin.call_count, 0)
+
+            first, second = self.queue.enqueue('record', 1), self.queue.enqueue('record', 2)
+
+            def claimed_by_another_worker(database):
+                if Job.get(Job.id == first.id).status == 'queued':
+                    Job.update(status='running', locked_until=time.time() + 60).where(Job.id == first.id).execute()
+                return write_transaction(database)
+
+            with mock.patch('east.jobs.write_transaction', side_effect=claimed_by_another_worker):
+                job = self.queue._claim()
+            self.assertEqual((job.id, job.status, job.attempts), (second.id, 'running', 1))
+            self.assertEqual(Job.get(Job.id == first.id).attempts, 0)
+            self.assertEqual(begin.call_count, 2)
+
+    def test_lease_lost(self):
+        Job, self.queue.logger = self.queue.model, mock.Mock()
+
+        @self.queue.task()
+        def taken_over():
+            # Lease expired, and another worker claimed the job again
+            job = self.queue.current()
+            Job.update(attempts=job.attempts + 1, locked_until=time.time() + 60).where(Job.id == job.id).execute()
+            self.queue.report(step=1)
+            return 'stale'
+
+        job = self.queue.enqueue('taken_over')
+        self.assertEqual(self.queue.run_pending(), 1)
+        job = Job.get(Job.id == job.id)
+        self.assertEqual((job.status, job.attempts, job.progress(), job.result()), ('running', 2, None, None))
+        self.assertEqual(self.queue.logger.error.call_args[0], ('job_lease_lost',))
+
+    def test_abandoned_failed(self):
+        Job, self.queue.logger = self.queue.model, mock.Mock()
+        job = self.queue.enqueue('record', 1)
+        Job.update(status='running', attempts=job.max_attempts, locked_until=0).execute()
+
+        self.assertEqual(self.queue.run_pending(), 0)
+        self.assertEqual(self.calls, [])
+        job = Job.get(Job.id == job.id)
+        self.assertEqual((job.status, job.attempts, job.locked_until), ('failed', 5, None))
+        self.assertEqual(self.queue.logger.error.call_args[0], ('job_abandoned',))
+
+    def test_retry_backoff(self):
+        job = self.queue.enqueue('flaky', 1)
+        self.assertEqual(self.queue.run_pending(), 1)
+        job = self.queue.model.get(self.queue.model.id == job.id)
+        self.assertEqual((job.status, job.attempts, job.error), ('queued', 1, 'RuntimeError: Attempt 1 failed'))
+        self.assertGreater(job.run_at, time.time() + 30)
+
+        self.queue.model.update(run_at=0).execute()
+        self.assertEqual(self.queue.run_pending(), 1)
+        job = self.queue.model.get(self.queue.model.id == job.id)
+        self.assertEqual((job.status, job.attempts, job.error), ('done', 2, None))
+
+    def test_failed_ok(self):
+        self.queue.backoff = 0
+        job = self.queue.enqueue('flaky', 5)
+        self.assertEqual(self.queue.run_pending(), 2)
+        job = self.queue.model.get(self.queue.model.id == job.id)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_workers_ok(self):
+        self.queue.start()
+        for i in range(10):
+            self.queue.enqueue('record', i)
+        deadline = time.time() + 5
+        while self.queue.model.select().where(self.queue.model.status == 'done').count() < 10:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.calls), list(range(10)))
+
+
+class LoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'requests.log')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_records(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_write_ok(self):
+        logger = StructuredLogger(self.path, flush_interval=0.01)
+        logger.info('started', worker=1)
+        try:
+            raise ValueError('broken')
+        except ValueError as e:
+            logger.error('exception', exc=e, path='/api/notes')
+        logger.flush()
+
+        records = self.read_records()
+        self.assertEqual([(r['event'], r['level']) for r in records], [('started', 'info'), ('exception', 'error')])
+        self.assertEqual(records[0]['worker'], 1)
+        self.assertEqual((records[1]['exception']['type'], records[1]['exception']['message']), ('ValueError', 'broken'))
+        self.assertIn('raise ValueError', records[1]['exception']['traceback'])
+        self.assertEqual((logger.written, logger.dropped), (2, 0))
+
+    def test_sampling_ok(self):
+        logger = StructuredLogger(self.path, flush_interval=0.01, sample_rate=0.5)
+        with mock.patch('east.logger.random.random', side_effect=[0.2, 0.7]):
+            logger.request(path='/kept')
+            logger.request(path='/sampled_out')
+        logger.request(error=True, path='/error')
+        logger.flush()
+        self.assertEqual([r['path'] for r in self.read_records()], ['/kept', '/error'])
+
+    def test_dropped_ok(self):
+        logger = StructuredLogger(self.path, queue_size=2)
+        with mock.patch.object(logger, '_start_writer'):
+            for i in range(5):
+                logger.info('event', n=i)
+        self.assertEqual(logger.dropped, 3)
+
+    def test_dropped_not_captured(self):
+        logger = StructuredLogger(self.path, queue_size=1)
+        with mock.patch.object(logger, '_start_writer'), \
+                mock.patch('east.logger.traceback.TracebackException') as capture:
+            logger.info('event')
+            logger.error('exception', exc=ValueError('broken'))
+        self.assertEqual(logger.dropped, 1)
+        capture.from_exception.assert_not_called()
+
+    def test_exception_released(self):
+        logger = StructuredLogger(self.path)
+        with mock.patch.object(logger, '_start_writer'), mock.patch('linecache.getline') as getline:
+            try:
+                try:
+                    raise KeyError('cause')
+                except KeyError as e:
+                    raise ValueError('broken') from e
+            except ValueError as e:
+                logger.error('exception', exc=e)
+        getline.assert_not_called()
+
+        # No traceback or frame is reachable from the queued record
+        pending, seen = [logger._queue.get_nowait()], set()
+        while pending:
+            obj = pending.pop()
+            if id(obj) in seen or isinstance(obj, type):
+                continue
+            seen.add(id(obj))
+            self.assertNotIsInstance(obj, (types.TracebackType, types.FrameType))
+            pending.extend(gc.get_referents(obj))
+        self.assertGreater(len(seen), 10)
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.flask_app = Flask(__name__)
+
+        @self.flask_app.route('/sleep/<float:seconds>')
+        def sleep(seconds):
+            time.sleep(seconds)
+            return 'ok'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def profile(self, *durations, **options):
+        self.profiler = RequestProfiler(self.flask_app, output_dir=self.directory.name,
+                                        interval=0.005, **options)
+        client = self.flask_app.test_client()
+        for duration in durations:
+            client.get('/sleep/%.2f' % duration)
+
+    def wait_for_profiles(self, count):
+        deadline = time.time() + 5
+        while len(os.listdir(self.directory.name)) < count:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        time.sleep(0.05)
+        return sorted(os.listdir(self.directory.name))
+
+    def test_threshold_ok(self):
+        self.profile(0.0, 0.15, sample_rate=0, threshold=0.1)
+        profiles = self.wait_for_profiles(1)
+        self.assertEqual(len(profiles), 1)
+        self.assertRegex(profiles[0], r'^\d{8}-\d{6}_sleep_user-None_1\d\dms\.collapsed$')
+
+        with open(os.path.join(self.directory.name, profiles[0])) as f:
+            lines = f.read().splitlines()
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn(';sleep (tests.py:', stack)
+
+    def test_sample_rate_ok(self):
+        with mock.patch('east.profiling.random.random', side_effect=[0.7, 0.2]):
+            self.profile(0.05, 0.05, sample_rate=0.5, threshold=10)
+        self.assertEqual(len(self.wait_for_profiles(1)), 1)
+
+
+class PreforkServerTest(unittest.TestCase):
+    def setUp(self):
+        self.flask_app = Flask(__name__)
+        self.broker = EventBroker(heartbeat=60)
+
+        @self.flask_app.route('/pid')
+        def pid():
+            return str(os.getpid())
+
+        @self.flask_app.route('/events')
+        def stream():
+            return Response(self.broker.subscribe('channel').stream(), mimetype='text/event-stream')
+
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.master = None
+
+    def tearDown(self):
+        # Killing the master outright would leave its workers running
+        if self.master is not None and self.master.is_alive():
+            os.kill(self.master.pid, signal.SIGTERM)
+            self.master.join(10)
+
+    def start(self, **options):
+        server = PreforkServer(self.flask_app, host='127.0.0.1', port=self.port,
+                               graceful_timeout=5, worker_shutdown=self.broker.close, **options)
+        self.master = multiprocessing.get_context('fork').Process(target=server.run)
+        self.master.start()
+        deadline = time.time() + 5
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+
+    def get(self, path):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return connection, response
+
+    def get_pid(self):
+        connection, response = self.get('/pid')
+        try:
+            return int(response.read())
+        finally:
+            connection.close()
+
+    def stop(self):
+        started = time.time()
+        os.kill(self.master.pid, signal.SIGTERM)
+        self.master.join(10)
+        self.assertEqual(self.master.exitcode, 0)
+        return time.time() - started
+
+    def test_start_stop(self):
+        self.start(workers=2)
+        pids = {self.get_pid() for _ in range(10)}
+        self.assertTrue(pids)
+        self.assertNotIn(self.master.pid, pids)
+        self.stop()
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+    def test_worker_recycled(self):
+        # The connection made to wait for the server counts too
+        self.start(workers=1, max_requests=3)
+        first = self.get_pid()
+        self.assertEqual(self.get_pid(), first)
+        self.assertNotEqual(self.get_pid(), first)
+        self.stop()
+
+    def test_reload(self):
+        self.start(workers=1)
+        old = self.get_pid()
+        os.kill(self.master.pid, signal.SIGHUP)
+        deadline = time.time() + 5
+        while self.get_pid() == old:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        self.stop()
+
+    def test_streams_ok(self):
+        self.start(workers=1, threads=3)
+        streams = [self.get('/events') for _ in range(2)]
+        for connection, response in streams:
+            self.assertEqual(response.getheader('Content-Type'), 'text/event-stream; charset=utf-8')
+        # Open streams hold threads of their own, the worker serves other requests,
+        # and they are ended when the worker exits
+        self.get_pid()
+        self.assertLess(self.stop(), 3)
+        for connection, response in streams:
+            self.assertTrue(response.read().startswith(b'retry: '))
+            connection.close()
+
+
+class MetricsTest(APITest):
+    def test_metrics_ok(self):
+        user = self.api.create_user('Mirko Mirkovic')
+        self.api.set_user(user)
+        self.check_success('/api/notes')
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('east_requests_total{route="list_all_notes",status="200"}', resp.get_data(as_text=True))
+        self.assertIn('east_db_queries_per_request_count{route="list_all_notes"}', resp.get_data(as_text=True))
+
+    def test_metrics_token(self):
+        app, _ = _east_app(EAST_COLLECT_METRICS=True, EAST_METRICS_TOKEN='scraper')
+        client = app.test_client()
+        for headers in ({}, {'Authorization': 'Bearer other'}, {'Authorization': 'scraper'}):
+            resp = client.get('/metrics', headers=headers)
+            self.assertEqual(resp.status_code, 403)
+            self.assertEqual(json.loads(resp.get_data(as_text=True))['error']['name'], 'AuthorizationError')
+        self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer scraper'}).status_code, 200)
+
+
+class ASGITest(APITest):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.adapter = ASGIAdapter(base_app, pool_size=2)
+
+    def test_async_route(self):
+        status, body = _send_asgi_request(self.adapter, '/api/auth', 'POST', b'email=mirko.mirkovic%40mail.com')
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body.decode())['error']['name'], 'MissingParameterError')
+
+    def test_sync_route(self):
+        status, body = _send_asgi_request(self.adapter, '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn(b'east_requests_total', body)
+
+    def test_context_ident_restored(self):
+        idents = (_request_ctx_stack.__ident_func__, _app_ctx_stack.__ident_func__)
+        _send_asgi_request(self.adapter, '/metrics')
+        self.assertEqual((_request_ctx_stack.__ident_func__, _app_ctx_stack.__ident_func__), idents)
+
+
+@unittest.skipIf(_TEST_DB.mode == 'memory', 'pool threads have in-memory databases of their own')
+class ASGIEndToEndTest(unittest.TestCase):
+    # Blocking calls run on the adapter's pool threads, whose connections
+    # can't see uncommitted rows - fixtures are committed and wiped instead
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.api = _TEST_API
+        cls.adapter = ASGIAdapter(base_app, pool_size=2)
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.api.create_user('Mirko Mirkovic')
+        base_east.rate_limiter.backend.clear()
+
+    def tearDown(self):
+        self.api.clear_user()
+        self.api.clear_db()
+        super().tearDown()
+
+    def test_async_auth(self):
+        status, body = _send_asgi_request(self.adapter, '/api/auth', 'POST',
+                                          b'email=mirko.mirkovic%40mail.com&password=lozinka')
+        self.assertEqual(status, 200)
+        data = json.loads(body.decode())
+        self.assertEqual(data['data']['user_id'], self.user.id)
+        self.assertTrue(_validate_format({'data': {'user_id': 'int', 'access_token': 'string'}}, data))
+
+    def test_sync_route_in_executor(self):
+        self.api.set_user(self.user)
+        with mock.patch.object(self.adapter, '_dispatch', wraps=self.adapter._dispatch) as dispatch:
+            status, body = _send_asgi_request(self.adapter, '/api/users/self',
+                                              headers=[(b'authorization', ('Bearer %s' % self.api.token).encode())])
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.decode())['data']['email'], self.user.email)
+        self.assertEqual(dispatch.call_count, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
 